@@ -0,0 +1,99 @@
+"""Time finding the runs of blocks missing from the cache for a large read.
+
+A 1 GiB read with 4 KiB blocks spans 262144 blocks. httpio used to look
+up every block and run a regular expression over a string of '0's and
+'1's to find the runs missing; the cache now keeps an interval set of
+resident blocks, and the fetches in progress are kept as runs too, so
+the runs to fetch are found in time proportional to their number.
+
+Finding the runs is only part of a read, which still stores, looks up
+and joins every block, so the second part of the benchmark times
+`read()` of a large span end to end against a local server, with a cold
+and then a warm cache.
+
+Run from the top of the source tree with
+``python -m benchmarks.gap_detection``.
+"""
+
+from __future__ import print_function
+
+import re
+import timeit
+
+import httpio
+from httpio import BlockCache
+
+from tests.rangeserver import RangeServer
+
+BLOCKS = 1024 ** 3 // 4096
+
+# The span read end to end, and its block size
+READ_SIZE = 256 * 1024 * 1024
+READ_BLOCK_SIZE = 4096
+
+
+def regex_runs(cache, sector0, sector1):
+    blocks = dict((idx, cache.get(idx)) for idx in range(sector0, sector1))
+    status = "".join("0" if blocks[idx] is None else "1"
+                     for idx in range(sector0, sector1))
+    return [(sector0 + match.start(), sector0 + match.end())
+            for match in re.finditer("0+", status)]
+
+
+def interval_runs(cache, sector0, sector1):
+    return cache.missing(sector0, sector1)
+
+
+def make_cache(resident):
+    cache = BlockCache()
+    block = b""
+    for idx in resident:
+        cache.put(idx, block)
+    return cache
+
+
+SCENARIOS = [
+    ("empty cache", []),
+    ("first half cached", range(BLOCKS // 2)),
+    ("every other 1024 blocks cached",
+     [idx for idx in range(BLOCKS) if idx // 1024 % 2]),
+]
+
+
+def read_end_to_end(number=3):
+    """Return the best times of a cold and of a warm `read()` of
+    `READ_SIZE` bytes"""
+    cold, warm = [], []
+    with RangeServer(bytes(READ_SIZE)) as server:
+        for _ in range(number):
+            with httpio.open(server.url_for('/data'), READ_BLOCK_SIZE) as f:
+                start = timeit.default_timer()
+                f.read(READ_SIZE)
+                cold.append(timeit.default_timer() - start)
+                f.seek(0)
+                start = timeit.default_timer()
+                f.read(READ_SIZE)
+                warm.append(timeit.default_timer() - start)
+    return min(cold), min(warm)
+
+
+def main(number=3):
+    print("Finding missing runs among %d blocks, in isolation" % BLOCKS)
+    for name, resident in SCENARIOS:
+        cache = make_cache(resident)
+        assert (regex_runs(cache, 0, BLOCKS) ==
+                interval_runs(cache, 0, BLOCKS))
+        old = min(timeit.repeat(lambda: regex_runs(cache, 0, BLOCKS),
+                                number=1, repeat=number))
+        new = min(timeit.repeat(lambda: interval_runs(cache, 0, BLOCKS),
+                                number=1, repeat=number))
+        print("%-32s regex %8.2f ms  intervals %8.3f ms  (%.0fx)"
+              % (name, old * 1e3, new * 1e3, old / new))
+
+    cold, warm = read_end_to_end(number)
+    print("read() of %d MiB in %d byte blocks: cold %.0f ms, warm %.0f ms"
+          % (READ_SIZE // 2 ** 20, READ_BLOCK_SIZE, cold * 1e3, warm * 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""Time typical workloads against a local server with a shaped network.
+
+Each workload runs once per block size against a `RangeServer` which
+adds a round-trip time to every response and paces bodies to a
+bandwidth, so that the trade between the number of requests and the
+bytes transferred shows up as it would over a real network:
+
+- ``sequential``: read the whole file in 64 KiB reads
+- ``random``: read 4 KiB at random offsets
+- ``ranges``: read 4 KiB at random offsets with one `read_ranges()`
+  call, using multi-range requests
+- ``zip``: list the members of a zip file with `zipfile`
+- ``footer``: read a length from the last 8 bytes, then the footer it
+  gives, as for Parquet
+- ``async``: read 4 KiB at random offsets from many tasks at once with
+  `AsyncHTTPIOFile`
+
+The results, with the requests and bytes counted by the server and by
+each file's `IOStats`, are written as JSON for regression tracking, and
+summarised as a table on stderr. Run from the top of the source tree with
+``python -m benchmarks.suite``; ``--help`` lists the options.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import random
+import struct
+import sys
+import timeit
+import zipfile
+
+import httpio
+from httpio_async import AsyncHTTPIOFile
+
+from tests.rangeserver import RangeServer
+
+READ_SIZE = 64 * 1024
+RANDOM_READ_SIZE = 4096
+FOOTER_SIZE = 64 * 1024
+
+
+def make_resources(size, members, seed=0):
+    rng = random.Random(seed)
+    data = bytes(bytearray(rng.getrandbits(8) for _ in range(size)))
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_STORED) as zf:
+        member_size = size // members
+        for n in range(members):
+            zf.writestr('member%05d.bin' % n, data[n * member_size:(n + 1) * member_size])
+
+    footer = data[:FOOTER_SIZE]
+    return {
+        '/data': data,
+        '/archive.zip': archive.getvalue(),
+        '/footer': data + footer + struct.pack('<Q', len(footer)),
+    }
+
+
+def sequential(server, block_size, stats, args):
+    with httpio.open(server.url_for('/data'), block_size, stats=stats) as f:
+        while f.read(READ_SIZE):
+            pass
+
+
+def random_reads(server, block_size, stats, args):
+    rng = random.Random(args.seed)
+    with httpio.open(server.url_for('/data'), block_size, stats=stats) as f:
+        for _ in range(args.reads):
+            f.seek(rng.randrange(f.length - RANDOM_READ_SIZE))
+            f.read(RANDOM_READ_SIZE)
+
+
+def ranges(server, block_size, stats, args):
+    rng = random.Random(args.seed)
+    with httpio.open(server.url_for('/data'), block_size, multipart=True, stats=stats) as f:
+        f.read_ranges([(rng.randrange(f.length - RANDOM_READ_SIZE), RANDOM_READ_SIZE)
+                       for _ in range(args.reads)])
+
+
+def zip_listing(server, block_size, stats, args):
+    with httpio.open(server.url_for('/archive.zip'), block_size, stats=stats) as f:
+        zipfile.ZipFile(f).namelist()
+
+
+def footer(server, block_size, stats, args):
+    with httpio.open(server.url_for('/footer'), block_size, stats=stats) as f:
+        f.seek(-8, 2)
+        length, = struct.unpack('<Q', f.read(8))
+        f.seek(-8 - length, 2)
+        assert len(f.read(length)) == length
+
+
+def async_readers(server, block_size, stats, args):
+    async def main():
+        rng = random.Random(args.seed)
+        async with AsyncHTTPIOFile(server.url_for('/data'), block_size, concurrency=args.tasks,
+                                   stats=stats) as f:
+            offsets = [rng.randrange(f.length - RANDOM_READ_SIZE) for _ in range(args.reads)]
+
+            async def reader(offsets):
+                for offset in offsets:
+                    await f.pread(offset, RANDOM_READ_SIZE)
+            await asyncio.gather(*[reader(offsets[n::args.tasks]) for n in range(args.tasks)])
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+
+WORKLOADS = {
+    'sequential': sequential,
+    'random': random_reads,
+    'ranges': ranges,
+    'zip': zip_listing,
+    'footer': footer,
+    'async': async_readers,
+}
+
+
+def run(server, name, block_size, args):
+    """Run one workload `args.repeat` times, returning a result record"""
+    times = []
+    for _ in range(args.repeat):
+        server.reset_counters()
+        stats = httpio.IOStats()
+        start = timeit.default_timer()
+        WORKLOADS[name](server, block_size, stats, args)
+        times.append(timeit.default_timer() - start)
+    return {
+        'workload': name,
+        'block_size': block_size,
+        'seconds': min(times),
+        'times': times,
+        'server_requests': len(server.requests),
+        'server_bytes': server.bytes_sent,
+        'requests': stats.requests,
+        'bytes_fetched': stats.bytes_fetched,
+        'bytes_returned': stats.bytes_returned,
+        'cache_hits': stats.cache_hits,
+        'cache_misses': stats.cache_misses,
+        'latency_p50': stats.latency.percentile(50),
+        'latency_p99': stats.latency.percentile(99),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--workloads', nargs='+', default=sorted(WORKLOADS),
+                        choices=sorted(WORKLOADS))
+    parser.add_argument('--block-sizes', nargs='+', type=int,
+                        default=[-1, 4096, 65536, 1024 * 1024],
+                        help="block sizes to run each workload with; -1 disables caching")
+    parser.add_argument('--rtt', type=float, default=0.02,
+                        help="seconds added to every response (default %(default)s)")
+    parser.add_argument('--bandwidth', type=float, default=100e6,
+                        help="bytes per second per connection; 0 for no limit "
+                             "(default %(default)s)")
+    parser.add_argument('--size', type=int, default=16 * 1024 * 1024,
+                        help="bytes in the file served (default %(default)s)")
+    parser.add_argument('--members', type=int, default=1000,
+                        help="members of the zip file served (default %(default)s)")
+    parser.add_argument('--reads', type=int, default=200,
+                        help="random reads per random workload (default %(default)s)")
+    parser.add_argument('--tasks', type=int, default=8,
+                        help="concurrent readers in the async workload (default %(default)s)")
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=argparse.FileType('w'), default=sys.stdout,
+                        help="where to write the JSON results (default stdout)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    resources = make_resources(args.size, args.members, args.seed)
+    results = []
+    with RangeServer(resources=resources, rtt=args.rtt, bandwidth=args.bandwidth or None) as server:
+        for name in args.workloads:
+            for block_size in args.block_sizes:
+                result = run(server, name, block_size, args)
+                results.append(result)
+                sys.stderr.write("%-10s block_size=%-8d %8.3f s %6d requests %12d bytes\n" % (
+                    name, block_size, result['seconds'], result['server_requests'],
+                    result['server_bytes']))
+
+    config = {key: value for key, value in vars(args).items() if key != 'output'}
+    json.dump({'config': config, 'results': results}, args.output, indent=2)
+    args.output.write('\n')
+
+
+if __name__ == "__main__":
+    main()
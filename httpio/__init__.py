@@ -1,19 +1,60 @@
 from __future__ import absolute_import
 
-import re
 import requests
+import threading
+import time
 
+from bisect import bisect_right
+from concurrent.futures import Future, ThreadPoolExecutor
 from io import BufferedIOBase
 
 from six import PY3
+from six.moves.http_client import IncompleteRead
 from sys import version_info
 
-__all__ = ["open", "HTTPIOError", "HTTPIOFile"]
+from .ranges import (DEFAULT_MAX_GAP, MAX_RANGES_PER_REQUEST, MultipartByteranges,
+                     coalesce, format_range_header, multipart_boundary, parse_content_range,
+                     parse_unsatisfied_range)
+from .cache import (BlockCache, LRUBlockCache, SharedBlockCache, ArenaBlockCache,
+                    DiskBlockCache, get_shared_cache, _RunMap)
+from .session import make_session, get_shared_session
+from .retry import Retry, is_retryable, retry_after
+from .stats import IOStats
+from .adaptive import AdaptiveFetch
+
+__all__ = ["open", "HTTPIOError", "HTTPIOFile", "BlockCache", "LRUBlockCache",
+           "SharedBlockCache", "ArenaBlockCache", "DiskBlockCache", "get_shared_cache",
+           "make_session", "get_shared_session", "Retry", "IOStats", "AdaptiveFetch"]
 
 
 # The expected exception from unimplemented IOBase operations
 IOBaseError = OSError if PY3 else IOError
 
+# The size of the chunks in which streamed response bodies are read
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def _join(pieces):
+    # Cached blocks may be memoryviews, which python 2's join() rejects
+    if PY3:
+        return b"".join(pieces)
+    return b"".join(memoryview(piece).tobytes() for piece in pieces)
+
+
+def _cut_runs(runs, start, data, chunks):
+    """Store in the dict `chunks` the data of each of the `(start, end)`
+    `runs` that lies wholly within `data`, which begins at `start`"""
+    end = start + len(data)
+    for run in runs:
+        if start <= run[0] and run[1] <= end:
+            chunks[run] = data[run[0] - start:run[1] - start]
+
+
+def _without(runs, inflight):
+    """Return the parts of `runs` not being fetched according to the
+    `_RunMap` `inflight`"""
+    return [gap for start, end in runs for gap in inflight.missing(start, end)]
+
 
 def open(url, block_size=-1, **kwargs):
     """
@@ -21,6 +62,62 @@ def open(url, block_size=-1, **kwargs):
 
     :param url: The URL of the file to open
     :param block_size: The cache block size, or `-1` to disable caching.
+    :param cache: The `httpio.BlockCache` to store blocks in, or `None`
+        for an unbounded cache private to the file. Pass
+        `httpio.get_shared_cache()` to share blocks with other files.
+    :param readahead: The largest number of blocks to fetch ahead of
+        sequential reads on a background thread, or `0` to disable
+        read-ahead. Requires a `block_size`.
+    :param multipart: Whether to fetch several missing runs of blocks, or
+        the ranges of `read_ranges()` without caching, in one request with
+        a multi-range `Range` header. If the server does not answer with
+        `multipart/byteranges`, one request per run is made.
+    :param session: The `requests.Session` to make requests with, or `None`
+        for a session private to the file. Pass `httpio.get_shared_session()`
+        or a session from `httpio.make_session()` to reuse connections
+        between files; the file does not close it.
+    :param length: The length of the resource, if already known. No HEAD
+        request is made when it is given.
+    :param etag: The ETag (or Last-Modified date) of the resource, used as
+        its validator when `length` is given.
+    :param lazy: Whether to skip the HEAD request and learn the length
+        from the `Content-Range` header of the first ranged GET instead.
+    :param prefetch_head: The number of bytes at the start of the resource
+        to fetch in place of the HEAD request, for formats with a header.
+    :param prefetch_tail: The number of bytes at the end of the resource
+        to fetch in place of the HEAD request, for formats with a footer
+        such as zip or Parquet. When both are given the two requests are
+        made at once.
+    :param tail_size: The number of bytes at the end of the resource to
+        fetch with one suffix range request, and keep, the first time a
+        read falls within them. Seeking from the end of a file whose
+        length is not yet known fetches the tail the same way, so a
+        trailer is read in one request.
+    :param streaming: Whether to keep the response to a sequential read
+        open, requested to the end of the resource, so that the reads
+        following it take their data straight from the connection. Only
+        applies without a `block_size`.
+    :param retries: The number of times to retry a request that fails
+        with a connection error, a truncated body or a transient status
+        such as 503, or an `httpio.Retry` saying how to retry. Retries
+        wait a jittered backoff time, and a truncated body is resumed
+        from the last byte received.
+    :param stats: The `httpio.IOStats` to count requests, bytes and cache
+        lookups in, or `None` for one private to the file. Either way it
+        is the `stats` attribute of the file.
+    :param adaptive: Whether to choose how much to fetch when a read misses
+        the cache from the pattern of reads and the latency and throughput
+        measured, or an `httpio.AdaptiveFetch` to do so. Sequential reads
+        then fetch ahead in requests that grow with the run of reads, while
+        random reads fetch only the blocks they need. The cache stays
+        aligned to `block_size`, which should be small. Requires a
+        `block_size`.
+    :param coalesce: The largest gap, in bytes, between runs of blocks
+        missing from one read that are still fetched in one request, the
+        cached blocks between them being fetched again. Without caching,
+        each unbuffered read fetches up to this many bytes more and keeps
+        them to serve a following read nearby. It is also the default
+        `max_gap` of `read_ranges()`, if not `0`.
     :param kwargs: Additional arguments to pass to `requests.Request()`
     :return: An `httpio.HTTPIOFile` object supporting most of the usual
         file-like object methods.
@@ -35,17 +132,64 @@ class HTTPIOError(IOBaseError):
 
 
 class SyncHTTPIOFile(BufferedIOBase):
-    def __init__(self, url, block_size=-1, **kwargs):
+    def __init__(self, url, block_size=-1, cache=None, readahead=0, multipart=False,
+                 session=None, length=None, etag=None, lazy=False, prefetch_head=0,
+                 prefetch_tail=0, tail_size=0, streaming=False, retries=0, stats=None,
+                 adaptive=False, coalesce=0, **kwargs):
         super(SyncHTTPIOFile, self).__init__()
         self.url = url
         self.block_size = block_size
+        self.readahead = readahead
+        self.multipart = multipart
+        self.lazy = lazy
+        self.prefetch_head = prefetch_head
+        self.prefetch_tail = prefetch_tail
+        self.tail_size = tail_size
+        self.streaming = streaming
+        self.retries = Retry.from_value(retries)
+        self.stats = IOStats() if stats is None else stats
+        self.adaptive = AdaptiveFetch() if adaptive is True else adaptive or None
+        self.coalesce = coalesce
 
         self._kwargs = kwargs
         self._cursor = 0
-        self._cache = {}
-        self._session = None
+        self._cache = BlockCache() if cache is None else cache
+        # The cache as given, before it is bound to the resource, for the
+        # files made by the asyncio context manager
+        self._given_cache = cache
+        self._session = session
+        self._owns_session = session is None
+        self._opened = False
+
+        # Read-ahead state: where the last read ended, the current window
+        # in blocks, and the runs of blocks being fetched in the background
+        self._last_read_end = 0
+        self._readahead_window = 0
+        self._inflight = _RunMap()
+        self._lock = threading.Lock()
+        self._executor = None
+
+        # The open-ended response sequential reads are streamed from, and
+        # the position of the next byte in its body
+        self._stream = None
+        self._stream_pos = None
+
+        # Whether the server has answered a multi-range request with
+        # multipart/byteranges, or None if it has not been asked yet
+        self._multipart = None
 
         self.length = None
+        self.validator = None
+        self._known = (length, etag)
+
+        # `(start, data)` pairs fetched in place of the HEAD request or as
+        # the tail of the file, which are kept whether or not caching is
+        # enabled
+        self._prefetched = []
+
+        # The `(start, data)` fetched past the end of the last unbuffered
+        # read, when `coalesce` is set
+        self._spill = None
 
         self._closing = False
 
@@ -59,28 +203,107 @@ class SyncHTTPIOFile(BufferedIOBase):
 
     def open(self):
         self._assert_not_closed()
-        if not self._closing and self._session is None:
-            self._session = requests.Session()
-            response = self._session.head(self.url, **self._kwargs)
-            response.raise_for_status()
+        if not self._closing and not self._opened:
+            if self._session is None:
+                self._session = requests.Session()
+            self._opened = True
+            if self._known[0] is not None:
+                self._bind(*self._known)
+            spans = []
+            if self.prefetch_head > 0:
+                spans.append((0, self._align(self.prefetch_head)))
+            if self.prefetch_tail > 0:
+                spans.append((-self.prefetch_tail, None))
+            if spans:
+                self._prefetched = self._map_concurrently(
+                    lambda span: self._probe(*span), spans, len(spans))
+                return
+            if self._known[0] is not None or self.lazy:
+                return
+            response = self._retrying(self._head)
             try:
-                self.length = int(response.headers['Content-Length'])
+                length = int(response.headers['Content-Length'])
             except KeyError:
                 raise HTTPIOError("Server does not report content length")
             if response.headers.get('Accept-Ranges', '').lower() != 'bytes':
                 raise HTTPIOError("Server does not accept 'Range' headers")
+            self._bind(length, response.headers.get('ETag') or
+                       response.headers.get('Last-Modified'))
 
     def close(self):
         self._closing = True
-        self._cache.clear()
-        if self._session is not None:
+        self._cancel_readahead()
+        self._close_stream()
+        self._cache.close()
+        if self._owns_session and self._session is not None:
             self._session.close()
         super(SyncHTTPIOFile, self).close()
 
     def flush(self):
         self._assert_not_closed()
+        # IOBase.close() flushes; that must not empty a shared cache
+        if self._closing:
+            return
         self.open()
+        self._cancel_readahead()
+        self._close_stream()
         self._cache.clear()
+        self._prefetched = []
+        self._spill = None
+
+    def iter_chunks(self, start=0, end=None, chunk_size=STREAM_CHUNK_SIZE):
+        """
+        Stream the file from `start` to `end` with one long-lived request
+
+        Each chunk moves the file position past it, and the blocks streamed
+        are cached if caching is enabled. Seeking elsewhere, or closing the
+        file, abandons the request before the next chunk.
+
+        :param start: The position to stream from.
+        :param end: The position to stream to, or `None` for the end.
+        :param chunk_size: The largest number of bytes in each chunk.
+        :return: An iterator of `bytes` objects.
+        """
+        self._assert_not_closed()
+        self._ensure_length()
+        end = self.length if end is None else min(end, self.length)
+        if start >= end:
+            return
+
+        pos = self._cursor = start
+        buffer, buffer_start = bytearray(), start
+        attempt = 0
+        while True:
+            # A failed request is retried from the last byte received
+            header = ("bytes=%d-" % pos if end == self.length
+                      else format_range_header([(pos, end)]))
+            response = None
+            try:
+                with self.stats.request(self.url, header) as request:
+                    response = self._session.get(self.url, stream=True,
+                                                 **self._request_kwargs(header))
+                    request.first_byte()
+                    response.raise_for_status()
+                    for chunk in response.iter_content(chunk_size):
+                        request.received(len(chunk))
+                        chunk = chunk[:end - pos]
+                        if self.block_size > 0:
+                            buffer += chunk
+                            buffer_start = self._cache_streamed(buffer_start, buffer)
+                        pos += len(chunk)
+                        self._cursor = pos
+                        self.stats.returned(len(chunk))
+                        yield chunk
+                        if pos >= end or self.closed or self._cursor != pos:
+                            return
+                    raise IncompleteRead(b"", end - pos)
+            except Exception as e:
+                if not self._should_retry(attempt, e):
+                    raise
+            finally:
+                if response is not None:
+                    response.close()
+            attempt += 1
 
     def peek(self, size=-1):
         loc = self.tell()
@@ -89,12 +312,140 @@ class SyncHTTPIOFile(BufferedIOBase):
 
         return data
 
+    def pread(self, offset, size=-1):
+        """
+        Read `size` bytes at `offset`, or to the end if `size` is negative,
+        without using or moving the file position
+
+        Once the file is open, this may be called from many threads at
+        once. Blocks another thread is already fetching are waited for
+        rather than fetched again.
+        """
+        self._assert_not_closed()
+        self._ensure_length()
+        end = self._pread_end(offset, size)
+        if end <= offset:
+            return b""
+
+        data = self._read_prefetched(offset, end)
+        if data is None and self.block_size <= 0:
+            data = self._read_spilling(offset, end)
+        elif data is None:
+            data = _join(self._read_blocks(offset, end - offset))
+        self.stats.returned(len(data))
+        return data
+
+    def preadinto(self, b, offset):
+        """
+        Read into the buffer `b` at `offset`, without using or moving the
+        file position, and return the number of bytes read
+
+        Like `pread()`, this may be called from many threads at once.
+        """
+        self._assert_not_closed()
+        self._ensure_length()
+        view = memoryview(b)
+        if PY3:
+            view = view.cast('B')
+        end = self._pread_end(offset, len(view))
+        if end <= offset:
+            return 0
+
+        data = self._read_prefetched(offset, end)
+        if data is not None:
+            view[:end - offset] = data
+            n = end - offset
+        elif self.block_size <= 0 and self.coalesce > 0:
+            data = self._read_spilling(offset, end)
+            n = len(data)
+            view[:n] = data
+        elif self.block_size <= 0:
+            n = self._read_raw_into(offset, end, view[:end - offset])
+        else:
+            n = 0
+            for sector in self._read_blocks(offset, end - offset):
+                view[n:n + len(sector)] = sector
+                n += len(sector)
+        self.stats.returned(n)
+        return n
+
     def read(self, size=-1):
         return self._read_impl(size)
 
     def read1(self, size=-1):
         return self._read_impl(size, 1)
 
+    def read_ranges(self, ranges, max_gap=None, max_workers=8):
+        """
+        Read several byte ranges at once, without moving the file position
+
+        Ranges closer together than `max_gap` bytes are fetched in a single
+        request, and the requests are made concurrently from a pool of
+        threads. If caching is enabled the blocks fetched are cached.
+
+        :param ranges: An iterable of `(offset, length)` pairs.
+        :param max_gap: The largest gap between two ranges that are still
+            fetched in a single request, or `None` for the file's `coalesce`
+            if set, or else `DEFAULT_MAX_GAP`.
+        :param max_workers: The largest number of concurrent requests.
+        :return: A list holding the data of each range in turn.
+        """
+        self._assert_not_closed()
+        self._ensure_length()
+        if max_gap is None:
+            max_gap = self.coalesce or DEFAULT_MAX_GAP
+
+        spans = [(offset, min(offset + length, self.length))
+                 for offset, length in ranges]
+        for start, _ in spans:
+            if not (0 <= start <= self.length):
+                raise HTTPIOError("Invalid argument: offset=%r" % start)
+        wanted = [(start, end) for start, end in spans if start < end]
+
+        if self.block_size <= 0:
+            runs = coalesce(wanted, max_gap)
+            if len(runs) > 1 and self.multipart and self._multipart is not False:
+                chunks = self._read_runs_multi(runs, max_workers)
+            else:
+                chunks = dict(zip(runs, self._map_concurrently(
+                    lambda run: self._read_raw(*run), runs, max_workers)))
+            starts = [run[0] for run in runs]
+            data = []
+            for start, end in spans:
+                if start >= end:
+                    data.append(b"")
+                    continue
+                run = runs[bisect_right(starts, start) - 1]
+                data.append(chunks[run][start - run[0]:end - run[0]])
+            self.stats.returned(sum(len(d) for d in data))
+            return data
+
+        blocks = {}
+        missing = []
+        for sector0, sector1 in coalesce(
+                (start // self.block_size, (end - 1) // self.block_size + 1)
+                for start, end in wanted):
+            found, runs = self._lookup(sector0, sector1)
+            blocks.update(found)
+            missing.extend(runs)
+        blocks.update(self._fetch_runs(coalesce(missing, max_gap // self.block_size),
+                                       max_workers=max_workers))
+
+        data = []
+        for start, end in spans:
+            chunk = []
+            pos = start
+            while pos < end:
+                idx, offset = divmod(pos, self.block_size)
+                piece = blocks[idx][offset:offset + end - pos]
+                if not piece:
+                    break
+                chunk.append(piece)
+                pos += len(piece)
+            data.append(_join(chunk))
+        self.stats.returned(sum(len(d) for d in data))
+        return data
+
     def readable(self):
         return True
 
@@ -111,11 +462,19 @@ class SyncHTTPIOFile(BufferedIOBase):
         elif whence == 1:
             self._cursor += offset
         elif whence == 2:
+            self.open()
+            if self.length is None:
+                # A suffix range fetches the tail without knowing the length
+                self._prefetched.append(self._probe(-max(-offset, self.tail_size, 1)))
             self._cursor = self.length + offset
         else:
             raise HTTPIOError("Invalid argument: whence=%r" % whence)
-        if not (0 <= self._cursor <= self.length):
+        # A lazily opened file checks the position once it knows its length
+        length = self._cursor if self.length is None else self.length
+        if not (0 <= self._cursor <= length):
             raise HTTPIOError("Invalid argument: cursor=%r" % self._cursor)
+        if self._cursor != self._stream_pos:
+            self._close_stream()
         return self._cursor
 
     def seekable(self):
@@ -133,92 +492,623 @@ class SyncHTTPIOFile(BufferedIOBase):
         self._assert_not_closed()
         self.open()
 
+        if self.length is None:
+            data = self._read_first(size)
+            self._cursor += len(data)
+            self.stats.returned(len(data))
+            return data
+
         if size < 1 or self._cursor + size > self.length:
             size = self.length - self._cursor
 
-        if size == 0:
+        if size <= 0:
             return b""
 
-        if self.block_size <= 0:
-            data = self._read_raw(self._cursor, self._cursor + size)
+        data = self._read_prefetched(self._cursor, self._cursor + size)
+        if data is not None:
+            pass
+
+        elif self.block_size <= 0 and self.streaming:
+            buf = bytearray(size)
+            n = self._read_streamed_into(self._cursor, self._cursor + size,
+                                         memoryview(buf))
+            data = bytes(buf[:n])
+
+        elif self.block_size <= 0:
+            data = self._read_spilling(self._cursor, self._cursor + size)
 
         else:
-            data = b''.join(self._read_cached(size,
-                                              max_raw_reads=max_raw_reads))
+            data = _join(self._read_cached(size,
+                                           max_raw_reads=max_raw_reads))
 
         self._cursor += len(data)
+        self.stats.returned(len(data))
         return data
 
     def _readinto_impl(self, b, max_raw_reads=-1):
         self._assert_not_closed()
         self.open()
 
-        size = len(b)
+        view = memoryview(b)
+        if PY3:
+            view = view.cast('B')
+
+        size = len(view)
+        if size == 0:
+            return 0
+
+        if self.length is None:
+            data = self._read_first(size)
+            view[:len(data)] = data
+            self._cursor += len(data)
+            self.stats.returned(len(data))
+            return len(data)
 
         if self._cursor + size > self.length:
             size = self.length - self._cursor
 
-        if size == 0:
+        if size <= 0:
             return 0
 
-        if self.block_size <= 0:
-            b[:size] = self._read_raw(self._cursor, self._cursor + size)
-            return size
+        data = self._read_prefetched(self._cursor, self._cursor + size)
+        if data is not None:
+            view[:size] = data
+            n = size
+
+        elif self.block_size <= 0 and self.streaming:
+            n = self._read_streamed_into(self._cursor, self._cursor + size,
+                                         view[:size])
+
+        elif self.block_size <= 0 and self.coalesce > 0:
+            data = self._read_spilling(self._cursor, self._cursor + size)
+            n = len(data)
+            view[:n] = data
+
+        elif self.block_size <= 0:
+            n = self._read_raw_into(self._cursor, self._cursor + size,
+                                    view[:size])
 
         else:
             n = 0
             for sector in self._read_cached(size,
                                             max_raw_reads=max_raw_reads):
-                b[n:n+len(sector)] = sector
+                view[n:n+len(sector)] = sector
                 n += len(sector)
 
-            return n
+        self._cursor += n
+        self.stats.returned(n)
+        return n
+
+    def _bind(self, length, validator):
+        """Record the length and validator of the resource, and bind the
+        cache to this version of it"""
+        self.length = length
+        self.validator = validator
+        self._cache = self._cache.bind(self.url, self.validator,
+                                       self.block_size, self.length)
+        self.stats.cache = self._cache
+
+    def _ensure_length(self):
+        """Open the file, and learn its length if it was opened lazily by
+        fetching the block (or byte) at the current position"""
+        self.open()
+        if self.length is None:
+            start = self._cursor - self._cursor % max(self.block_size, 1)
+            self._probe(start, self._align(start + 1))
+
+    def _align(self, end):
+        """Round `end` up to a block boundary if caching is enabled"""
+        if self.block_size <= 0:
+            return end
+        return -(-end // self.block_size) * self.block_size
+
+    def _read_first(self, size):
+        """Read `size` bytes, or to the end if `size` is negative, from a
+        file opened lazily, learning its length from the response"""
+        start = self._cursor - self._cursor % max(self.block_size, 1)
+        end = self._align(self._cursor + size) if size > 0 else None
+        start, data = self._probe(start, end)
+        offset = self._cursor - start
+        return data[offset:offset + size if size > 0 else None]
+
+    def _read_prefetched(self, start, end):
+        """Return `[start, end)` if it lies within data fetched at open, the
+        tail of the file or the bytes kept after the last unbuffered read,
+        fetching the tail if need be, or `None`"""
+        spill = self._spill
+        for span_start, data in self._prefetched + ([spill] if spill else []):
+            if span_start <= start and end <= span_start + len(data):
+                return data[start - span_start:end - span_start]
+        if self.tail_size > 0 and start >= self.length - self.tail_size:
+            span_start, data = self._probe(-self.tail_size)
+            self._prefetched.append((span_start, data))
+            return data[start - span_start:end - span_start]
+        return None
+
+    def _probe(self, start, end=None):
+        """
+        Fetch from `start` to `end`, or to the end if `end` is `None`, with
+        a ranged GET, taking the length and validator of the resource from
+        the response in place of a HEAD request. A negative `start` asks
+        for that many bytes from the end.
+
+        :return: A `(start, data)` pair; the data is cached if caching is
+            enabled.
+        """
+        start, data, length, validator = self._retrying(self._get_span, start, end)
+        with self._lock:
+            if self.length is None:
+                self._bind(length, self._known[1] or validator)
+        if self.block_size > 0:
+            self._store_blocks(start, data)
+        return start, data
+
+    def _get_span(self, start, end):
+        """Make the request for `_probe()`, returning the start and data of
+        the span sent, and the length and validator of the resource"""
+        if start < 0:
+            header = "bytes=%d" % start
+        elif end is None:
+            header = "bytes=%d-" % start
+        else:
+            header = format_range_header([(start, end)])
+        with self.stats.request(self.url, header) as request:
+            response = self._session.get(self.url, **self._request_kwargs(header))
+            request.first_byte()
+            content_range = response.headers.get('Content-Range')
+            if response.status_code == 416:
+                # The range starts at or past the end, as for an empty file
+                length = parse_unsatisfied_range(content_range)
+                start, data = max(start, 0), b""
+            else:
+                response.raise_for_status()
+                span = parse_content_range(content_range)
+                if (response.status_code != 206 or span is None or
+                        (start >= 0 and span[0] != start)):
+                    raise HTTPIOError("Server does not accept 'Range' headers")
+                start, length = span[0], span[2]
+                data = response.content
+                request.received(len(data))
+        if length is None:
+            raise HTTPIOError("Server does not report content length")
+        return (start, data, length,
+                response.headers.get('ETag') or response.headers.get('Last-Modified'))
+
+    def _cache_streamed(self, start, buffer):
+        """Cache the whole blocks at the front of `buffer`, which holds data
+        streamed from `start`, returning where the data left in it starts"""
+        blocks = self._store_blocks(start, bytes(buffer))
+        if not blocks:
+            return start
+        end = min((max(blocks) + 1) * self.block_size, self.length)
+        del buffer[:end - start]
+        return end
+
+    def _pread_end(self, offset, size):
+        if offset < 0:
+            raise HTTPIOError("Invalid argument: offset=%r" % offset)
+        return self.length if size < 0 else min(offset + size, self.length)
 
     def _read_cached(self, size, max_raw_reads=-1):
-        sector0, offset0 = divmod(self._cursor, self.block_size)
-        sector1, offset1 = divmod(self._cursor + size - 1, self.block_size)
+        fetch_size = size
+        if self.adaptive is not None:
+            self.adaptive.record_read(self._cursor, self._cursor + size)
+            fetch_size = self.adaptive.fetch_size(size)
+        data = self._read_blocks(self._cursor, size, max_raw_reads, fetch_size)
+
+        if self.readahead > 0:
+            sequential = self._cursor == self._last_read_end
+            self._last_read_end = self._cursor + sum(len(d) for d in data)
+            self._schedule_readahead(self._cursor // self.block_size,
+                                     (self._cursor + size - 1) // self.block_size + 1,
+                                     sequential)
+
+        return data
+
+    def _read_blocks(self, position, size, max_raw_reads=-1, fetch_size=None):
+        """Return the sectors of the `size` bytes at `position`, fetching
+        up to `fetch_size` bytes from there if the last is missing"""
+        sector0, offset0 = divmod(position, self.block_size)
+        sector1, offset1 = divmod(position + size - 1, self.block_size)
         offset1 += 1
         sector1 += 1
 
-        # Fetch any sectors missing from the cache
-        status = "".join(str(int(idx in self._cache))
-                         for idx in range(sector0, sector1))
-        raw_reads = 0
-        for match in re.finditer("0+", status):
-            if max_raw_reads >= 0 and raw_reads >= max_raw_reads:
-                break
+        # Look up every cached sector up front, so that blocks fetched
+        # below cannot evict ones we have already found
+        blocks, runs = self._lookup(sector0, sector1)
+        if fetch_size is not None and fetch_size > size:
+            runs = self._extend_runs(runs, sector1, position + fetch_size)
+        if self.coalesce > 0:
+            runs = coalesce(runs, self.coalesce // self.block_size)
 
-            data = self._read_raw(
-                self.block_size * (sector0 + match.start()),
-                self.block_size * (sector0 + match.end()))
-            raw_reads += 1
-
-            for idx in range(match.end() - match.start()):
-                self._cache[sector0 + idx + match.start()] = data[
-                    self.block_size * idx:
-                    self.block_size * (idx + 1)]
+        # Fetch any sectors missing from the cache
+        blocks.update(self._fetch_runs(runs, max_raw_reads))
 
         data = []
         for idx in range(sector0, sector1):
-            if idx not in self._cache:
+            if idx not in blocks:
                 break
 
             start = offset0 if idx == sector0 else None
             end = offset1 if idx == (sector1 - 1) else None
-            data.append(self._cache[idx][start:end])
+            data.append(blocks[idx][start:end])
+        return data
+
+    def _extend_runs(self, runs, sector1, end):
+        """Extend the last of `runs`, if it ends at `sector1`, over the
+        blocks missing from there to the one holding byte `end - 1`"""
+        if not runs or runs[-1][1] != sector1:
+            return runs
+        stop = min(-(-end // self.block_size), -(-self.length // self.block_size))
+        more = self._cache.missing(sector1, stop, record=False)
+        if more and more[0][0] == sector1:
+            runs = runs[:-1] + [(runs[-1][0], more[0][1])]
+        return runs
+
+    def _schedule_readahead(self, sector0, sector1, sequential):
+        # Like the kernel's read-ahead, the window starts at twice the
+        # size of the first sequential read and doubles on every
+        # further sequential read, up to `readahead` blocks
+        if not sequential:
+            self._readahead_window = 0
+            return
+        self._readahead_window = min(
+            self.readahead,
+            max(2 * self._readahead_window, 2 * (sector1 - sector0)))
+
+        stop = min(sector1 + self._readahead_window,
+                   -(-self.length // self.block_size))
+        with self._lock:
+            runs = _without(self._cache.missing(sector1, stop, record=False),
+                            self._inflight)
+            for start, end in runs:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=1)
+                future = self._executor.submit(self._fetch_blocks, start, end)
+                self._inflight.assign(start, end, future)
+
+    def _lookup(self, sector0, sector1):
+        """Return the cached blocks in `[sector0, sector1)` and the runs of
+        blocks missing from the cache"""
+        runs = self._cache.missing(sector0, sector1)
+        blocks = {}
+        evicted = []
+        pos = sector0
+        for start, end in runs + [(sector1, sector1)]:
+            for idx in range(pos, start):
+                block = self._cache.get(idx)
+                if block is None:
+                    # Evicted by another reader of a shared cache
+                    evicted.append((idx, idx + 1))
+                else:
+                    blocks[idx] = block
+            pos = end
+        if evicted:
+            runs = coalesce(runs + evicted)
+        self.stats.looked_up(self.url, len(blocks), runs)
+        return blocks, runs
+
+    def _fetch_runs(self, runs, max_raw_reads=-1, max_workers=1):
+        """
+        Fetch the given runs of blocks and return them
+
+        Blocks already being fetched, by read-ahead or by another thread,
+        are waited for rather than fetched again; the rest are registered
+        in `_inflight` while this thread fetches them, so that others wait
+        for it in turn.
+        """
+        with self._lock:
+            others = [run for start, end in runs
+                      for run in self._inflight.overlapping(start, end)]
+            mine = _without(runs, self._inflight)
+            if max_raw_reads >= 0:
+                mine = mine[:max_raw_reads]
+            future = Future()
+            for start, end in mine:
+                self._inflight.assign(start, end, future)
+
+        blocks = {}
+        try:
+            if len(mine) > 1 and self.multipart and self._multipart is not False:
+                blocks.update(self._fetch_blocks_multi(mine))
+            else:
+                for fetched in self._map_concurrently(
+                        lambda run: self._fetch_blocks(*run), mine, max_workers):
+                    blocks.update(fetched)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(blocks)
+        finally:
+            with self._lock:
+                for start, end in mine:
+                    self._inflight.discard(start, end, future)
+
+        for start, end, other in others:
+            try:
+                blocks.update(other.result())
+            except Exception:
+                # Fetch what another fetch failed (or was cancelled) to get
+                if max_raw_reads < 0:
+                    blocks.update(self._fetch_blocks(start, end))
+        return blocks
 
+    def _fetch_blocks(self, sector0, sector1):
+        try:
+            # The run is read into one slab, and the blocks cached are
+            # views of it, so the data is not copied again
+            start = self.block_size * sector0
+            end = min(self.block_size * sector1, self.length)
+            slab = memoryview(bytearray(end - start))
+            slab = slab[:self._read_raw_into(start, end, slab)]
+            blocks = {}
+            for idx in range(sector1 - sector0):
+                block = slab[self.block_size * idx:
+                             self.block_size * (idx + 1)]
+                if not len(block):
+                    break
+                blocks[sector0 + idx] = block
+                self._cache.put(sector0 + idx, block)
+            return blocks
+        finally:
+            with self._lock:
+                self._inflight.discard(sector0, sector1)
+
+    def _fetch_blocks_multi(self, runs):
+        """Fetch several runs of blocks with multi-range requests, falling
+        back to one request per run for any blocks not returned"""
+        blocks = {}
+        for i in range(0, len(runs), MAX_RANGES_PER_REQUEST):
+            spans = [(self.block_size * start,
+                      min(self.block_size * end, self.length))
+                     for start, end in runs[i:i + MAX_RANGES_PER_REQUEST]]
+            try:
+                for start, data in self._read_raw_multi(spans):
+                    blocks.update(self._store_blocks(start, data))
+            except Exception as e:
+                # The runs not yet received are retried one at a time
+                if self.retries.total <= 0 or not is_retryable(e, self.retries):
+                    raise
+
+        for start, end in runs:
+            if any(idx not in blocks for idx in range(start, end)):
+                blocks.update(self._fetch_blocks(start, end))
+        return blocks
+
+    def _read_runs_multi(self, runs, max_workers):
+        """Read several runs of bytes with multi-range requests, falling
+        back to one request per run for any not returned, and return a
+        dict of the data of each run"""
+        chunks = {}
+        for i in range(0, len(runs), MAX_RANGES_PER_REQUEST):
+            spans = runs[i:i + MAX_RANGES_PER_REQUEST]
+            try:
+                for start, data in self._read_raw_multi(spans):
+                    _cut_runs(spans, start, data, chunks)
+            except Exception as e:
+                # The runs not yet received are retried one at a time
+                if self.retries.total <= 0 or not is_retryable(e, self.retries):
+                    raise
+
+        missing = [run for run in runs if run not in chunks]
+        chunks.update(zip(missing, self._map_concurrently(
+            lambda run: self._read_raw(*run), missing, max_workers)))
+        return chunks
+
+    def _store_blocks(self, start, data):
+        """Cache every whole block within `data`, which begins at `start`"""
+        blocks = {}
+        idx = -(-start // self.block_size)
+        while idx * self.block_size < self.length:
+            block_start = idx * self.block_size
+            block_end = min(block_start + self.block_size, self.length)
+            if block_end > start + len(data):
+                break
+            blocks[idx] = data[block_start - start:block_end - start]
+            self._cache.put(idx, blocks[idx])
+            idx += 1
+        return blocks
+
+    def _cancel_readahead(self):
+        with self._lock:
+            futures = set(self._inflight.values())
+        for future in futures:
+            future.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._inflight.clear()
+        self._readahead_window = 0
+
+    def _read_spilling(self, start, end):
+        """Read `[start, end)` unbuffered, fetching up to `coalesce` bytes
+        more in the same request and keeping them for a following read"""
+        stop = min(end + self.coalesce, self.length)
+        data = self._read_raw(start, stop)
+        if len(data) > end - start:
+            self._spill = (end, data[end - start:])
+            data = data[:end - start]
         return data
 
     def _read_raw(self, start, end):
-        headers = {"Range": "bytes=%d-%d" % (start, end - 1)}
+        buffer = bytearray(end - start)
+        del buffer[self._read_raw_into(start, end, memoryview(buffer)):]
+        return bytes(buffer)
+
+    def _read_raw_into(self, start, end, view):
+        """Read from `start` to `end` straight into the writable memoryview
+        `view`, returning the number of bytes read. A failed request is
+        retried, resuming from the last byte received."""
+        n = 0
+        attempt = 0
+        while True:
+            received = n
+            header = format_range_header([(start + n, end)])
+            try:
+                with self.stats.request(self.url, header) as request:
+                    response = self._session.get(self.url, stream=True,
+                                                 **self._request_kwargs(header))
+                    request.first_byte()
+                    try:
+                        response.raise_for_status()
+                        while n < len(view):
+                            count = response.raw.readinto(view[n:])
+                            if not count:
+                                break
+                            n += count
+                    finally:
+                        request.received(n - received)
+                        response.close()
+                if self.adaptive is not None:
+                    self.adaptive.record_request(request.nbytes, request.latency, request.ttfb)
+                if n == len(view) or start + n >= self.length:
+                    return n
+                raise IncompleteRead(view[received:n].tobytes(), len(view) - n)
+            except Exception as e:
+                if not self._should_retry(attempt, e):
+                    raise
+            attempt += 1
+
+    def _retrying(self, fn, *args):
+        """Call `fn` with `args`, retrying while it fails with errors that
+        may be retried"""
+        attempt = 0
+        while True:
+            try:
+                return fn(*args)
+            except Exception as e:
+                if not self._should_retry(attempt, e):
+                    raise
+            attempt += 1
+
+    def _should_retry(self, attempt, error):
+        """Return whether to retry after failure number `attempt`, counting
+        from zero, with `error`, having waited the backoff time if so"""
+        if attempt >= self.retries.total or not is_retryable(error, self.retries):
+            return False
+        time.sleep(self.retries.delay(attempt, retry_after(error)))
+        self.stats.retried()
+        return True
+
+    def _head(self):
+        with self.stats.request(self.url, None) as request:
+            response = self._session.head(self.url, **self._kwargs)
+            request.first_byte()
+            response.raise_for_status()
+            return response
+
+    def _read_streamed_into(self, start, end, view):
+        """Like `_read_raw_into()`, but a read that follows on from the last
+        is taken from the open-ended response kept open for it"""
+        sequential = start == self._last_read_end
+        self._last_read_end = end
+        if self._stream is None or self._stream_pos != start:
+            self._close_stream()
+            if not sequential:
+                return self._read_raw_into(start, end, view)
+            header = "bytes=%d-" % start
+            try:
+                with self.stats.request(self.url, header) as request:
+                    response = self._session.get(self.url, stream=True,
+                                                 **self._request_kwargs(header))
+                    request.first_byte()
+                    try:
+                        response.raise_for_status()
+                    except Exception:
+                        response.close()
+                        raise
+            except Exception as e:
+                if self.retries.total <= 0 or not is_retryable(e, self.retries):
+                    raise
+                # Read this span alone, with retries; the next read opens
+                # the stream again
+                return self._read_raw_into(start, end, view)
+            self._stream, self._stream_pos = response, start
+
+        n = 0
+        try:
+            while n < len(view):
+                count = self._stream.raw.readinto(view[n:])
+                if not count:
+                    break
+                n += count
+        except Exception as e:
+            self.stats.fetched(n)
+            self._close_stream()
+            if self.retries.total <= 0 or not is_retryable(e, self.retries):
+                raise
+            return n + self._read_raw_into(start + n, end, view[n:])
+        self.stats.fetched(n)
+        self._stream_pos += n
+        if n < len(view) or self._stream_pos >= self.length:
+            self._close_stream()
+        if n < len(view) and start + n < self.length:
+            # The stream ended early; request the rest of the span alone
+            return n + self._read_raw_into(start + n, end, view[n:])
+        return n
+
+    def _close_stream(self):
+        if self._stream is not None:
+            self._stream.close()
+        self._stream = self._stream_pos = None
+
+    def _read_raw_multi(self, spans):
+        """Request several spans at once, yielding `(start, data)` pairs as
+        they arrive. The pairs cover whatever the server chose to send."""
+        header = format_range_header(spans)
+        with self.stats.request(self.url, header) as request:
+            response = self._session.get(self.url, stream=True,
+                                         **self._request_kwargs(header))
+            request.first_byte()
+            try:
+                response.raise_for_status()
+                chunks = self._counted(request, response.iter_content(
+                    chunk_size=STREAM_CHUNK_SIZE))
+                boundary = multipart_boundary(response.headers.get('Content-Type'))
+
+                if response.status_code == 206 and boundary is not None:
+                    self._multipart = True
+                    parser = MultipartByteranges(boundary)
+                    for chunk in chunks:
+                        for part in parser.feed(chunk):
+                            yield part
+                        if parser.done:
+                            break
+                    return
+
+                self._multipart = False
+                if response.status_code == 206:
+                    span = parse_content_range(response.headers.get('Content-Range'))
+                    if span is None:
+                        raise HTTPIOError("Server sent an invalid Content-Range")
+                    yield span[0], b"".join(chunks)
+                # Otherwise the server sent the whole resource, which may be
+                # far larger than the spans; nothing is read from it, and
+                # the runs are fetched one request at a time instead
+            finally:
+                response.close()
+
+    @staticmethod
+    def _counted(request, chunks):
+        for chunk in chunks:
+            request.received(len(chunk))
+            yield chunk
+
+    def _request_kwargs(self, range_header):
+        # Ranges of an encoded body are ranges of the encoding, so ask
+        # for the identity encoding unless the caller says otherwise
+        headers = {"Range": range_header, "Accept-Encoding": "identity"}
         headers.update(self._kwargs.get("headers", {}))
         kwargs = dict(self._kwargs)
         kwargs['headers'] = headers
-        response = self._session.get(
-            self.url,
-            **kwargs)
-        response.raise_for_status()
-        return response.content
+        return kwargs
+
+    def _map_concurrently(self, fn, items, max_workers):
+        if len(items) <= 1 or max_workers <= 1:
+            return [fn(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+            return list(pool.map(fn, items))
 
     def _assert_not_closed(self):
         if self.closed:
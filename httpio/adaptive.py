@@ -0,0 +1,95 @@
+"""Adaptive fetch sizes.
+
+A file's `block_size` fixes how its cache is aligned, but the best amount
+to fetch in one request depends on how the file is read and on the
+network: each request costs a round trip, and each byte fetched but
+never read costs transfer time. `AdaptiveFetch` watches the reads made
+and the requests they cause, and chooses how much to fetch when a read
+misses the cache.
+"""
+
+from __future__ import absolute_import
+
+import threading
+
+from collections import deque
+
+__all__ = ["AdaptiveFetch"]
+
+
+# The most bytes fetched by one request, by default
+DEFAULT_MAX_FETCH_SIZE = 16 * 1024 * 1024
+
+# Sequential reads fetch enough that transferring the body takes this many
+# times the latency, so that the round trip is a fifth of each request
+LATENCY_FACTOR = 4
+
+# The weight of each new measurement in the moving averages
+SMOOTHING = 0.3
+
+# Bodies shorter than this are sent too quickly to measure throughput by
+MIN_THROUGHPUT_SAMPLE = 64 * 1024
+
+
+def _average(old, new):
+    return new if old is None else old + SMOOTHING * (new - old)
+
+
+class AdaptiveFetch(object):
+    """
+    Chooses how many bytes to fetch when a read misses the cache
+
+    Reads are sequential when most of the last `history` reads started
+    where the one before ended. A random read fetches only the blocks it
+    needs, as anything more would likely be wasted. A sequential read
+    fetches ahead: enough that the round trip is a small part of the
+    request, given the latency and throughput measured so far, but at most
+    twice the length of the current sequential run, so that little is
+    wasted when the run ends.
+
+    :param max_size: The most bytes to fetch in one request.
+    :param history: The number of recent reads to classify access by.
+    """
+    def __init__(self, max_size=DEFAULT_MAX_FETCH_SIZE, history=8):
+        self.max_size = max_size
+        self.latency = None
+        self.throughput = None
+        self._sequential = deque(maxlen=history)
+        self._last_end = None
+        self._run = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<%s sequential=%r latency=%r throughput=%r>" % (
+            type(self).__name__, self.sequential, self.latency, self.throughput)
+
+    @property
+    def sequential(self):
+        return 2 * sum(self._sequential) > len(self._sequential)
+
+    def record_read(self, start, end):
+        """Note a read of the bytes `[start, end)`"""
+        with self._lock:
+            sequential = start == self._last_end
+            self._sequential.append(sequential)
+            self._run = self._run + end - start if sequential else end - start
+            self._last_end = end
+
+    def record_request(self, nbytes, latency, ttfb):
+        """Note a request which took `latency` seconds, `ttfb` of them
+        before the response began, to fetch `nbytes` bytes"""
+        with self._lock:
+            self.latency = _average(self.latency, ttfb)
+            if nbytes >= MIN_THROUGHPUT_SAMPLE and latency > ttfb:
+                self.throughput = _average(self.throughput, nbytes / (latency - ttfb))
+
+    def fetch_size(self, size):
+        """Return the number of bytes to fetch for a read of `size` bytes
+        which misses the cache"""
+        with self._lock:
+            if not self.sequential:
+                return size
+            target = 2 * self._run
+            if self.latency is not None and self.throughput is not None:
+                target = min(target, LATENCY_FACTOR * self.latency * self.throughput)
+            return int(max(size, min(target, self.max_size)))
@@ -0,0 +1,779 @@
+"""Block caches for httpio file objects.
+
+A block cache maps block indices to the bytes of that block. The file
+objects in `httpio` and `httpio_async` look blocks up with `get()` and
+store freshly fetched blocks with `put()`, so any object implementing
+the interface of `BlockCache` can be passed as the `cache` argument of
+`httpio.open()` or `httpio_async.open()`.
+
+Once a file has been opened it calls `bind()` on its cache with the
+URL, the validator (ETag or Last-Modified) reported by the server, the
+block size and the length. Caches private to one file simply return
+themselves; `SharedBlockCache` returns a view onto the part of the
+cache belonging to that version of that URL, which is how several files
+share blocks, and `DiskBlockCache` returns a file on disk.
+"""
+
+from __future__ import absolute_import
+
+import hashlib
+import json
+import mmap
+import os
+import threading
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from six import PY3
+
+__all__ = ["BlockCache", "LRUBlockCache", "SharedBlockCache",
+           "ArenaBlockCache", "DiskBlockCache", "get_shared_cache"]
+
+
+# The default budget of the process-wide cache returned by
+# get_shared_cache()
+DEFAULT_SHARED_CACHE_SIZE = 64 * 1024 * 1024
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_shared_cache():
+    """
+    Return the process-wide `SharedBlockCache`, creating it if necessary
+
+    The cache is bounded to `DEFAULT_SHARED_CACHE_SIZE` bytes; assign to
+    its `max_bytes` attribute to change the budget.
+    """
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = SharedBlockCache(
+                max_bytes=DEFAULT_SHARED_CACHE_SIZE)
+        return _shared_cache
+
+
+class _IntervalSet(object):
+    """A set of integers stored as sorted, disjoint `[start, end)` intervals,
+    so that the runs missing from a range are found in time proportional
+    to their number rather than to the length of the range"""
+
+    def __init__(self):
+        self._starts = []
+        self._ends = []
+        self._count = 0
+
+    def __contains__(self, n):
+        i = bisect_right(self._starts, n) - 1
+        return i >= 0 and n < self._ends[i]
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for start, end in zip(self._starts, self._ends):
+            for n in range(start, end):
+                yield n
+
+    def add(self, n):
+        i = bisect_right(self._starts, n) - 1
+        if i >= 0 and n < self._ends[i]:
+            return
+        self._count += 1
+        joins_left = i >= 0 and self._ends[i] == n
+        joins_right = i + 1 < len(self._starts) and self._starts[i + 1] == n + 1
+        if joins_left and joins_right:
+            self._ends[i] = self._ends[i + 1]
+            del self._starts[i + 1]
+            del self._ends[i + 1]
+        elif joins_left:
+            self._ends[i] = n + 1
+        elif joins_right:
+            self._starts[i + 1] = n
+        else:
+            self._starts.insert(i + 1, n)
+            self._ends.insert(i + 1, n + 1)
+
+    def discard(self, n):
+        i = bisect_right(self._starts, n) - 1
+        if i < 0 or n >= self._ends[i]:
+            return
+        self._count -= 1
+        start, end = self._starts[i], self._ends[i]
+        if start == n and end == n + 1:
+            del self._starts[i]
+            del self._ends[i]
+        elif start == n:
+            self._starts[i] = n + 1
+        elif end == n + 1:
+            self._ends[i] = n
+        else:
+            self._ends[i] = n
+            self._starts.insert(i + 1, n + 1)
+            self._ends.insert(i + 1, end)
+
+    def clear(self):
+        del self._starts[:]
+        del self._ends[:]
+        self._count = 0
+
+    def missing(self, start, stop):
+        """Return the `(start, end)` runs in `[start, stop)` not in the set"""
+        runs = []
+        i = max(0, bisect_right(self._starts, start) - 1)
+        pos = start
+        while pos < stop and i < len(self._starts):
+            if self._ends[i] <= pos:
+                i += 1
+                continue
+            if self._starts[i] >= stop:
+                break
+            if self._starts[i] > pos:
+                runs.append((pos, self._starts[i]))
+            pos = self._ends[i]
+            i += 1
+        if pos < stop:
+            runs.append((pos, stop))
+        return runs
+
+
+class _RunMap(object):
+    """A map from disjoint `[start, end)` runs of integers to values, so
+    that the fetches in progress for a run of blocks are found, and
+    subtracted from it, in time proportional to their number rather than
+    to the length of the run"""
+
+    def __init__(self):
+        self._starts = []
+        self._ends = []
+        self._values = []
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __iter__(self):
+        return iter(zip(self._starts, self._ends, self._values))
+
+    def get(self, n, default=None):
+        i = bisect_right(self._starts, n) - 1
+        if i >= 0 and n < self._ends[i]:
+            return self._values[i]
+        return default
+
+    def values(self):
+        return set(self._values)
+
+    def overlapping(self, start, stop):
+        """Return the `(start, end, value)` runs within `[start, stop)`,
+        clipped to it"""
+        i = max(0, bisect_right(self._starts, start) - 1)
+        j = bisect_left(self._starts, stop)
+        return [(max(run_start, start), min(run_end, stop), value)
+                for run_start, run_end, value
+                in zip(self._starts[i:j], self._ends[i:j], self._values[i:j])
+                if run_end > start]
+
+    def missing(self, start, stop):
+        """Return the `(start, end)` runs in `[start, stop)` not mapped"""
+        runs = []
+        pos = start
+        for run_start, run_end, _ in self.overlapping(start, stop):
+            if run_start > pos:
+                runs.append((pos, run_start))
+            pos = run_end
+        if pos < stop:
+            runs.append((pos, stop))
+        return runs
+
+    def assign(self, start, stop, value):
+        """Map `[start, stop)` to `value`, replacing anything mapped there"""
+        self.discard(start, stop)
+        i = bisect_left(self._starts, start)
+        self._starts.insert(i, start)
+        self._ends.insert(i, stop)
+        self._values.insert(i, value)
+
+    def discard(self, start, stop, value=None):
+        """Unmap `[start, stop)`, or only the parts of it mapped to `value`
+        if that is given"""
+        i = max(0, bisect_right(self._starts, start) - 1)
+        j = bisect_left(self._starts, stop)
+        kept = []
+        for run_start, run_end, run_value in zip(
+                self._starts[i:j], self._ends[i:j], self._values[i:j]):
+            if run_end <= start or (value is not None and run_value is not value):
+                kept.append((run_start, run_end, run_value))
+                continue
+            if run_start < start:
+                kept.append((run_start, start, run_value))
+            if run_end > stop:
+                kept.append((stop, run_end, run_value))
+        self._starts[i:j] = [run[0] for run in kept]
+        self._ends[i:j] = [run[1] for run in kept]
+        self._values[i:j] = [run[2] for run in kept]
+
+    def clear(self):
+        del self._starts[:]
+        del self._ends[:]
+        del self._values[:]
+
+
+class BlockCache(object):
+    """An unbounded cache of blocks, keyed by block index.
+
+    This is the cache used when none is given; it keeps every block
+    fetched until it is cleared. A cache instance belongs to a single
+    file object.
+    """
+
+    def __init__(self):
+        self._blocks = self._make_storage()
+        self._resident = _IntervalSet()
+        self._lock = threading.RLock()
+
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __repr__(self):
+        return "<%s blocks=%d size=%d hits=%d misses=%d evictions=%d>" % (
+            type(self).__name__, len(self), self.size,
+            self.hits, self.misses, self.evictions)
+
+    def __contains__(self, idx):
+        return idx in self._blocks
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def get(self, idx):
+        """Return the block at `idx`, or `None` if it is not cached"""
+        with self._lock:
+            block = self._blocks.get(idx)
+            if block is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._touch(idx, block)
+            return block
+
+    def missing(self, start, stop, record=True):
+        """
+        Return the runs of blocks in `[start, stop)` that are not cached
+
+        :param record: Whether to count the blocks missing as misses.
+        :return: A list of `(start, end)` pairs.
+        """
+        with self._lock:
+            runs = self._resident.missing(start, stop)
+            if record:
+                self.misses += sum(end - start for start, end in runs)
+            return runs
+
+    def put(self, idx, block):
+        """Store `block` at `idx`, evicting other blocks if necessary"""
+        with self._lock:
+            old = self._blocks.pop(idx, None)
+            if old is not None:
+                self.size -= len(old)
+                self._forget(idx)
+            if not self._fits(block):
+                return
+            block = self._own(block)
+            self._blocks[idx] = block
+            self.size += len(block)
+            self._remember(idx)
+            self._evict()
+
+    def clear(self):
+        """Drop every cached block"""
+        with self._lock:
+            self._blocks.clear()
+            self._resident.clear()
+            self.size = 0
+
+    def close(self):
+        """Called when the file using this cache is closed"""
+        self.clear()
+
+    def bind(self, url, validator, block_size, length=None):
+        """
+        Return the cache a newly opened file should use
+
+        :param url: The URL of the file
+        :param validator: The ETag or Last-Modified header reported for
+            the file, or `None` if there was neither.
+        :param block_size: The block size of the file
+        :param length: The length of the file
+        """
+        return self
+
+    def _make_storage(self):
+        return {}
+
+    def _touch(self, idx, block):
+        pass
+
+    def _fits(self, block):
+        return True
+
+    def _own(self, block):
+        # Blocks may be views of the slab a run was fetched into; this
+        # cache keeps every block of the slab, so holding it costs nothing
+        return block
+
+    def _evict(self):
+        pass
+
+    def _remember(self, idx):
+        self._resident.add(idx)
+
+    def _forget(self, idx):
+        self._resident.discard(idx)
+
+
+class LRUBlockCache(BlockCache):
+    """A block cache bounded in bytes and/or blocks.
+
+    When either limit is exceeded the least recently used blocks are
+    evicted until the cache fits again.
+
+    :param max_bytes: The maximum total size of the cached blocks, or
+        `None` for no limit.
+    :param max_blocks: The maximum number of cached blocks, or `None`
+        for no limit.
+    """
+
+    def __init__(self, max_bytes=None, max_blocks=None):
+        self.max_bytes = max_bytes
+        self.max_blocks = max_blocks
+        super(LRUBlockCache, self).__init__()
+
+    def _make_storage(self):
+        return OrderedDict()
+
+    def _touch(self, idx, block):
+        # OrderedDict.move_to_end() does not exist in python 2
+        del self._blocks[idx]
+        self._blocks[idx] = block
+
+    def _fits(self, block):
+        return self.max_bytes is None or len(block) <= self.max_bytes
+
+    def _own(self, block):
+        # A view would keep its whole slab alive after the rest of it is
+        # evicted, outside the budget, so keep a copy of just the block
+        return block.tobytes() if isinstance(block, memoryview) else block
+
+    def _evict(self):
+        while ((self.max_bytes is not None and self.size > self.max_bytes) or
+               (self.max_blocks is not None and len(self._blocks) > self.max_blocks)):
+            idx, block = self._blocks.popitem(last=False)
+            self.size -= len(block)
+            self.evictions += 1
+            self._forget(idx)
+
+
+class SharedBlockCache(LRUBlockCache):
+    """A bounded LRU block cache shared between many file objects.
+
+    Blocks are keyed by URL, validator (ETag or Last-Modified) and block
+    index, so files opened on the same version of a resource share their
+    blocks, while a changed resource is never served stale data. Files
+    whose server reports no validator get a namespace of their own that
+    is dropped when they are closed.
+
+    All operations are guarded by a lock and never block on I/O, so one
+    cache can be used from many threads and from asyncio tasks alike.
+    """
+
+    def __init__(self, max_bytes=None, max_blocks=None):
+        super(SharedBlockCache, self).__init__(max_bytes, max_blocks)
+        self._namespaces = {}
+
+    def close(self):
+        pass
+
+    def bind(self, url, validator, block_size, length=None):
+        if validator is None:
+            return _BlockCacheView(self, (url, object(), block_size), True)
+        return _BlockCacheView(self, (url, validator, block_size), False)
+
+    def clear(self):
+        with self._lock:
+            super(SharedBlockCache, self).clear()
+            self._namespaces.clear()
+
+    def _discard(self, namespace):
+        with self._lock:
+            for idx in self._namespaces.pop(namespace, ()):
+                block = self._blocks.pop((namespace, idx))
+                self.size -= len(block)
+
+    def _missing(self, namespace, start, stop, record):
+        with self._lock:
+            resident = self._namespaces.get(namespace)
+            runs = [(start, stop)] if resident is None else resident.missing(start, stop)
+            if record:
+                self.misses += sum(end - start for start, end in runs)
+            return runs
+
+    def _remember(self, key):
+        self._namespaces.setdefault(key[0], _IntervalSet()).add(key[1])
+
+    def _forget(self, key):
+        indices = self._namespaces[key[0]]
+        indices.discard(key[1])
+        if not indices:
+            del self._namespaces[key[0]]
+
+
+class _BlockCacheView(object):
+    """The part of a `SharedBlockCache` belonging to one file"""
+
+    def __init__(self, cache, namespace, private):
+        self._shared = cache
+        self._namespace = namespace
+        self._private = private
+
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return "<%s of %r blocks=%d hits=%d misses=%d>" % (
+            type(self).__name__, self._shared, len(self),
+            self.hits, self.misses)
+
+    def __contains__(self, idx):
+        return (self._namespace, idx) in self._shared
+
+    def __len__(self):
+        return len(self._shared._namespaces.get(self._namespace, ()))
+
+    @property
+    def evictions(self):
+        return self._shared.evictions
+
+    def get(self, idx):
+        block = self._shared.get((self._namespace, idx))
+        if block is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return block
+
+    def missing(self, start, stop, record=True):
+        runs = self._shared._missing(self._namespace, start, stop, record)
+        if record:
+            self.misses += sum(end - start for start, end in runs)
+        return runs
+
+    def put(self, idx, block):
+        self._shared.put((self._namespace, idx), block)
+
+    def clear(self):
+        self._shared._discard(self._namespace)
+
+    def close(self):
+        if self._private:
+            self.clear()
+
+    def bind(self, url, validator, block_size, length=None):
+        return self._shared.bind(url, validator, block_size, length)
+
+
+class ArenaBlockCache(BlockCache):
+    """A bounded block cache storing every block in one preallocated arena.
+
+    The arena is an anonymous memory map divided into one slot per block,
+    allocated when the cache is bound to a file and its block size is
+    known; pages are only committed as slots are first used. Slots are
+    indexed by a dict from block index to slot and arrays from slot to
+    block index and length, so there are no per-block objects for the
+    garbage collector to track, and the cache never fragments the heap.
+    Blocks are evicted with the CLOCK algorithm.
+
+    `get()` returns a copy of a block. `view()` returns a memoryview of
+    the slot itself, which is only valid until the next `put()`; on
+    python 2, whose memory maps cannot be viewed, it returns a copy too.
+
+    A cache instance belongs to a single file object.
+
+    :param max_bytes: The size of the arena.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.block_size = None
+        self._arena = None
+        super(ArenaBlockCache, self).__init__()
+
+    def bind(self, url, validator, block_size, length=None):
+        if block_size <= 0:
+            return BlockCache()
+        if block_size != self.block_size:
+            with self._lock:
+                slots = max(1, self.max_bytes // block_size)
+                if length is not None:
+                    slots = max(1, min(slots, -(-length // block_size)))
+                if self._arena is not None:
+                    self._arena.close()
+                self.block_size = block_size
+                self._arena = mmap.mmap(-1, slots * block_size)
+                # Slicing a python 2 mmap copies, but it has no buffer
+                # interface to view instead
+                self._view = memoryview(self._arena) if PY3 else self._arena
+                self._slot_blocks = array('l', [-1]) * slots
+                self._slot_lengths = array('l', [0]) * slots
+                self._referenced = bytearray(slots)
+                self._used = 0
+                self._hand = 0
+                self._blocks = {}
+                self._resident.clear()
+                self.size = 0
+        return self
+
+    def get(self, idx):
+        view = self.view(idx)
+        return None if view is None else bytes(view)
+
+    def view(self, idx):
+        """Return a memoryview of the block at `idx`, or `None` if it is
+        not cached. The view is only valid until the next `put()`."""
+        with self._lock:
+            slot = self._blocks.get(idx)
+            if slot is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._referenced[slot] = 1
+            start = slot * self.block_size
+            return self._view[start:start + self._slot_lengths[slot]]
+
+    def put(self, idx, block):
+        with self._lock:
+            if self._arena is None or len(block) > self.block_size:
+                return
+            slot = self._blocks.get(idx)
+            if slot is None:
+                slot = self._allocate()
+                self._blocks[idx] = slot
+                self._slot_blocks[slot] = idx
+                self._resident.add(idx)
+            else:
+                self.size -= self._slot_lengths[slot]
+            start = slot * self.block_size
+            if not PY3 and isinstance(block, memoryview):
+                block = block.tobytes()
+            self._view[start:start + len(block)] = block
+            self._slot_lengths[slot] = len(block)
+            self._referenced[slot] = 1
+            self.size += len(block)
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self._resident.clear()
+            self.size = 0
+            if self._arena is not None:
+                self._slot_blocks = array('l', [-1]) * len(self._slot_blocks)
+                self._referenced = bytearray(len(self._referenced))
+                self._used = 0
+                self._hand = 0
+
+    def close(self):
+        with self._lock:
+            self.clear()
+            if self._arena is not None:
+                self._view = None
+                try:
+                    self._arena.close()
+                except BufferError:
+                    # A view is still held; the arena goes when it does
+                    pass
+                self._arena = None
+                self.block_size = None
+
+    def _allocate(self):
+        if self._used < len(self._slot_blocks):
+            self._used += 1
+            return self._used - 1
+
+        # Sweep the clock hand past recently used slots, clearing their
+        # reference bits, and evict the first slot found unreferenced
+        while self._referenced[self._hand]:
+            self._referenced[self._hand] = 0
+            self._hand = (self._hand + 1) % len(self._referenced)
+        slot = self._hand
+        self._hand = (self._hand + 1) % len(self._referenced)
+
+        del self._blocks[self._slot_blocks[slot]]
+        self._resident.discard(self._slot_blocks[slot])
+        self.size -= self._slot_lengths[slot]
+        self.evictions += 1
+        return slot
+
+
+class DiskBlockCache(object):
+    """A block cache persisted in a directory.
+
+    Each file gets a sparse data file the length of the resource, into
+    which fetched blocks are written through `mmap`, a map file holding
+    one byte per block recording which blocks are present, and a metadata
+    file recording the URL, validator, block size and length. The cache
+    survives restarts: a file opened later on the same URL reuses the
+    blocks if the server still reports the same validator and length,
+    and starts afresh otherwise.
+
+    Files whose server reports no validator cannot be checked for
+    staleness, so they are given an in-memory `BlockCache` instead.
+
+    :param directory: The directory to keep cache files in; it is created
+        if it does not exist.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def __repr__(self):
+        return "<%s %r>" % (type(self).__name__, self.directory)
+
+    def bind(self, url, validator, block_size, length=None):
+        if validator is None or length is None or block_size <= 0:
+            return BlockCache()
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        path = os.path.join(self.directory, "%s.%d" % (name, block_size))
+        return _DiskBlockFile(path, {'url': url,
+                                     'validator': validator,
+                                     'block_size': block_size,
+                                     'length': length})
+
+    def clear(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _DiskBlockFile(object):
+    """The blocks of one file in a `DiskBlockCache`"""
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.block_size = meta['block_size']
+        self.length = meta['length']
+        self._lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        count = -(-self.length // self.block_size)
+        try:
+            with open(path + '.meta') as f:
+                fresh = json.load(f) != meta
+        except (IOError, OSError, ValueError):
+            fresh = True
+
+        if fresh:
+            # Write the metadata last, so an interrupted reset is redone
+            for suffix in ('.meta', '.map', '.data'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            with open(path + '.map', 'wb') as f:
+                f.write(b'\0' * count)
+            with open(path + '.data', 'wb') as f:
+                f.truncate(self.length)
+            with open(path + '.meta', 'w') as f:
+                json.dump(meta, f)
+
+        self._map_file = open(path + '.map', 'r+b')
+        self._map = bytearray(self._map_file.read())
+        self._data_file = open(path + '.data', 'r+b')
+        self._data = None
+        if self.length > 0:
+            self._data = mmap.mmap(self._data_file.fileno(), self.length)
+
+    def __repr__(self):
+        return "<%s %r blocks=%d hits=%d misses=%d>" % (
+            type(self).__name__, self.path, len(self),
+            self.hits, self.misses)
+
+    def __contains__(self, idx):
+        return 0 <= idx < len(self._map) and self._map[idx] == 1
+
+    def __len__(self):
+        return self._map.count(b'\1')
+
+    @property
+    def size(self):
+        return min(len(self) * self.block_size, self.length)
+
+    def get(self, idx):
+        with self._lock:
+            if idx not in self:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self._data[idx * self.block_size:
+                              min((idx + 1) * self.block_size, self.length)]
+
+    def missing(self, start, stop, record=True):
+        # The map holds a byte per block, so runs are found with find()
+        with self._lock:
+            runs = []
+            stop = min(stop, len(self._map))
+            pos = start
+            while pos < stop:
+                first = self._map.find(b'\0', pos, stop)
+                if first < 0:
+                    break
+                end = self._map.find(b'\1', first, stop)
+                end = stop if end < 0 else end
+                runs.append((first, end))
+                pos = end
+            if record:
+                self.misses += sum(end - start for start, end in runs)
+            return runs
+
+    def put(self, idx, block):
+        with self._lock:
+            start = idx * self.block_size
+            end = min(start + self.block_size, self.length)
+            if self._data is None or len(block) != end - start:
+                return
+            if not PY3 and isinstance(block, memoryview):
+                # python 2's mmap slice assignment takes only strings
+                block = block.tobytes()
+            self._data[start:end] = block
+            self._set(idx, 1)
+
+    def clear(self):
+        with self._lock:
+            self._map[:] = b'\0' * len(self._map)
+            self._map_file.seek(0)
+            self._map_file.write(self._map)
+            self._map_file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._data is not None:
+                self._data.flush()
+                self._data.close()
+                self._data = None
+            self._data_file.close()
+            self._map_file.close()
+
+    def bind(self, url, validator, block_size, length=None):
+        return self
+
+    def _set(self, idx, value):
+        self._map[idx] = value
+        self._map_file.seek(idx)
+        self._map_file.write(self._map[idx:idx + 1])
+        self._map_file.flush()
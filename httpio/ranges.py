@@ -0,0 +1,139 @@
+"""Helpers for working with byte ranges and HTTP range requests.
+
+Ranges here are half-open `(start, end)` pairs, as used throughout httpio,
+rather than the inclusive pairs of the HTTP `Range` header.
+"""
+
+from __future__ import absolute_import
+
+import re
+
+__all__ = ["DEFAULT_MAX_GAP", "MAX_RANGES_PER_REQUEST", "coalesce",
+           "format_range_header", "parse_content_range", "parse_unsatisfied_range",
+           "multipart_boundary", "MultipartByteranges"]
+
+
+# The largest gap, in bytes, between two ranges that read_ranges() will
+# fetch in a single request; transferring this much more is cheaper than
+# a round trip on all but the fastest links.
+DEFAULT_MAX_GAP = 16 * 1024
+
+# The most ranges put in the Range header of one request; some servers
+# refuse requests with many more (Apache allows 200 by default)
+MAX_RANGES_PER_REQUEST = 100
+
+
+def coalesce(spans, max_gap=0):
+    """
+    Merge overlapping and nearby spans
+
+    :param spans: An iterable of `(start, end)` pairs.
+    :param max_gap: The largest gap between two spans that are still merged.
+    :return: A sorted list of disjoint `(start, end)` pairs covering every
+        span given.
+    """
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start - merged[-1][1] <= max_gap:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def format_range_header(spans):
+    """Return the value of a `Range` header requesting the given spans"""
+    return "bytes=" + ",".join("%d-%d" % (start, end - 1)
+                               for start, end in spans)
+
+
+def parse_content_range(value):
+    """
+    Parse a `Content-Range` header
+
+    :return: A `(start, end, length)` tuple, where `length` is `None` if
+        the server does not know it, or `None` if the header is malformed.
+    """
+    match = re.match(r"\s*bytes\s+(\d+)-(\d+)/(\d+|\*)\s*$", value or "")
+    if match is None:
+        return None
+    length = None if match.group(3) == "*" else int(match.group(3))
+    return int(match.group(1)), int(match.group(2)) + 1, length
+
+
+def parse_unsatisfied_range(value):
+    """Return the length in the `Content-Range` header of a 416 response,
+    `bytes */length`, or `None` if the header is malformed"""
+    match = re.match(r"\s*bytes\s+\*/(\d+)\s*$", value or "")
+    return None if match is None else int(match.group(1))
+
+
+def multipart_boundary(content_type):
+    """Return the boundary of a `multipart/byteranges` content type, or `None`"""
+    match = re.match(r'\s*multipart/byteranges\s*;.*?boundary=("?)([^";]+)\1',
+                     content_type or "", re.IGNORECASE)
+    return match.group(2).encode('ascii') if match else None
+
+
+class MultipartByteranges(object):
+    """An incremental parser for `multipart/byteranges` response bodies.
+
+    Feed the body to `feed()` in chunks as it arrives; each call returns
+    the parts completed by that chunk, so a part can be stored as soon
+    as it has been received rather than once the whole body has.
+    """
+
+    def __init__(self, boundary):
+        self._delimiter = b"--" + boundary
+        self._buffer = bytearray()
+        self._span = None
+        self.done = False
+
+    def feed(self, data):
+        """
+        Parse the next chunk of the body
+
+        :return: A list of `(start, data)` pairs, one for each part completed.
+        """
+        self._buffer += data
+        parts = []
+        while not self.done:
+            if self._span is None:
+                if not self._parse_headers():
+                    break
+            else:
+                start, end = self._span
+                if len(self._buffer) < end - start:
+                    break
+                parts.append((start, bytes(self._buffer[:end - start])))
+                del self._buffer[:end - start]
+                self._span = None
+        return parts
+
+    def _parse_headers(self):
+        pos = self._buffer.find(self._delimiter)
+        if pos < 0:
+            # Keep enough of the buffer to spot a delimiter split by chunks
+            del self._buffer[:max(0, len(self._buffer) - len(self._delimiter))]
+            return False
+        pos += len(self._delimiter)
+        if len(self._buffer) < pos + 2:
+            return False
+        if self._buffer[pos:pos + 2] == b"--":
+            self.done = True
+            return False
+        end = self._buffer.find(b"\r\n\r\n", pos)
+        if end < 0:
+            return False
+
+        span = None
+        for line in bytes(self._buffer[pos:end]).split(b"\r\n"):
+            name, _, value = line.partition(b":")
+            if name.strip().lower() == b"content-range":
+                span = parse_content_range(value.decode('latin-1'))
+        del self._buffer[:end + 4]
+        if span is None:
+            raise ValueError("multipart/byteranges part without Content-Range")
+        self._span = span[:2]
+        return True
@@ -0,0 +1,101 @@
+"""Retrying failed range requests.
+
+A request that fails with a connection error, a truncated body or one of
+a few transient status codes is retried after a backoff time which grows
+exponentially with each attempt, and is jittered so that many clients
+failing at once do not retry in step. Reads resume a truncated body from
+the last byte received rather than starting again.
+"""
+
+from __future__ import absolute_import
+
+import random
+import requests
+import urllib3
+
+from six.moves.http_client import IncompleteRead
+
+__all__ = ["Retry", "RETRY_STATUSES"]
+
+
+# The status codes of responses which are worth retrying
+RETRY_STATUSES = frozenset([408, 429, 500, 502, 503, 504])
+
+# The errors raised by requests and urllib3 for a failed connection or a
+# body cut short
+RETRY_ERRORS = (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError,
+                urllib3.exceptions.ProtocolError,
+                urllib3.exceptions.TimeoutError,
+                IncompleteRead)
+
+
+class Retry(object):
+    """
+    How failed requests are retried
+
+    :param total: The most retries made for one read, counting every
+        failure, including those which are resumed.
+    :param backoff: The longest wait before the first retry, in seconds,
+        doubled for each retry after it.
+    :param max_backoff: The longest wait before any retry, in seconds.
+    :param statuses: The status codes of responses which are retried.
+    """
+    def __init__(self, total=3, backoff=0.1, max_backoff=10.0, statuses=RETRY_STATUSES):
+        self.total = total
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = frozenset(statuses)
+
+    def __repr__(self):
+        return "%s(total=%r, backoff=%r, max_backoff=%r)" % (
+            type(self).__name__, self.total, self.backoff, self.max_backoff)
+
+    @classmethod
+    def from_value(cls, retries):
+        """Return `retries` if it is a `Retry`, or a `Retry` making that
+        many retries if it is a number"""
+        if isinstance(retries, cls):
+            return retries
+        return cls(total=retries or 0)
+
+    def delay(self, attempt, retry_after=None):
+        """
+        Return the time to wait before retry number `attempt`, counting
+        from zero, chosen at random up to the backoff time ("full jitter")
+
+        :param retry_after: The delay the server asked for with a
+            `Retry-After` header, if any, which is waited for instead
+            when it is longer, up to `max_backoff`.
+        """
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_backoff))
+        return delay
+
+
+def is_retryable(error, retry):
+    """Return whether a request which failed with `error` may be retried"""
+    if isinstance(error, requests.exceptions.HTTPError):
+        return (error.response is not None and
+                error.response.status_code in retry.statuses)
+    return isinstance(error, RETRY_ERRORS)
+
+
+def retry_after(error):
+    """Return the delay in seconds asked for by the `Retry-After` header of
+    the response that caused `error`, or `None`"""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    return parse_retry_after(response.headers.get('Retry-After'))
+
+
+def parse_retry_after(value):
+    """Parse a `Retry-After` header given in seconds, returning `None` for
+    a missing header or an HTTP date"""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,61 @@
+"""HTTP sessions for httpio file objects.
+
+Each file opened without a `session` creates a `requests.Session` of its
+own, and so new connections to the server, which it closes when the
+file is closed. Passing one session to many files lets them reuse the
+kept-alive connections in its pools instead, saving a TCP and TLS
+handshake per file. A session passed in is never closed by a file.
+"""
+
+from __future__ import absolute_import
+
+import requests
+import threading
+
+from requests.adapters import HTTPAdapter
+
+__all__ = ["make_session", "get_shared_session"]
+
+
+# The default number of hosts a session keeps a connection pool for
+DEFAULT_POOL_CONNECTIONS = 10
+
+# The default number of connections kept alive in the pool for each host;
+# read_ranges() and read-ahead make several requests at once
+DEFAULT_POOL_MAXSIZE = 16
+
+_shared_session = None
+_shared_session_lock = threading.Lock()
+
+
+def make_session(pool_connections=DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE, pool_block=False,
+                 max_retries=0):
+    """
+    Return a `requests.Session` with connection pools sized for httpio
+
+    :param pool_connections: The number of hosts to keep a pool for.
+    :param pool_maxsize: The most connections kept alive to each host.
+    :param pool_block: Whether a request waits for a free connection
+        when `pool_maxsize` are in use, rather than opening another one
+        that is discarded afterwards. Set this to cap the connections
+        made to each host.
+    :param max_retries: Passed to `requests.adapters.HTTPAdapter`.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections,
+                          pool_maxsize=pool_maxsize, pool_block=pool_block,
+                          max_retries=max_retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_shared_session():
+    """Return the process-wide session made by `make_session()`, creating
+    it if necessary"""
+    global _shared_session
+    with _shared_session_lock:
+        if _shared_session is None:
+            _shared_session = make_session()
+        return _shared_session
@@ -0,0 +1,201 @@
+"""Counters of the I/O done by httpio file objects.
+
+Every file keeps an `IOStats` as its `stats` attribute, counting the
+requests it makes, the bytes it fetches and returns, and the blocks it
+finds in or misses from its cache, with histograms of request latency and
+time to first byte. Hooks passed to `IOStats` are called as requests
+start and end and as blocks are missed, to export the numbers elsewhere.
+One `IOStats` may be passed to several files to count their I/O together.
+"""
+
+from __future__ import absolute_import
+
+import threading
+
+from bisect import bisect_left
+from timeit import default_timer
+
+__all__ = ["IOStats", "LatencyHistogram"]
+
+
+# The upper bounds of the latency histogram buckets, in seconds: powers of
+# two from 1ms to about 33s, and a last bucket for anything slower
+LATENCY_BUCKETS = tuple(0.001 * 2 ** n for n in range(16)) + (float('inf'),)
+
+
+class LatencyHistogram(object):
+    """A histogram of durations, in buckets whose bounds double"""
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def __repr__(self):
+        return "<%s count=%d mean=%.4f max=%.4f>" % (
+            type(self).__name__, self.count, self.mean, self.max)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def add(self, seconds):
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        """Return the upper bound of the bucket holding the `q`th
+        percentile, capped at the largest duration seen"""
+        if not self.count:
+            return 0.0
+        rank = q / 100.0 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': [(bound, count) for bound, count in zip(self.bounds, self.counts)
+                        if count],
+        }
+
+
+class IOStats(object):
+    """
+    Counters of the I/O done by one or more files
+
+    :param on_request_start: Called as `on_request_start(url, range_header)`
+        before each request. The range header is `None` for a HEAD request.
+    :param on_request_end: Called as `on_request_end(url, range_header,
+        nbytes, latency, ttfb, error)` after each request, with the number
+        of bytes of body received, the seconds taken in all and until the
+        response headers arrived, and the exception it failed with or `None`.
+    :param on_cache_miss: Called as `on_cache_miss(url, start, stop)` for
+        each run of blocks `[start, stop)` a read finds missing from the
+        cache.
+    """
+    def __init__(self, on_request_start=None, on_request_end=None, on_cache_miss=None):
+        self.on_request_start = on_request_start
+        self.on_request_end = on_request_end
+        self.on_cache_miss = on_cache_miss
+
+        self.requests = 0
+        self.failed_requests = 0
+        self.retries = 0
+        self.bytes_fetched = 0
+        self.bytes_returned = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.latency = LatencyHistogram()
+        self.ttfb = LatencyHistogram()
+
+        # The cache of the file last bound, whose evictions are reported
+        self.cache = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<%s requests=%d fetched=%d returned=%d hits=%d misses=%d>" % (
+            type(self).__name__, self.requests, self.bytes_fetched,
+            self.bytes_returned, self.cache_hits, self.cache_misses)
+
+    @property
+    def cache_evictions(self):
+        return getattr(self.cache, 'evictions', 0)
+
+    def request(self, url, range_header):
+        """Return a context manager timing one request"""
+        return _Request(self, url, range_header)
+
+    def fetched(self, nbytes):
+        """Count bytes received outside of `request()`, such as those read
+        later from a response kept open"""
+        with self._lock:
+            self.bytes_fetched += nbytes
+
+    def returned(self, nbytes):
+        with self._lock:
+            self.bytes_returned += nbytes
+
+    def retried(self):
+        with self._lock:
+            self.retries += 1
+
+    def looked_up(self, url, hits, runs):
+        """Count a cache lookup which found `hits` blocks and missed the
+        runs of blocks `runs`"""
+        with self._lock:
+            self.cache_hits += hits
+            self.cache_misses += sum(stop - start for start, stop in runs)
+        if self.on_cache_miss is not None:
+            for start, stop in runs:
+                self.on_cache_miss(url, start, stop)
+
+    def as_dict(self):
+        """Return the counters as a dictionary, to export elsewhere"""
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'failed_requests': self.failed_requests,
+                'retries': self.retries,
+                'bytes_fetched': self.bytes_fetched,
+                'bytes_returned': self.bytes_returned,
+                'cache_hits': self.cache_hits,
+                'cache_misses': self.cache_misses,
+                'cache_evictions': self.cache_evictions,
+                'latency': self.latency.as_dict(),
+                'ttfb': self.ttfb.as_dict(),
+            }
+
+
+class _Request(object):
+    """Times one request, from entering to leaving the context"""
+    def __init__(self, stats, url, range_header):
+        self.stats = stats
+        self.url = url
+        self.range_header = range_header
+        self.nbytes = 0
+        self.ttfb = None
+        self.latency = None
+
+    def __enter__(self):
+        if self.stats.on_request_start is not None:
+            self.stats.on_request_start(self.url, self.range_header)
+        self._start = default_timer()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is GeneratorExit:
+            # A stream abandoned by its reader, not a failure
+            exc = None
+        latency = self.latency = default_timer() - self._start
+        ttfb = self.ttfb = latency if self.ttfb is None else self.ttfb
+        stats = self.stats
+        with stats._lock:
+            stats.requests += 1
+            stats.failed_requests += exc is not None
+            stats.bytes_fetched += self.nbytes
+            stats.latency.add(latency)
+            stats.ttfb.add(ttfb)
+        if stats.on_request_end is not None:
+            stats.on_request_end(self.url, self.range_header, self.nbytes,
+                                 latency, ttfb, exc)
+
+    def first_byte(self):
+        """Note that the response headers have arrived"""
+        if self.ttfb is None:
+            self.ttfb = default_timer() - self._start
+
+    def received(self, nbytes):
+        self.nbytes += nbytes
@@ -3,11 +3,63 @@
 The interface is where possible as similar to the existing httpio interface as possible (and hence similar to the
 file like objects of python) except that many methods are replaced with asynchronous coroutines."""
 
+import asyncio
+
+from bisect import bisect_right
+from http.client import IncompleteRead
+
 import aiohttp
 from httpio import HTTPIOError
+from httpio.adaptive import AdaptiveFetch
+from httpio.cache import BlockCache, _RunMap
+from httpio.retry import Retry, parse_retry_after
+from httpio.stats import IOStats
+from httpio import STREAM_CHUNK_SIZE, _cut_runs, _without
+from httpio.ranges import (DEFAULT_MAX_GAP, MAX_RANGES_PER_REQUEST, MultipartByteranges,
+                           coalesce, format_range_header, multipart_boundary, parse_content_range,
+                           parse_unsatisfied_range)
+
+
+__all__ = ["AsyncHTTPIOFile", "HTTPIOError", "open", "make_session"]
+
+
+# The smallest piece, in bytes, that a run of missing blocks is split into
+# for concurrent requests; smaller reads cost more in requests than they
+# gain from running at once
+MIN_SPLIT_SIZE = 1024 * 1024
+
+# The errors raised by aiohttp for a failed connection or a body cut short
+RETRY_ERRORS = (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError,
+                asyncio.TimeoutError, IncompleteRead)
+
+
+def _is_retryable(error, retry):
+    """Return whether a request which failed with `error` may be retried"""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in retry.statuses
+    return isinstance(error, RETRY_ERRORS)
+
+
+def _retry_after(error):
+    headers = getattr(error, 'headers', None)
+    return parse_retry_after(headers.get('Retry-After')) if headers else None
+
+
+def make_session(limit=100, limit_per_host=0, keepalive_timeout=15, **kwargs):
+    """
+    Return an `aiohttp.ClientSession` whose connections can be shared by many files
 
+    Call this from a coroutine, and close the session when done with it.
 
-__all__ = ["AsyncHTTPIOFile", "HTTPIOError", "open"]
+    :param limit: The most connections open at once, or `0` for no limit.
+    :param limit_per_host: The most connections open to each host at once,
+        or `0` for no limit.
+    :param keepalive_timeout: How long in seconds to keep idle connections alive.
+    :param kwargs: Additional arguments to pass to `aiohttp.ClientSession()`
+    """
+    connector = aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host,
+                                     keepalive_timeout=keepalive_timeout)
+    return aiohttp.ClientSession(connector=connector, **kwargs)
 
 
 async def open(url, block_size=-1, **kwargs):
@@ -19,6 +71,59 @@ async def open(url, block_size=-1, **kwargs):
 
     :param url: The URL of the file to open
     :param block_size: The cache block size, or `-1` to disable caching.
+    :param cache: The `httpio.BlockCache` to store blocks in, or `None`
+        for an unbounded cache private to the file. Pass
+        `httpio.get_shared_cache()` to share blocks with other files.
+    :param readahead: The largest number of blocks to fetch ahead of
+        sequential reads, or `0` to disable read-ahead. Requires a `block_size`.
+    :param multipart: Whether to fetch several missing runs of blocks, or
+        the ranges of `read_ranges()` without caching, in one request with
+        a multi-range `Range` header. If the server does not answer with
+        `multipart/byteranges`, one request per run is made.
+    :param session: The `aiohttp.ClientSession` to make requests with, or `None`
+        for a session private to the file. Pass a session from `make_session()`
+        to reuse connections between files; the file does not close it.
+    :param length: The length of the resource, if already known. No HEAD
+        request is made when it is given.
+    :param etag: The ETag (or Last-Modified date) of the resource, used as
+        its validator when `length` is given.
+    :param lazy: Whether to skip the HEAD request and learn the length
+        from the `Content-Range` header of the first ranged GET instead.
+    :param prefetch_head: The number of bytes at the start of the resource
+        to fetch in place of the HEAD request, for formats with a header.
+    :param prefetch_tail: The number of bytes at the end of the resource
+        to fetch in place of the HEAD request, for formats with a footer
+        such as zip or Parquet. When both are given the two requests are
+        made at once.
+    :param tail_size: The number of bytes at the end of the resource to
+        fetch with one suffix range request, and keep, the first time a
+        read falls within them. Seeking from the end of a file whose
+        length is not yet known fetches the tail the same way, so a
+        trailer is read in one request.
+    :param retries: The number of times to retry a request that fails
+        with a connection error, a truncated body or a transient status
+        such as 503, or an `httpio.Retry` saying how to retry. Retries
+        wait a jittered backoff time, and a truncated body is resumed
+        from the last byte received.
+    :param stats: The `httpio.IOStats` to count requests, bytes and cache
+        lookups in, or `None` for one private to the file. Either way it
+        is the `stats` attribute of the file.
+    :param adaptive: Whether to choose how much to fetch when a read misses
+        the cache from the pattern of reads and the latency and throughput
+        measured, or an `httpio.AdaptiveFetch` to do so. Sequential reads
+        then fetch ahead in requests that grow with the run of reads, while
+        random reads fetch only the blocks they need. The cache stays
+        aligned to `block_size`, which should be small. Requires a
+        `block_size`.
+    :param coalesce: The largest gap, in bytes, between runs of blocks
+        missing from one read that are still fetched in one request, the
+        cached blocks between them being fetched again. Without caching,
+        each unbuffered read fetches up to this many bytes more and keeps
+        them to serve a following read nearby. It is also the default
+        `max_gap` of `read_ranges()`, if not `0`.
+    :param concurrency: The largest number of requests to have in flight
+        at once. Reads missing more than `MIN_SPLIT_SIZE` bytes (1 MiB) are
+        split between up to this many requests.
     :param kwargs: Additional arguments to pass to `requests.Request()`
     :return: An `httpio.HTTPIOFile` object supporting most of the usual
         file-like object methods.
@@ -32,23 +137,84 @@ class AsyncHTTPIOFile(object):
     """An asynchronous equivalent to httpio.HTTPIOFile.
     Sadly this class cannot descend from that one for technical reasons.
     """
-    def __init__(self, url, block_size=-1, **kwargs):
+    def __init__(self, url, block_size=-1, *, cache=None, readahead=0, multipart=False,
+                 session=None, length=None, etag=None, lazy=False, prefetch_head=0, prefetch_tail=0,
+                 tail_size=0, retries=0, stats=None, adaptive=False, coalesce=0, concurrency=1,
+                 **kwargs):
         """
         :param url: The URL of the file to open
         :param block_size: The cache block size, or `-1` to disable caching.
+        :param cache: The `httpio.BlockCache` to store blocks in, or `None`
+            for an unbounded cache private to the file.
+        :param readahead: The largest number of blocks to fetch ahead of
+            sequential reads, or `0` to disable read-ahead.
+        :param multipart: Whether to fetch several runs of blocks in one request.
+        :param session: The `aiohttp.ClientSession` to use, or `None` for a private one.
+        :param length: The length of the resource, if known, to skip the HEAD request.
+        :param etag: The ETag of the resource, used with `length`.
+        :param lazy: Whether to learn the length from the first read rather than a HEAD request.
+        :param prefetch_head: The number of bytes at the start to fetch in place of a HEAD request.
+        :param prefetch_tail: The number of bytes at the end to fetch in place of a HEAD request.
+        :param tail_size: The number of bytes at the end to fetch and keep on the first read there.
+        :param retries: The number of retries of a failed request, or an `httpio.Retry`.
+        :param stats: The `httpio.IOStats` to count I/O in, or `None` for a private one.
+        :param adaptive: Whether to adapt fetch sizes to the reads made, or an `httpio.AdaptiveFetch`.
+        :param coalesce: The largest gap in bytes between missing ranges fetched in one request.
+        :param concurrency: The largest number of requests to have in flight at once.
         :param kwargs: Additional arguments to pass to `session.get`
         """
         super(AsyncHTTPIOFile, self).__init__()
         self.url = url
         self.block_size = block_size
+        self.readahead = readahead
+        self.concurrency = concurrency
+        self.multipart = multipart
+        self.lazy = lazy
+        self.prefetch_head = prefetch_head
+        self.prefetch_tail = prefetch_tail
+        self.tail_size = tail_size
+        self.retries = Retry.from_value(retries)
+        self.stats = IOStats() if stats is None else stats
+        self.adaptive = AdaptiveFetch() if adaptive is True else adaptive or None
+        self.coalesce = coalesce
 
         self._kwargs = kwargs
         self._cursor = 0
-        self._cache = {}
+        self._cache = BlockCache() if cache is None else cache
+        # A cache belonging to another file, which is not closed with this one
+        self._borrowed_cache = None
         self._session = None
+        self._external_session = session
         self._aiter = None
 
+        # Fetches of runs of blocks in progress, as tasks keyed by the runs
+        # they will fill, and the state of read-ahead
+        self._inflight = _RunMap()
+        # Unbuffered reads in progress, as tasks keyed by `(start, end)`
+        self._raw_inflight = {}
+        self._semaphore = None
+        self._last_read_end = 0
+        self._readahead_window = 0
+
+        # Whether the server has answered a multi-range request with
+        # multipart/byteranges, or None if it has not been asked yet
+        self._multipart = None
+
         self.length = None
+        self.validator = None
+        self._known = (length, etag)
+
+        # Data read ahead of the cursor by readline(), and its position
+        self._line_buffer = bytearray()
+        self._line_start = 0
+
+        # `(start, data)` pairs fetched in place of the HEAD request or as
+        # the tail of the file
+        self._prefetched = []
+
+        # The `(start, data)` fetched past the end of the last unbuffered
+        # read, when `coalesce` is set
+        self._spill = None
         self.closed = False
 
     def __repr__(self):
@@ -70,11 +236,23 @@ class AsyncHTTPIOFile(object):
         be coroutines this class needs this as a seperate coroutine"""
 
         if self._session is None:
-            self._session = await aiohttp.ClientSession().__aenter__()
-            async with self._session.head(self.url, **self._kwargs) as response:
-                response.raise_for_status()
-                self.length = int(response.headers.get('content-length', None))
-                self.closed = False
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            if self._external_session is None:
+                self._session = await aiohttp.ClientSession().__aenter__()
+            else:
+                self._session = self._external_session
+            self.closed = False
+            if self._known[0] is not None:
+                self._bind(*self._known)
+            spans = []
+            if self.prefetch_head > 0:
+                spans.append((0, self._align(self.prefetch_head)))
+            if self.prefetch_tail > 0:
+                spans.append((-self.prefetch_tail, None))
+            if spans:
+                self._prefetched = await asyncio.gather(*[self._probe(*span) for span in spans])
+            elif self._known[0] is None and not self.lazy:
+                self._bind(*await self._retrying(self._head))
 
     async def __aenter__(self):
         await self.open()
@@ -85,15 +263,69 @@ class AsyncHTTPIOFile(object):
 
     async def close(self):
         if not self.closed:
-            if self._session is not None:
+            await self._cancel_fetches()
+            if self._session is not None and self._external_session is None:
                 await self._session.__aexit__(None, None, None)
             self._session = None
-            self._cache.clear()
+            if self._cache is not self._borrowed_cache:
+                self._cache.close()
             self.closed = True
 
     async def flush(self):
         self._assert_open()
+        await self._cancel_fetches()
         self._cache.clear()
+        self._prefetched = []
+        self._spill = None
+        del self._line_buffer[:]
+
+    async def iter_chunks(self, start=0, end=None, chunk_size=STREAM_CHUNK_SIZE):
+        """
+        Stream the file from `start` to `end` with one long-lived request
+
+        Each chunk moves the file position past it, and the blocks streamed
+        are cached if caching is enabled. Seeking elsewhere, or closing the
+        file, abandons the request before the next chunk.
+
+        :param start: The position to stream from.
+        :param end: The position to stream to, or `None` for the end.
+        :param chunk_size: The largest number of bytes in each chunk.
+        :return: An asynchronous iterator of `bytes` objects.
+        """
+        self._assert_open()
+        await self._ensure_length()
+        end = self.length if end is None else min(end, self.length)
+        if start >= end:
+            return
+
+        pos = self._cursor = start
+        buffer, buffer_start = bytearray(), start
+        attempt = 0
+        while True:
+            # A failed request is retried from the last byte received
+            header = "bytes=%d-" % pos if end == self.length else format_range_header([(pos, end)])
+            try:
+                with self.stats.request(self.url, header) as request:
+                    async with self._session.get(self.url, **self._request_kwargs(header)) as response:
+                        request.first_byte()
+                        response.raise_for_status()
+                        async for chunk in response.content.iter_chunked(chunk_size):
+                            request.received(len(chunk))
+                            chunk = chunk[:end - pos]
+                            if self.block_size > 0:
+                                buffer += chunk
+                                buffer_start = self._cache_streamed(buffer_start, buffer)
+                            pos += len(chunk)
+                            self._cursor = pos
+                            self.stats.returned(len(chunk))
+                            yield chunk
+                            if pos >= end or self.closed or self._cursor != pos:
+                                return
+                    raise IncompleteRead(b"", end - pos)
+            except Exception as e:
+                if not await self._should_retry(attempt, e):
+                    raise
+            attempt += 1
 
     async def peek(self, size):
         return await self._read_impl(size, peek=True)
@@ -101,9 +333,124 @@ class AsyncHTTPIOFile(object):
     async def read(self, size=-1):
         return await self._read_impl(size)
 
+    async def pread(self, offset, size=-1):
+        """
+        Read `size` bytes at `offset`, or to the end if `size` is negative,
+        without using or moving the file position
+
+        Many tasks may read the same file this way at once. Blocks, or
+        unbuffered ranges, which another task is already fetching are
+        awaited rather than fetched again.
+        """
+        self._assert_open()
+        await self._ensure_length()
+        end = self._pread_end(offset, size)
+        if end <= offset:
+            return b""
+
+        data = await self._read_prefetched(offset, end)
+        if data is None and self.block_size <= 0:
+            data = await self._read_shared(offset, end)
+        elif data is None:
+            data = b''.join([sector async for sector in self._read_cached(
+                end - offset, position=offset, schedule_readahead=False)])
+        self.stats.returned(len(data))
+        return data
+
+    async def preadinto(self, b, offset):
+        """
+        Read into the buffer `b` at `offset`, without using or moving the
+        file position, and return the number of bytes read
+        """
+        view = memoryview(b).cast('B')
+        data = await self.pread(offset, len(view))
+        view[:len(data)] = data
+        return len(data)
+
     async def read1(self, size=-1):
         return await self._read_impl(size, 1)
 
+    async def read_ranges(self, ranges, max_gap=None):
+        """
+        Read several byte ranges at once, without moving the file position
+
+        Ranges closer together than `max_gap` bytes are fetched in a single
+        request, and up to `concurrency` requests are made at once. If
+        caching is enabled the blocks fetched are cached.
+
+        :param ranges: An iterable of `(offset, length)` pairs.
+        :param max_gap: The largest gap between two ranges that are still
+            fetched in a single request, or `None` for the file's `coalesce`
+            if set, or else `DEFAULT_MAX_GAP`.
+        :return: A list holding the data of each range in turn.
+        """
+        self._assert_open()
+        await self._ensure_length()
+        if max_gap is None:
+            max_gap = self.coalesce or DEFAULT_MAX_GAP
+
+        spans = [(offset, min(offset + length, self.length))
+                 for offset, length in ranges]
+        for start, _ in spans:
+            if not (0 <= start <= self.length):
+                raise HTTPIOError("Invalid argument: offset=%r" % start)
+        wanted = [(start, end) for start, end in spans if start < end]
+
+        if self.block_size <= 0:
+            runs = coalesce(wanted, max_gap)
+            if len(runs) > 1 and self.multipart and self._multipart is not False:
+                chunks = await self._read_runs_multi(runs)
+            else:
+                chunks = await asyncio.gather(*[self._read_raw_limited(*run) for run in runs])
+                chunks = dict(zip(runs, chunks))
+            starts = [run[0] for run in runs]
+            data = []
+            for start, end in spans:
+                if start >= end:
+                    data.append(b"")
+                    continue
+                run = runs[bisect_right(starts, start) - 1]
+                data.append(chunks[run][start - run[0]:end - run[0]])
+            self.stats.returned(sum(len(d) for d in data))
+            return data
+
+        blocks = {}
+        missing = []
+        for sector0, sector1 in coalesce(
+                (start // self.block_size, (end - 1) // self.block_size + 1)
+                for start, end in wanted):
+            found, runs = self._lookup(sector0, sector1)
+            blocks.update(found)
+            missing.extend(runs)
+
+        runs = coalesce(_without(missing, self._inflight), max_gap // self.block_size)
+        if len(runs) > 1 and self.multipart and self._multipart is not False:
+            self._fetch_blocks_multi(runs)
+            runs = []
+        for start, end in runs:
+            self._fetch_blocks(start, end)
+        waits = [run for start, end in missing
+                 for run in self._inflight.overlapping(start, end)]
+        for start, end, task in waits:
+            fetched = await asyncio.shield(task)
+            for idx in range(start, end):
+                blocks[idx] = fetched[idx]
+
+        data = []
+        for start, end in spans:
+            chunk = []
+            pos = start
+            while pos < end:
+                idx, offset = divmod(pos, self.block_size)
+                piece = blocks[idx][offset:offset + end - pos]
+                if not piece:
+                    break
+                chunk.append(piece)
+                pos += len(piece)
+            data.append(b"".join(chunk))
+        self.stats.returned(sum(len(d) for d in data))
+        return data
+
     async def readable(self):
         return True
 
@@ -115,58 +462,39 @@ class AsyncHTTPIOFile(object):
 
     async def readline(self, size=-1):
         self._assert_open()
-
-        if size < 1 or self._cursor + size > self.length:
-            size = self.length - self._cursor
-
-        if size == 0:
-            return b""
-
-        if self.block_size <= 0:
-            data = await self._read_raw(self._cursor, self._cursor + size)
-
-        else:
-            data = b''
-            while len(data) < size:
-                async for sector in self._read_cached(size,
-                                                      max_raw_reads=1):
-                    data += sector
-                    if b'\n' in sector:
-                        break
-                if b'\n' in sector:
-                        break
-
-        data = data.splitlines(True)[0]
-        self._cursor += len(data)
-        return data
+        await self._ensure_length()
+
+        buffer = self._line_buffer_at_cursor()
+        pos = 0
+        while True:
+            newline = buffer.find(b'\n', pos)
+            if newline >= 0:
+                n = newline + 1
+                break
+            pos = len(buffer)
+            if 0 < size <= pos or not await self._fill_line_buffer():
+                n = pos
+                break
+        if size > 0:
+            n = min(n, size)
+
+        line = bytes(buffer[:n])
+        del buffer[:n]
+        self._line_start += n
+        self._cursor += n
+        self.stats.returned(n)
+        return line
 
     async def readlines(self, hint=-1):
         self._assert_open()
 
-        if hint < 1 or self._cursor + hint > self.length:
-            hint = self.length - self._cursor
-
-        if hint == 0:
-            yield b""
-        else:
-            if self.block_size <= 0:
-                data = await self._read_raw(self._cursor, self._cursor + hint)
-                for line in data.splitlines(True):
-                    yield line
-            else:
-                data = b''
-                while len(data) < hint:
-                    async for sector in self._read_cached(hint,
-                                                          max_raw_reads=1):
-                        for line in sector.splitlines(True):
-                            data += line
-                            if data.endswith(b'\n'):
-                                yield data
-                                hint -= len(data)
-                                self._cursor += len(data)
-                                data = b''
-                self._cursor += len(data)
-                yield data
+        total = 0
+        while hint < 1 or total < hint:
+            line = await self.readline()
+            if not line:
+                break
+            total += len(line)
+            yield line
 
     async def seek(self, offset, whence=0):
         self._assert_open()
@@ -175,10 +503,15 @@ class AsyncHTTPIOFile(object):
         elif whence == 1:
             self._cursor += offset
         elif whence == 2:
+            if self.length is None:
+                # A suffix range fetches the tail without knowing the length
+                self._prefetched.append(await self._probe(-max(-offset, self.tail_size, 1)))
             self._cursor = self.length + offset
         else:
             raise HTTPIOError("Invalid argument: whence=%r" % whence)
-        if not (0 <= self._cursor <= self.length):
+        # A lazily opened file checks the position once it knows its length
+        length = self._cursor if self.length is None else self.length
+        if not (0 <= self._cursor <= length):
             raise HTTPIOError("Invalid argument: cursor=%r" % self._cursor)
         return self._cursor
 
@@ -192,95 +525,617 @@ class AsyncHTTPIOFile(object):
     async def write(self, *args, **kwargs):
         raise HTTPIOError("Writing not supported on http resource")
 
+    def _line_buffer_at_cursor(self):
+        """Return the line buffer, trimmed to start at the cursor"""
+        offset = self._cursor - self._line_start
+        if 0 <= offset <= len(self._line_buffer):
+            del self._line_buffer[:offset]
+        else:
+            del self._line_buffer[:]
+        self._line_start = self._cursor
+        return self._line_buffer
+
+    async def _fill_line_buffer(self):
+        """Append the next chunk of the file to the line buffer, returning
+        `False` at the end of the file"""
+        start = self._line_start + len(self._line_buffer)
+        end = min(start + (self.block_size if self.block_size > 0 else STREAM_CHUNK_SIZE),
+                  self.length)
+        if start >= end:
+            return False
+        data = await self._read_prefetched(start, end)
+        if data is not None:
+            self._line_buffer += data
+        elif self.block_size <= 0:
+            self._line_buffer += await self._read_shared(start, end)
+        else:
+            async for sector in self._read_cached(end - start, position=start):
+                self._line_buffer += sector
+        return True
+
     async def _read_impl(self, size=-1, max_raw_reads=-1, peek=False):
         self._assert_open()
 
+        if self.length is None:
+            data = await self._read_first(size)
+            if not peek:
+                self._cursor += len(data)
+            self.stats.returned(len(data))
+            return data
+
         if size < 1 or self._cursor + size > self.length:
             size = self.length - self._cursor
 
-        if size == 0:
+        if size <= 0:
             return b""
 
-        if self.block_size <= 0:
-            data = await self._read_raw(self._cursor, self._cursor + size)
+        data = await self._read_prefetched(self._cursor, self._cursor + size)
+        if data is not None:
+            pass
+
+        elif self.block_size <= 0:
+            data = await self._read_shared(self._cursor, self._cursor + size)
 
         else:
-            data = b''
-            async for sector in self._read_cached(size,
-                                                  max_raw_reads=max_raw_reads):
-                data += sector
+            data = b''.join([sector async for sector in self._read_cached(size,
+                                                                          max_raw_reads=max_raw_reads)])
 
         if not peek:
             self._cursor += len(data)
+        self.stats.returned(len(data))
         return data
 
     async def _readinto_impl(self, b, max_raw_reads=-1):
         self._assert_open()
 
-        size = len(b)
+        view = memoryview(b).cast('B')
+        size = len(view)
+        if size == 0:
+            return 0
+
+        if self.length is None:
+            data = await self._read_first(size)
+            view[:len(data)] = data
+            self._cursor += len(data)
+            self.stats.returned(len(data))
+            return len(data)
 
         if self._cursor + size > self.length:
             size = self.length - self._cursor
 
-        if size == 0:
+        if size <= 0:
             return 0
 
-        if self.block_size <= 0:
-            b[:size] = await self._read_raw(self._cursor, self._cursor + size)
-            return size
+        data = await self._read_prefetched(self._cursor, self._cursor + size)
+        if data is not None:
+            view[:size] = data
+            n = size
+
+        elif self.block_size <= 0:
+            data = self._join_raw(self._cursor, self._cursor + size)
+            if data is not None:
+                view[:size] = await data
+                n = size
+            elif self.coalesce > 0:
+                data = await self._read_shared(self._cursor, self._cursor + size)
+                n = len(data)
+                view[:n] = data
+            else:
+                n = await self._read_raw_into(self._cursor, self._cursor + size, view[:size])
 
         else:
             n = 0
             async for sector in self._read_cached(size,
                                                   max_raw_reads=max_raw_reads):
-                b[n:n+len(sector)] = sector
+                view[n:n+len(sector)] = sector
                 n += len(sector)
 
-            return n
-
-    async def _read_cached(self, size, max_raw_reads=-1):
-        sector0, offset0 = divmod(self._cursor, self.block_size)
-        sector1, offset1 = divmod(self._cursor + size - 1, self.block_size)
+        self._cursor += n
+        self.stats.returned(n)
+        return n
+
+    def _bind(self, length, validator):
+        """Record the length and validator of the resource, and bind the
+        cache to this version of it"""
+        self.length = length
+        self.validator = validator
+        self._cache = self._cache.bind(self.url, self.validator,
+                                       self.block_size, self.length)
+        self.stats.cache = self._cache
+
+    async def _ensure_length(self):
+        """Learn the length of a file opened lazily by fetching the block
+        (or byte) at the current position"""
+        if self.length is None:
+            start = self._cursor - self._cursor % max(self.block_size, 1)
+            await self._probe(start, self._align(start + 1))
+
+    def _align(self, end):
+        """Round `end` up to a block boundary if caching is enabled"""
+        if self.block_size <= 0:
+            return end
+        return -(-end // self.block_size) * self.block_size
+
+    async def _read_first(self, size):
+        """Read `size` bytes, or to the end if `size` is negative, from a
+        file opened lazily, learning its length from the response"""
+        start = self._cursor - self._cursor % max(self.block_size, 1)
+        end = self._align(self._cursor + size) if size > 0 else None
+        start, data = await self._probe(start, end)
+        offset = self._cursor - start
+        return data[offset:offset + size if size > 0 else None]
+
+    async def _read_prefetched(self, start, end):
+        """Return `[start, end)` if it lies within data fetched at open, the
+        tail of the file or the bytes kept after the last unbuffered read,
+        fetching the tail if need be, or `None`"""
+        spill = self._spill
+        for span_start, data in self._prefetched + ([spill] if spill else []):
+            if span_start <= start and end <= span_start + len(data):
+                return data[start - span_start:end - span_start]
+        if self.tail_size > 0 and start >= self.length - self.tail_size:
+            span_start, data = await self._probe(-self.tail_size)
+            self._prefetched.append((span_start, data))
+            return data[start - span_start:end - span_start]
+        return None
+
+    async def _probe(self, start, end=None):
+        """Fetch from `start` to `end`, or to the end if `end` is `None`,
+        taking the length and validator from the response in place of a
+        HEAD request. A negative `start` asks for that many bytes from the
+        end. Returns a `(start, data)` pair, and caches the data if caching
+        is enabled."""
+        start, data, length, validator = await self._retrying(self._get_span, start, end)
+        if self.length is None:
+            self._bind(length, self._known[1] or validator)
+        if self.block_size > 0:
+            self._store_blocks(start, data)
+        return start, data
+
+    async def _get_span(self, start, end):
+        """Make the request for `_probe()`, returning the start and data of
+        the span sent, and the length and validator of the resource"""
+        if start < 0:
+            header = "bytes=%d" % start
+        elif end is None:
+            header = "bytes=%d-" % start
+        else:
+            header = format_range_header([(start, end)])
+        with self.stats.request(self.url, header) as request:
+            async with self._session.get(self.url, **self._request_kwargs(header)) as response:
+                request.first_byte()
+                content_range = response.headers.get('Content-Range')
+                if response.status == 416:
+                    # The range starts at or past the end, as for an empty file
+                    length = parse_unsatisfied_range(content_range)
+                    start, data = max(start, 0), b""
+                else:
+                    response.raise_for_status()
+                    span = parse_content_range(content_range)
+                    if response.status != 206 or span is None or (start >= 0 and span[0] != start):
+                        raise HTTPIOError("Server does not accept 'Range' headers")
+                    start, length = span[0], span[2]
+                    data = await response.read()
+                    request.received(len(data))
+            if length is None:
+                raise HTTPIOError("Server does not report content length")
+            return (start, data, length,
+                    response.headers.get('ETag') or response.headers.get('Last-Modified'))
+
+    def _cache_streamed(self, start, buffer):
+        """Cache the whole blocks at the front of `buffer`, which holds data
+        streamed from `start`, returning where the data left in it starts"""
+        blocks = self._store_blocks(start, bytes(buffer))
+        if not blocks:
+            return start
+        end = min((max(blocks) + 1) * self.block_size, self.length)
+        del buffer[:end - start]
+        return end
+
+    def _pread_end(self, offset, size):
+        if offset < 0:
+            raise HTTPIOError("Invalid argument: offset=%r" % offset)
+        return self.length if size < 0 else min(offset + size, self.length)
+
+    async def _read_cached(self, size, max_raw_reads=-1, position=None,
+                           schedule_readahead=True):
+        """Yield the sectors of the `size` bytes at `position`, or at the
+        cursor if `position` is `None`"""
+        if position is None:
+            position = self._cursor
+        sector0, offset0 = divmod(position, self.block_size)
+        sector1, offset1 = divmod(position + size - 1, self.block_size)
         offset1 += 1
         sector1 += 1
 
-        raw_reads = 0
+        # Look up every cached sector up front, so that blocks fetched
+        # below cannot evict ones we have already found
+        blocks, missing = self._lookup(sector0, sector1)
+        if self.adaptive is not None and schedule_readahead:
+            self.adaptive.record_read(position, position + size)
+            fetch_size = self.adaptive.fetch_size(size)
+            if fetch_size > size:
+                missing = self._extend_runs(missing, sector1, position + fetch_size)
+        if self.coalesce > 0:
+            missing = coalesce(missing, self.coalesce // self.block_size)
+
+        # Start fetching the missing sectors which are not already being
+        # fetched, by read-ahead or by other readers, whose tasks are
+        # awaited instead. Without a limit on raw reads, runs larger than
+        # `MIN_SPLIT_SIZE` are split so that `concurrency` requests share
+        # the work.
+        runs = _without(missing, self._inflight)
+        own = set()
+        if len(runs) > 1 and self.multipart and self._multipart is not False:
+            own.add(self._fetch_blocks_multi(runs))
+            runs = []
+        elif max_raw_reads >= 0:
+            runs = runs[:max_raw_reads]
+        else:
+            runs = self._split_runs(runs)
+        for start, end in runs:
+            own.add(self._fetch_blocks(start, end))
+
+        # Tasks remove themselves from _inflight when done, so note which
+        # task each missing run is waiting on
+        tasks = _RunMap()
+        for start, end in missing:
+            for run in self._inflight.overlapping(start, end):
+                tasks.assign(*run)
+
+        if self.readahead > 0 and schedule_readahead:
+            sequential = position == self._last_read_end
+            self._last_read_end = position + size
+            self._schedule_readahead(sector0, sector1, sequential)
 
         for idx in range(sector0, sector1):
-            if idx not in self._cache:
-                if max_raw_reads == raw_reads:
+            block = blocks.get(idx)
+            if block is None:
+                task = tasks.get(idx)
+                if task is None:
                     break
-
-                end = idx + 1
-                while end < sector1 and end not in self._cache:
-                    end += 1
-
-                read_data = await self._read_raw(
-                    self.block_size * idx,
-                    self.block_size * end
-                )
-                raw_reads += 1
-
-                for i in range(end - idx):
-                    self._cache[idx + i] = read_data[
-                        self.block_size * i:
-                        self.block_size * (i + 1)
-                    ]
+                # Other readers may be waiting on the same task
+                try:
+                    block = (await asyncio.shield(task))[idx]
+                except Exception:
+                    # Fetch again what another reader failed to fetch,
+                    # rather than fail on its behalf
+                    if (task in own or max_raw_reads >= 0 or
+                            not task.done() or task.cancelled()):
+                        raise
+                    stop = tasks.overlapping(idx, sector1)[0][1]
+                    retry = self._fetch_blocks(idx, stop)
+                    own.add(retry)
+                    tasks.assign(idx, stop, retry)
+                    block = (await asyncio.shield(retry))[idx]
 
             start = offset0 if idx == sector0 else None
             end = offset1 if idx == (sector1 - 1) else None
-            yield self._cache[idx][start:end]
+            yield block[start:end]
+
+    def _extend_runs(self, runs, sector1, end):
+        """Extend the last of `runs`, if it ends at `sector1`, over the
+        blocks missing from there to the one holding byte `end - 1`"""
+        if not runs or runs[-1][1] != sector1:
+            return runs
+        stop = min(-(-end // self.block_size), -(-self.length // self.block_size))
+        more = self._cache.missing(sector1, stop, record=False)
+        if more and more[0][0] == sector1:
+            runs = runs[:-1] + [(runs[-1][0], more[0][1])]
+        return runs
+
+    def _join_raw(self, start, end):
+        """Return an awaitable for the bytes `[start, end)` if an unbuffered
+        read in progress covers them, or `None`"""
+        for (run_start, run_end), task in self._raw_inflight.items():
+            if run_start <= start and end <= run_end:
+                return self._slice_task(task, start - run_start, end - run_start)
+        return None
+
+    async def _slice_task(self, task, start, end):
+        return (await asyncio.shield(task))[start:end]
+
+    async def _read_shared(self, start, end):
+        """Read the bytes `[start, end)` unbuffered, awaiting a read of the
+        same bytes already in progress rather than requesting them again.
+        Up to `coalesce` bytes more are fetched and kept for a following
+        read."""
+        data = self._join_raw(start, end)
+        if data is not None:
+            return await data
+
+        stop = min(end + self.coalesce, self.length)
+        task = asyncio.ensure_future(self._read_raw(start, stop))
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._raw_inflight[(start, stop)] = task
+        try:
+            data = await asyncio.shield(task)
+        finally:
+            if self._raw_inflight.get((start, stop)) is task:
+                del self._raw_inflight[(start, stop)]
+        if len(data) > end - start:
+            self._spill = (end, data[end - start:])
+            data = data[:end - start]
+        return data
+
+    def _lookup(self, sector0, sector1):
+        """Return the cached blocks in `[sector0, sector1)` and the runs of
+        blocks missing from the cache"""
+        runs = self._cache.missing(sector0, sector1)
+        blocks = {}
+        evicted = []
+        pos = sector0
+        for start, end in runs + [(sector1, sector1)]:
+            for idx in range(pos, start):
+                block = self._cache.get(idx)
+                if block is None:
+                    evicted.append((idx, idx + 1))
+                else:
+                    blocks[idx] = block
+            pos = end
+        if evicted:
+            runs = coalesce(runs + evicted)
+        self.stats.looked_up(self.url, len(blocks), runs)
+        return blocks, runs
+
+    def _split_runs(self, runs):
+        """Split `runs` into pieces for up to `concurrency` requests to
+        share, none smaller than `MIN_SPLIT_SIZE` bytes"""
+        nblocks = sum(end - start for start, end in runs)
+        max_blocks = max(-(-nblocks // self.concurrency),
+                         -(-MIN_SPLIT_SIZE // self.block_size))
+        pieces = []
+        for start, end in runs:
+            for idx in range(start, end, max_blocks):
+                pieces.append((idx, min(idx + max_blocks, end)))
+        return pieces
+
+    def _schedule_readahead(self, sector0, sector1, sequential):
+        # The window starts at twice the size of the first sequential
+        # read and doubles on every further one, up to `readahead` blocks
+        if not sequential:
+            self._readahead_window = 0
+            return
+        self._readahead_window = min(
+            self.readahead,
+            max(2 * self._readahead_window, 2 * (sector1 - sector0)))
+
+        stop = min(sector1 + self._readahead_window,
+                   -(-self.length // self.block_size))
+        runs = _without(self._cache.missing(sector1, stop, record=False), self._inflight)
+        for start, end in self._split_runs(runs):
+            self._fetch_blocks(start, end)
+
+    def _fetch_blocks(self, sector0, sector1):
+        """Start a task fetching the given run of blocks into the cache"""
+        task = asyncio.ensure_future(self._do_fetch_blocks(sector0, sector1))
+        # Nobody may wait on a read-ahead task, so retrieve its exception
+        # here to stop asyncio complaining that it was never retrieved
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._inflight.assign(sector0, sector1, task)
+        return task
+
+    async def _do_fetch_blocks(self, sector0, sector1):
+        try:
+            # The run is read into one slab, and the blocks cached are
+            # views of it, so the data is not copied again
+            start = self.block_size * sector0
+            end = min(self.block_size * sector1, self.length)
+            slab = memoryview(bytearray(end - start))
+            async with self._semaphore:
+                slab = slab[:await self._read_raw_into(start, end, slab)]
+            blocks = {}
+            for idx in range(sector1 - sector0):
+                block = slab[self.block_size * idx:
+                             self.block_size * (idx + 1)]
+                if not len(block):
+                    break
+                blocks[sector0 + idx] = block
+                self._cache.put(sector0 + idx, block)
+            return blocks
+        finally:
+            self._inflight.discard(sector0, sector1)
+
+    def _fetch_blocks_multi(self, runs):
+        """Start a task fetching several runs of blocks with multi-range requests"""
+        task = asyncio.ensure_future(self._do_fetch_blocks_multi(runs))
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        for start, end in runs:
+            self._inflight.assign(start, end, task)
+        return task
+
+    async def _do_fetch_blocks_multi(self, runs):
+        try:
+            blocks = {}
+            for i in range(0, len(runs), MAX_RANGES_PER_REQUEST):
+                spans = [(self.block_size * start,
+                          min(self.block_size * end, self.length))
+                         for start, end in runs[i:i + MAX_RANGES_PER_REQUEST]]
+                try:
+                    async with self._semaphore:
+                        async for start, data in self._read_raw_multi(spans):
+                            blocks.update(self._store_blocks(start, data))
+                except Exception as e:
+                    # The runs not yet received are retried one at a time
+                    if self.retries.total <= 0 or not _is_retryable(e, self.retries):
+                        raise
+
+            # Fall back to one request per run for anything not returned
+            for start, end in runs:
+                if any(idx not in blocks for idx in range(start, end)):
+                    data = await self._read_raw_limited(self.block_size * start,
+                                                        self.block_size * end)
+                    blocks.update(self._store_blocks(self.block_size * start, data))
+            return blocks
+        finally:
+            for start, end in runs:
+                self._inflight.discard(start, end)
+
+    async def _read_runs_multi(self, runs):
+        """Read several runs of bytes with multi-range requests, falling
+        back to one request per run for any not returned, and return a
+        dict of the data of each run"""
+        chunks = {}
+        for i in range(0, len(runs), MAX_RANGES_PER_REQUEST):
+            spans = runs[i:i + MAX_RANGES_PER_REQUEST]
+            try:
+                async with self._semaphore:
+                    async for start, data in self._read_raw_multi(spans):
+                        _cut_runs(spans, start, data, chunks)
+            except Exception as e:
+                # The runs not yet received are retried one at a time
+                if self.retries.total <= 0 or not _is_retryable(e, self.retries):
+                    raise
+
+        missing = [run for run in runs if run not in chunks]
+        data = await asyncio.gather(*[self._read_raw_limited(*run) for run in missing])
+        chunks.update(zip(missing, data))
+        return chunks
+
+    def _store_blocks(self, start, data):
+        """Cache every whole block within `data`, which begins at `start`"""
+        blocks = {}
+        idx = -(-start // self.block_size)
+        while idx * self.block_size < self.length:
+            block_start = idx * self.block_size
+            block_end = min(block_start + self.block_size, self.length)
+            if block_end > start + len(data):
+                break
+            blocks[idx] = data[block_start - start:block_end - start]
+            self._cache.put(idx, blocks[idx])
+            idx += 1
+        return blocks
+
+    async def _cancel_fetches(self):
+        tasks = set(self._inflight.values()) | set(self._raw_inflight.values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._inflight.clear()
+        self._raw_inflight.clear()
+        self._readahead_window = 0
+
+    async def _read_raw_limited(self, start, end):
+        async with self._semaphore:
+            return await self._read_raw(start, end)
 
     async def _read_raw(self, start, end):
-        headers = {"Range": "bytes=%d-%d" % (start, end - 1)}
+        buffer = bytearray(end - start)
+        del buffer[await self._read_raw_into(start, end, memoryview(buffer)):]
+        return bytes(buffer)
+
+    async def _read_raw_into(self, start, end, view):
+        """Read from `start` to `end` straight into the writable memoryview
+        `view`, returning the number of bytes read. A failed request is
+        retried, resuming from the last byte received."""
+        n = 0
+        attempt = 0
+        while True:
+            received = n
+            header = format_range_header([(start + n, end)])
+            try:
+                with self.stats.request(self.url, header) as request:
+                    async with self._session.get(self.url,
+                                                 **self._request_kwargs(header)) as response:
+                        request.first_byte()
+                        response.raise_for_status()
+                        try:
+                            async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                                count = min(len(chunk), len(view) - n)
+                                view[n:n + count] = chunk[:count]
+                                n += count
+                                if n == len(view):
+                                    break
+                        finally:
+                            request.received(n - received)
+                if self.adaptive is not None:
+                    self.adaptive.record_request(request.nbytes, request.latency, request.ttfb)
+                if n == len(view) or start + n >= self.length:
+                    return n
+                raise IncompleteRead(view[received:n].tobytes(), len(view) - n)
+            except Exception as e:
+                if not await self._should_retry(attempt, e):
+                    raise
+            attempt += 1
+
+    async def _retrying(self, fn, *args):
+        """Await `fn` with `args`, retrying while it fails with errors that
+        may be retried"""
+        attempt = 0
+        while True:
+            try:
+                return await fn(*args)
+            except Exception as e:
+                if not await self._should_retry(attempt, e):
+                    raise
+            attempt += 1
+
+    async def _should_retry(self, attempt, error):
+        """Return whether to retry after failure number `attempt`, counting
+        from zero, with `error`, having waited the backoff time if so"""
+        if attempt >= self.retries.total or not _is_retryable(error, self.retries):
+            return False
+        await asyncio.sleep(self.retries.delay(attempt, _retry_after(error)))
+        self.stats.retried()
+        return True
+
+    async def _head(self):
+        """Return the length and validator of the resource from a HEAD request"""
+        with self.stats.request(self.url, None) as request:
+            async with self._session.head(self.url, **self._kwargs) as response:
+                request.first_byte()
+                response.raise_for_status()
+                return (int(response.headers.get('content-length', None)),
+                        response.headers.get('ETag') or response.headers.get('Last-Modified'))
+
+    async def _read_raw_multi(self, spans):
+        """Request several spans at once, yielding `(start, data)` pairs as
+        they arrive. The pairs cover whatever the server chose to send."""
+        header = format_range_header(spans)
+        with self.stats.request(self.url, header) as request:
+            async with self._session.get(self.url, **self._request_kwargs(header)) as response:
+                request.first_byte()
+                response.raise_for_status()
+                chunks = self._counted(request, response.content.iter_chunked(STREAM_CHUNK_SIZE))
+                boundary = multipart_boundary(response.headers.get('Content-Type'))
+
+                if response.status == 206 and boundary is not None:
+                    self._multipart = True
+                    parser = MultipartByteranges(boundary)
+                    async for chunk in chunks:
+                        for part in parser.feed(chunk):
+                            yield part
+                        if parser.done:
+                            break
+                    return
+
+                self._multipart = False
+                if response.status == 206:
+                    span = parse_content_range(response.headers.get('Content-Range'))
+                    if span is None:
+                        raise HTTPIOError("Server sent an invalid Content-Range")
+                    yield span[0], b"".join([chunk async for chunk in chunks])
+                else:
+                    # The server sent the whole resource, which may be far
+                    # larger than the spans; nothing is read from it, and
+                    # the runs are fetched one request at a time instead
+                    response.close()
+
+    @staticmethod
+    async def _counted(request, chunks):
+        async for chunk in chunks:
+            request.received(len(chunk))
+            yield chunk
+
+    def _request_kwargs(self, range_header):
+        # Ranges of an encoded body are ranges of the encoding, so ask
+        # for the identity encoding unless the caller says otherwise
+        headers = {"Range": range_header, "Accept-Encoding": "identity"}
         headers.update(self._kwargs.get("headers", {}))
         kwargs = dict(self._kwargs)
         kwargs['headers'] = headers
-        async with self._session.get(
-                self.url,
-                **kwargs) as response:
-            response.raise_for_status()
-            return await response.read()
+        return kwargs
 
     def _assert_open(self):
         if self.closed:
@@ -288,10 +1143,21 @@ class AsyncHTTPIOFile(object):
 
 
 class AsyncHTTPIOFileContextManagerMixin (object):
-    """This is a mixin for HTTPIOFile to make it act as an async context manager via the AsyncHTTPIOFile class"""
+    """This is a mixin for HTTPIOFile to make it act as an async context manager via the AsyncHTTPIOFile class
+
+    The AsyncHTTPIOFile takes the options of the HTTPIOFile, and its length and validator if it has been opened,
+    so that no HEAD request is made again. It is given the cache the HTTPIOFile was given, and shares its blocks;
+    a cache the HTTPIOFile owns is not closed when the AsyncHTTPIOFile is, so the HTTPIOFile keeps its blocks.
+    To read through one event loop from blocking code, see `httpio_async.blocking.BlockingHTTPIOFile`."""
 
     async def __aenter__(self):
-        self.__acontextmanager = AsyncHTTPIOFile(self.url, self.block_size, **self._kwargs)
+        length, etag = self._known if self.length is None else (self.length, self.validator)
+        self.__acontextmanager = AsyncHTTPIOFile(
+            self.url, self.block_size, cache=self._given_cache, readahead=self.readahead,
+            multipart=self.multipart, length=length, etag=etag, lazy=self.lazy, prefetch_head=self.prefetch_head,
+            prefetch_tail=self.prefetch_tail, tail_size=self.tail_size, retries=self.retries,
+            stats=self.stats, adaptive=self.adaptive, coalesce=self.coalesce, **self._kwargs)
+        self.__acontextmanager._borrowed_cache = self._given_cache
         return await self.__acontextmanager.__aenter__()
 
     async def __aexit__(self, exc_type, exc, tb):
@@ -0,0 +1,198 @@
+"""Blocking file objects backed by `AsyncHTTPIOFile`.
+
+Libraries such as `zipfile`, `tarfile` and `pyarrow` need a synchronous
+file object. `BlockingHTTPIOFile` is an `io.BufferedIOBase` whose methods
+run the coroutines of an `AsyncHTTPIOFile` on an event loop in a
+background thread, an `EventLoopThread`, and wait for their results. The
+files run on one loop share its `aiohttp` connection pool, and with a
+shared `cache` their blocks too, while each still gets the concurrent
+fetches, read-ahead and single-flight reads of `AsyncHTTPIOFile`.
+"""
+
+import asyncio
+import threading
+
+from io import BufferedIOBase
+
+from httpio import HTTPIOError
+from httpio_async import AsyncHTTPIOFile, make_session
+
+__all__ = ["BlockingHTTPIOFile", "EventLoopThread", "get_shared_loop"]
+
+
+_shared_loop = None
+_shared_loop_lock = threading.Lock()
+
+
+def get_shared_loop():
+    """Return the process-wide `EventLoopThread`, starting it if necessary"""
+    global _shared_loop
+    with _shared_loop_lock:
+        if _shared_loop is None:
+            _shared_loop = EventLoopThread()
+        return _shared_loop
+
+
+class EventLoopThread(object):
+    """
+    An asyncio event loop running in a daemon thread
+
+    Coroutines are run on it from other threads with `run()`. The loop
+    keeps one `aiohttp.ClientSession`, made by `make_session()` when first
+    needed, for every file run on it, so that they share its connections.
+
+    :param session_kwargs: Arguments to pass to `make_session()`.
+    """
+    def __init__(self, **session_kwargs):
+        self.loop = asyncio.new_event_loop()
+        self._session_kwargs = session_kwargs
+        self._session = None
+        self._thread = threading.Thread(target=self._run, name="httpio-event-loop")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __repr__(self):
+        status = "running" if self._thread.is_alive() else "stopped"
+        return "<%s %s at %s>" % (status, type(self).__name__, hex(id(self)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run(self, coro):
+        """Run the coroutine `coro` on the loop, and return its result once
+        it finishes"""
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise HTTPIOError("Cannot wait for the event loop from its own thread")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def session(self):
+        """Return the session shared by the files run on the loop. Await
+        this on the loop."""
+        if self._session is None:
+            self._session = make_session(**self._session_kwargs)
+        return self._session
+
+    def close(self):
+        """Close the shared session and stop the loop"""
+        if not self._thread.is_alive():
+            return
+        if self._session is not None:
+            self.run(self._session.close())
+            self._session = None
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+class BlockingHTTPIOFile(BufferedIOBase):
+    """
+    A blocking, `io.BufferedIOBase` view of an `AsyncHTTPIOFile` whose
+    reads run on an `EventLoopThread`
+
+    The file is opened as it is made. Reads at the file position are for
+    one thread at a time, but `pread()`, `preadinto()` and `read_ranges()`
+    may be called from many threads at once; reads of blocks already being
+    fetched for another thread wait for that fetch.
+
+    :param url: The URL of the file to open
+    :param block_size: The cache block size, or `-1` to disable caching.
+    :param loop: The `EventLoopThread` to run on, or `None` for the one
+        returned by `get_shared_loop()`.
+    :param kwargs: Additional arguments to pass to `AsyncHTTPIOFile`, such
+        as `cache`, `readahead` or `concurrency`. Unless a `session` is
+        given, the loop's shared session is used. Pass
+        `httpio.get_shared_cache()` as `cache` to share blocks with other
+        files opened on the same resource, blocking or not.
+    """
+    def __init__(self, url, block_size=-1, loop=None, **kwargs):
+        super(BlockingHTTPIOFile, self).__init__()
+        self.url = url
+        self.block_size = block_size
+        self._loop = get_shared_loop() if loop is None else loop
+        self._closing = False
+        self._file = None
+        self._file = self._loop.run(self._open(url, block_size, kwargs))
+
+    async def _open(self, url, block_size, kwargs):
+        if kwargs.get('session') is None:
+            kwargs['session'] = await self._loop.session()
+        f = AsyncHTTPIOFile(url, block_size, **kwargs)
+        await f.open()
+        return f
+
+    def __repr__(self):
+        status = "closed" if self.closed else "open"
+        return "<%s %s %r at %s>" % (status, type(self).__name__, self.url, hex(id(self)))
+
+    @property
+    def length(self):
+        return self._file.length
+
+    @property
+    def stats(self):
+        return self._file.stats
+
+    def close(self):
+        self._closing = True
+        if not self.closed and self._file is not None:
+            self._loop.run(self._file.close())
+        super(BlockingHTTPIOFile, self).close()
+
+    def flush(self):
+        # IOBase.close() flushes; that must not empty a shared cache
+        if self._closing:
+            return
+        self._loop.run(self._file.flush())
+
+    def peek(self, size=0):
+        return self._loop.run(self._file.peek(size))
+
+    def read(self, size=-1):
+        return self._loop.run(self._file.read(-1 if size is None else size))
+
+    def read1(self, size=-1):
+        return self._loop.run(self._file.read1(-1 if size is None else size))
+
+    def readinto(self, b):
+        return self._loop.run(self._file.readinto(b))
+
+    def readinto1(self, b):
+        return self._loop.run(self._file.readinto1(b))
+
+    def readline(self, size=-1):
+        return self._loop.run(self._file.readline(-1 if size is None else size))
+
+    def pread(self, offset, size=-1):
+        """Read up to `size` bytes at `offset`, without using or moving the
+        file position"""
+        return self._loop.run(self._file.pread(offset, size))
+
+    def preadinto(self, b, offset):
+        """Read into the buffer `b` at `offset`, without using or moving the
+        file position, and return the number of bytes read"""
+        return self._loop.run(self._file.preadinto(b, offset))
+
+    def read_ranges(self, ranges, max_gap=None):
+        """Read several byte ranges at once, without moving the file
+        position; see `AsyncHTTPIOFile.read_ranges()`"""
+        return self._loop.run(self._file.read_ranges(ranges, max_gap))
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=0):
+        return self._loop.run(self._file.seek(offset, whence))
+
+    def tell(self):
+        return self._loop.run(self._file.tell())
@@ -6,7 +6,8 @@ packages = {
 }
 install_requires = [
     'requests >= 2.10.0',
-    'six'
+    'six',
+    'futures; python_version < "3.2"'
 ]
 
 if version_info[0] > 3 or (version_info[0] == 3 and version_info[1] >= 6):
@@ -0,0 +1,215 @@
+"""A local HTTP server for tests and benchmarks.
+
+`RangeServer` serves in-memory resources with support for single, suffix
+and multiple byte ranges (answered with ``multipart/byteranges``), and can
+inject faults into its responses. It can also delay each response by a
+round-trip time and pace each body to a bandwidth, so that the cost of
+requests and of transfer can be measured without a real network. The
+shaping is per connection: the server does not model congestion between
+connections or the TCP handshake.
+"""
+
+import re
+import socket
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+# The size of the pieces a body is written in
+CHUNK_SIZE = 16 * 1024
+
+BOUNDARY = "httpio-test-boundary"
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class RangeServer(object):
+    """
+    Serve `data` at `url`, and `resources`, a mapping of paths to bytes,
+    at `url_for(path)`, until stopped
+
+    Each request takes the first of `faults`, if any, which may be:
+
+    - `('status', code)` to answer with that status code
+    - `('truncate', count)` to send only `count` bytes of the body and
+      then close the connection
+    - `('reset',)` to close the connection without answering
+
+    :param etag: The ETag of every resource.
+    :param rtt: The delay before each response, in seconds.
+    :param bandwidth: The rate each body is sent at, in bytes per second,
+        or `None` for no limit.
+    """
+    def __init__(self, data=None, etag='"v1"', resources=None, rtt=0.0, bandwidth=None):
+        self.resources = dict(resources or {})
+        if data is not None:
+            self.data = data
+        self.etag = etag
+        self.rtt = rtt
+        self.bandwidth = bandwidth
+        self.faults = []
+        # `(method, Range header)` of each request, and the body bytes sent
+        self.requests = []
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._server = _Server(('127.0.0.1', 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+
+    @property
+    def data(self):
+        return self.resources['/data']
+
+    @data.setter
+    def data(self, data):
+        self.resources['/data'] = data
+
+    @property
+    def url(self):
+        return self.url_for('/data')
+
+    def url_for(self, path):
+        return 'http://127.0.0.1:%d%s' % (self._server.server_address[1], path)
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = []
+            self.bytes_sent = 0
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _next_fault(self, method, range_header):
+        with self._lock:
+            self.requests.append((method, range_header))
+            return self.faults.pop(0) if self.faults else None
+
+    def _count(self, nbytes):
+        with self._lock:
+            self.bytes_sent += nbytes
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                # Headers and body are separate writes; without this,
+                # Nagle's algorithm and delayed ACKs add 40ms to requests
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def do_HEAD(self):
+                self._respond(send_body=False)
+
+            def do_GET(self):
+                self._respond(send_body=True)
+
+            def _respond(self, send_body):
+                range_header = self.headers.get('Range')
+                fault = server._next_fault(self.command, range_header)
+                if server.rtt:
+                    time.sleep(server.rtt)
+                if fault is not None and fault[0] == 'reset':
+                    self._reset()
+                    return
+                if fault is not None and fault[0] == 'status':
+                    self._send(fault[1], [('Retry-After', '0')], b'')
+                    return
+
+                data = server.resources.get(self.path)
+                if data is None:
+                    self._send(404, [], b'')
+                    return
+
+                spans = parse_ranges(range_header, len(data))
+                headers = [('Accept-Ranges', 'bytes'), ('ETag', server.etag)]
+                if spans is None:
+                    body, status = data, 200
+                elif not spans:
+                    self._send(416, [('Content-Range', 'bytes */%d' % len(data))], b'')
+                    return
+                elif len(spans) == 1:
+                    start, end = spans[0]
+                    headers.append(('Content-Range', 'bytes %d-%d/%d' % (start, end - 1, len(data))))
+                    body, status = data[start:end], 206
+                else:
+                    headers.append(('Content-Type', 'multipart/byteranges; boundary=' + BOUNDARY))
+                    body, status = multipart_body(data, spans), 206
+
+                if not send_body:
+                    self._send(status, headers, body, send_body=False)
+                elif fault is not None and fault[0] == 'truncate':
+                    self._send(status, headers, body, limit=fault[1])
+                    self._reset()
+                else:
+                    self._send(status, headers, body)
+
+            def _send(self, status, headers, body, send_body=True, limit=None):
+                self.send_response(status)
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if not send_body:
+                    return
+                body = body[:limit]
+                server._count(len(body))
+                for i in range(0, len(body), CHUNK_SIZE):
+                    chunk = body[i:i + CHUNK_SIZE]
+                    self.wfile.write(chunk)
+                    if server.bandwidth:
+                        time.sleep(len(chunk) / float(server.bandwidth))
+
+            def _reset(self):
+                self.wfile.flush()
+                self.connection.shutdown(socket.SHUT_RDWR)
+                self.close_connection = True
+
+        return Handler
+
+
+def parse_ranges(header, length):
+    """Return the spans a `Range` header asks for, clipped to `length`,
+    or `None` if there is no header. Unsatisfiable spans are dropped."""
+    if not header or not header.startswith('bytes='):
+        return None
+    spans = []
+    for spec in header[len('bytes='):].split(','):
+        m = re.match(r'\s*(\d*)-(\d*)\s*$', spec)
+        if not m or not (m.group(1) or m.group(2)):
+            return None
+        if not m.group(1):
+            start, end = max(0, length - int(m.group(2))), length
+        else:
+            start = int(m.group(1))
+            end = min(int(m.group(2)) + 1, length) if m.group(2) else length
+        if start < end:
+            spans.append((start, end))
+    return spans
+
+
+def multipart_body(data, spans):
+    parts = []
+    for start, end in spans:
+        parts.append(('--%s\r\nContent-Type: application/octet-stream\r\n'
+                      'Content-Range: bytes %d-%d/%d\r\n\r\n'
+                      % (BOUNDARY, start, end - 1, len(data))).encode('ascii'))
+        parts.append(data[start:end])
+        parts.append(b'\r\n')
+    parts.append(('--%s--\r\n' % BOUNDARY).encode('ascii'))
+    return b''.join(parts)
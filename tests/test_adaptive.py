@@ -0,0 +1,43 @@
+import unittest
+from unittest import TestCase
+
+from httpio import AdaptiveFetch
+
+
+class TestAdaptiveFetch(TestCase):
+    def test_random_reads_fetch_what_they_need(self):
+        adaptive = AdaptiveFetch()
+        for start in [5000, 100, 90000, 30000]:
+            adaptive.record_read(start, start + 100)
+        self.assertFalse(adaptive.sequential)
+        self.assertEqual(adaptive.fetch_size(100), 100)
+
+    def test_sequential_reads_fetch_twice_the_run(self):
+        adaptive = AdaptiveFetch()
+        for start in range(0, 4000, 1000):
+            adaptive.record_read(start, start + 1000)
+        self.assertTrue(adaptive.sequential)
+        self.assertEqual(adaptive.fetch_size(1000), 8000)
+
+    def test_fetch_size_is_bounded_by_bandwidth_delay(self):
+        adaptive = AdaptiveFetch(max_size=300000)
+        # 10ms to the first byte, then 1 MB/s
+        adaptive.record_request(100000, 0.11, 0.01)
+        self.assertAlmostEqual(adaptive.latency, 0.01)
+        self.assertAlmostEqual(adaptive.throughput, 1e6)
+        for start in range(0, 200000, 10000):
+            adaptive.record_read(start, start + 10000)
+        self.assertEqual(adaptive.fetch_size(10000), 40000)
+        # On a slow link, max_size bounds it instead
+        adaptive.record_request(100000, 10.01, 10)
+        self.assertEqual(adaptive.fetch_size(10000), 300000)
+
+    def test_small_bodies_do_not_measure_throughput(self):
+        adaptive = AdaptiveFetch()
+        adaptive.record_request(100, 0.02, 0.01)
+        self.assertIsNone(adaptive.throughput)
+        self.assertAlmostEqual(adaptive.latency, 0.01)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,9 @@
 import asyncio
 from unittest import TestCase
 
-from httpio import HTTPIOFile
+from httpio import ArenaBlockCache, HTTPIOFile, IOStats, LRUBlockCache, SharedBlockCache
+import httpio_async
+from httpio_async import AsyncHTTPIOFile
 
 import mock
 import random
@@ -34,6 +36,27 @@ ASCII_DATA = b''.join(line.encode('ascii') for line in ASCII_LINES)
 IOBaseError = OSError
 
 
+def multipart_body(data, spans, boundary):
+    body = b''
+    for start, end in spans:
+        body += (b'--' + boundary + b'\r\n' +
+                 b'Content-Type: application/octet-stream\r\n' +
+                 ('Content-Range: bytes %d-%d/%d\r\n\r\n' % (
+                     start, end - 1, len(data))).encode('ascii') +
+                 data[start:end] + b'\r\n')
+    return body + b'--' + boundary + b'--\r\n'
+
+
+class StreamContent(object):
+    """Enough of aiohttp.StreamReader to stream a response body"""
+    def __init__(self, data):
+        self.data = data
+
+    async def iter_chunked(self, n):
+        for i in range(0, len(self.data), min(n, 1000)):
+            yield self.data[i:i + min(n, 1000)]
+
+
 class HTTPException(Exception):
     pass
 
@@ -94,6 +117,8 @@ class TestAsyncHTTPIOFile(TestCase):
 
         self.data_source = DATA
         self.error_code = None
+        self.etag = None
+        self.multipart = False
 
         def _head(url, **kwargs):
             m = AsyncContextManagerMock()
@@ -103,6 +128,8 @@ class TestAsyncHTTPIOFile(TestCase):
                                                   len(self.data_source),
                                                   'Accept-Ranges':
                                                   'bytes'}
+                if self.etag is not None:
+                    m.async_context_object.headers['ETag'] = self.etag
             else:
                 m.async_context_object.status_code = self.error_code
                 m.async_context_object.raise_for_status = mock.MagicMock(side_effect=HTTPException)
@@ -114,18 +141,35 @@ class TestAsyncHTTPIOFile(TestCase):
             (start, end) = (None, None)
             if 'headers' in kwargs:
                 if 'Range' in kwargs['headers']:
-                    m = re.match(r'bytes=(\d+)-(\d+)',
+                    m = re.match(r'bytes=(\d*)-(\d*)$',
                                  kwargs['headers']['Range'])
-                    if m:
+                    if m and not m.group(1):
+                        # A suffix range
+                        start = max(0, len(self.data_source) - int(m.group(2)))
+                        end = len(self.data_source)
+                    elif m:
                         start = int(m.group(1))
-                        end = int(m.group(2)) + 1
-
-            if self.error_code is None:
+                        end = int(m.group(2) or len(self.data_source) - 1) + 1
+                        end = min(end, len(self.data_source))
+
+            headers = {}
+            if start is not None:
+                headers['Content-Range'] = 'bytes %d-%d/%d' % (start, end - 1, len(self.data_source))
+            if self.etag is not None:
+                headers['ETag'] = self.etag
+
+            if self.error_code is None and ',' in kwargs.get('headers', {}).get('Range', ''):
+                return self._multi_range_response(kwargs['headers']['Range'])
+            elif self.error_code is None and start is not None and start >= len(self.data_source):
+                return AsyncContextManagerMock(async_context_object=mock.MagicMock(
+                    status=416, headers={'Content-Range': 'bytes */%d' % len(self.data_source)}))
+            elif self.error_code is None:
                 return AsyncContextManagerMock(
-                    async_context_object=mock.MagicMock(status_code=200,
+                    async_context_object=mock.MagicMock(status=206, headers=headers,
                                                         read=mock.MagicMock(
                                                             side_effect=async_func(
-                                                                lambda: self.data_source[start:end]))))
+                                                                lambda: self.data_source[start:end])),
+                                                        content=StreamContent(self.data_source[start:end])))
             else:
                 return AsyncContextManagerMock(
                     async_context_object=mock.MagicMock(
@@ -137,6 +181,22 @@ class TestAsyncHTTPIOFile(TestCase):
         for key in self.patchers:
             self.mocks[key] = self.patchers[key].stop()
 
+    def _multi_range_response(self, header):
+        spans = [(int(start), int(end) + 1)
+                 for start, end in re.findall(r'(\d+)-(\d+)', header)]
+        if self.multipart:
+            body = multipart_body(self.data_source, spans, b'BOUNDARY')
+            headers = {'Content-Type': 'multipart/byteranges; boundary=BOUNDARY'}
+            status = 206
+        else:
+            body = self.data_source
+            headers = {}
+            status = 200
+        return AsyncContextManagerMock(
+            async_context_object=mock.MagicMock(status=status,
+                                                headers=headers,
+                                                content=StreamContent(body)))
+
     @async_test
     async def test_throws_exception_when_head_returns_error(self):
         self.error_code = 404
@@ -144,6 +204,33 @@ class TestAsyncHTTPIOFile(TestCase):
             async with HTTPIOFile('http://www.example.com/test/', 1024):
                 pass
 
+    @async_test
+    async def test_context_manager_takes_options(self):
+        stats = IOStats()
+        sync = HTTPIOFile('http://www.example.com/test/', 1024, length=len(DATA),
+                          etag='"v1"', retries=2, stats=stats)
+        async with sync as io:
+            self.assertEqual(io.retries.total, 2)
+            self.assertIs(io.stats, stats)
+            self.assertEqual(await io.read(100), DATA[:100])
+        self.session.head.assert_not_called()
+        self.assertEqual(stats.requests, 1)
+
+    @async_test
+    async def test_context_manager_leaves_private_caches_alone(self):
+        for cache in [LRUBlockCache(), ArenaBlockCache(64*1024)]:
+            cache = cache.bind('http://www.example.com/test/', None, 1024, len(DATA))
+            for idx in range(4):
+                cache.put(idx, DATA[idx * 1024:(idx + 1) * 1024])
+            sync = HTTPIOFile('http://www.example.com/test/', 1024, cache)
+            async with sync as io:
+                self.assertIs(io._cache, cache)
+                self.session.reset_mock()
+                self.assertEqual(await io.read(4096), DATA[:4096])
+                self.session.get.assert_not_called()
+            self.assertEqual(len(cache), 4)
+            self.assertEqual(cache.get(3), DATA[3072:4096])
+
     @async_test
     async def test_read_after_close_fails(self):
         async with HTTPIOFile('http://www.example.com/test/', 1024) as io:
@@ -197,6 +284,32 @@ class TestAsyncHTTPIOFile(TestCase):
                 await io.read(1024)
             self.assertEqual(await io.tell(), 0)
 
+    @async_test
+    async def test_coalesce_keeps_bytes_after_unbuffered_reads(self):
+        headers = []
+        stats = IOStats(on_request_start=lambda url, header: headers.append(header))
+        async with AsyncHTTPIOFile('http://www.example.com/test/', stats=stats,
+                                   coalesce=1000) as io:
+            await io.seek(5000)
+            self.assertEqual(await io.read(10), DATA[5000:5010])
+            self.assertEqual(await io.pread(5300, 10), DATA[5300:5310])
+            self.assertEqual(await io.pread(6100, 10), DATA[6100:6110])
+        self.assertEqual(headers, [None, 'bytes=5000-6009', 'bytes=6100-7109'])
+
+    @async_test
+    async def test_stats_count_requests_bytes_and_lookups(self):
+        misses = []
+        stats = IOStats(on_cache_miss=lambda url, start, stop: misses.append((start, stop)))
+        async with AsyncHTTPIOFile('http://www.example.com/test/', 1024, stats=stats) as io:
+            await io.read(1500)
+            await io.seek(0)
+            await io.read(100)
+        self.assertEqual((stats.requests, stats.bytes_fetched, stats.bytes_returned),
+                         (2, 2048, 1600))
+        self.assertEqual((stats.cache_hits, stats.cache_misses), (1, 2))
+        self.assertEqual(misses, [(0, 2)])
+        self.assertEqual(stats.latency.count, 2)
+
     @async_test
     async def test_read1(self):
         async with HTTPIOFile('http://www.example.com/test/', 1024) as io:
@@ -211,6 +324,292 @@ class TestAsyncHTTPIOFile(TestCase):
             self.assertEqual(data, DATA[:2048])
             await io.seek(1536)
 
+    @async_test
+    async def test_read_with_bounded_cache(self):
+        cache = LRUBlockCache(max_blocks=2)
+        async with HTTPIOFile('http://www.example.com/test/', 1024, cache) as io:
+            await io.seek(512)
+            self.assertEqual(await io.read(4096), DATA[512:4608])
+            self.assertEqual(len(cache), 2)
+
+            await io.seek(3584)
+            self.session.reset_mock()
+            self.assertEqual(await io.read(1024), DATA[3584:4608])
+            self.session.get.assert_not_called()
+
+    @async_test
+    async def test_shared_cache_is_shared_between_files(self):
+        cache = SharedBlockCache()
+        self.etag = '"v1"'
+        async with HTTPIOFile('http://www.example.com/test/', 1024, cache) as io:
+            self.assertEqual(await io.read(2048), DATA[:2048])
+        self.session.reset_mock()
+        async with HTTPIOFile('http://www.example.com/test/', 1024, cache) as io:
+            self.assertEqual(await io.read(2048), DATA[:2048])
+            self.session.get.assert_not_called()
+
+    @async_test
+    async def test_session_is_shared_between_files(self):
+        for _ in range(2):
+            async with AsyncHTTPIOFile('http://www.example.com/test/', 1024,
+                                       session=self.session) as io:
+                self.assertEqual(await io.read(1024), DATA[:1024])
+        self.mocks['ClientSession'].assert_not_called()
+        self.assertEqual(self.session.head.call_count, 2)
+
+    @async_test
+    async def test_lazy_open_learns_length_from_first_read(self):
+        self.etag = '"v1"'
+        async with AsyncHTTPIOFile('http://www.example.com/test/', 1024, lazy=True) as io:
+            self.session.head.assert_not_called()
+            self.assertIsNone(io.length)
+            self.assertEqual(await io.read(100), DATA[:100])
+            self.assertEqual(io.length, len(DATA))
+            self.assertEqual(io.validator, '"v1"')
+            self.assertEqual(await io.read(924), DATA[100:1024])
+            self.assertEqual(self.session.get.call_count, 1)
+
+    @async_test
+    async def test_lazy_open_without_cache(self):
+        async with AsyncHTTPIOFile('http://www.example.com/test/', lazy=True) as io:
+            self.assertEqual(await io.seek(-10, SEEK_END), len(DATA) - 10)
+            self.assertEqual(await io.read(), DATA[-10:])
+            self.session.head.assert_not_called()
+
+    @async_test
+    async def test_open_passes_options_by_keyword(self):
+        cache = LRUBlockCache()
+        io = await httpio_async.open('http://www.example.com/test/', 1024, cache=cache,
+                                     retries=2, coalesce=4096, concurrency=3)
+        async with io:
+            self.assertIs(io._cache, cache)
+            self.assertEqual((io.retries.total, io.coalesce, io.concurrency), (2, 4096, 3))
+            self.assertEqual(await io.read(100), DATA[:100])
+
+    def test_options_are_keyword_only(self):
+        with self.assertRaises(TypeError):
+            AsyncHTTPIOFile('http://www.example.com/test/', 1024, LRUBlockCache())
+
+    @async_test
+    async def test_lazy_open_empty_readinto(self):
+        async with AsyncHTTPIOFile('http://www.example.com/test/', 1024, lazy=True) as io:
+            self.assertEqual(await io.readinto(bytearray(0)), 0)
+            self.assertIsNone(io.length)
+            self.session.get.assert_not_called()
+            self.assertEqual(await io.read(100), DATA[:100])
+
+    @async_test
+    async def test_known_length_skips_probe(self):
+        async with AsyncHTTPIOFile('http://www.example.com/test/', 1024,
+                                   length=len(DATA), etag='"v1"') as io:
+            self.assertEqual(io.validator, '"v1"')
+            self.assertEqual(await io.read(1024), DATA[:1024])
+            self.session.head.assert_not_called()
+            self.assertEqual(self.session.get.call_count, 1)
+
+    @async_test
+    async def test_prefetch_head_and_tail(self):
+        async with AsyncHTTPIOFile('http://www.example.com/test/',
+                                   prefetch_head=100, prefetch_tail=1024) as io:
+            self.session.head.assert_not_called()
+            self.assertEqual(io.length, len(DATA))
+            self.assertEqual(await io.read(100), DATA[:100])
+            await io.seek(-1000, SEEK_END)
+            self.assertEqual(await io.read(), DATA[-1000:])
+            self.assertEqual(self.session.get.call_count, 2)
+
+    @async_test
+    async def test_trailer_of_lazy_file_takes_one_request(self):
+        async with AsyncHTTPIOFile('http://www.example.com/test/', lazy=True,
+                                   tail_size=1024) as io:
+            self.assertEqual(await io.seek(-22, SEEK_END), len(DATA) - 22)
+            self.assertEqual(await io.read(22), DATA[-22:])
+            await io.seek(-1000, SEEK_END)
+            self.assertEqual(await io.read(10), DATA[-1000:-990])
+            self.assertEqual(self.session.get.call_count, 1)
+            self.assertEqual(self.session.get.call_args[1]['headers']['Range'], 'bytes=-1024')
+
+    @async_test
+    async def test_iter_chunks_streams_in_one_request(self):
+        async with AsyncHTTPIOFile('http://www.example.com/test/', 1024) as io:
+            chunks = [chunk async for chunk in io.iter_chunks(0, 10000, chunk_size=1000)]
+            self.assertEqual(b''.join(chunks), DATA[:10000])
+            self.assertEqual(await io.tell(), 10000)
+            self.session.get.assert_called_once()
+
+            self.session.reset_mock()
+            await io.seek(0)
+            self.assertEqual(await io.read(9216), DATA[:9216])
+            self.session.get.assert_not_called()
+
+    @async_test
+    async def test_concurrent_fetches_split_large_reads(self):
+        async with AsyncHTTPIOFile('http://www.example.com/test/', 64*1024,
+                                   concurrency=4) as io:
+            self.assertEqual(await io.read(4*1024*1024), DATA[:4*1024*1024])
+            ranges = sorted(call[1]['headers']['Range']
+                            for call in self.session.get.call_args_list)
+            self.assertEqual(ranges, ['bytes=0-1048575', 'bytes=1048576-2097151',
+                                      'bytes=2097152-3145727', 'bytes=3145728-4194303'])
+
+    @async_test
+    async def test_small_reads_are_not_split(self):
+        async with AsyncHTTPIOFile('http://www.example.com/test/', 4096,
+                                   concurrency=8, readahead=16) as io:
+            self.assertEqual(await io.read(32768), DATA[:32768])
+            await asyncio.sleep(0)
+            ranges = [call[1]['headers']['Range']
+                      for call in self.session.get.call_args_list]
+            self.assertEqual(ranges, ['bytes=0-32767', 'bytes=32768-98303'])
+
+    @async_test
+    async def test_pread_leaves_position_alone(self):
+        async with AsyncHTTPIOFile('http://www.example.com/test/', 1024) as io:
+            await io.seek(10)
+            self.assertEqual(await io.pread(1000, 100), DATA[1000:1100])
+            b = bytearray(100)
+            self.assertEqual(await io.preadinto(b, len(DATA) - 50), 50)
+            self.assertEqual(bytes(b[:50]), DATA[-50:])
+            self.assertEqual(await io.tell(), 10)
+
+    @async_test
+    async def test_concurrent_readers_share_fetches(self):
+        async with AsyncHTTPIOFile('http://www.example.com/test/', 1024) as io:
+            results = await asyncio.gather(*[io.pread(512, 1024) for _ in range(8)])
+            self.assertEqual(results, [DATA[512:1536]] * 8)
+            self.assertEqual(self.session.get.call_count, 1)
+
+        async with AsyncHTTPIOFile('http://www.example.com/test/') as io:
+            results = await asyncio.gather(io.pread(0, 2048), io.pread(100, 100),
+                                           io.read(1024))
+            self.assertEqual(results, [DATA[:2048], DATA[100:200], DATA[:1024]])
+            self.assertEqual(self.session.get.call_count, 2)
+
+    @async_test
+    async def test_failed_readahead_is_fetched_again(self):
+        _get = self.session.get.side_effect
+
+        def get(*args, **kwargs):
+            if self.session.get.call_count == 2:
+                raise HTTPException()
+            return _get(*args, **kwargs)
+        self.session.get.side_effect = get
+
+        async with AsyncHTTPIOFile('http://www.example.com/test/', 1024,
+                                   readahead=4) as io:
+            self.assertEqual(await io.read(1024), DATA[:1024])
+            self.assertEqual(await io.read(1024), DATA[1024:2048])
+            ranges = [call[1]['headers']['Range']
+                      for call in self.session.get.call_args_list]
+            self.assertEqual(ranges[:3], ['bytes=0-1023', 'bytes=1024-3071',
+                                          'bytes=1024-2047'])
+
+    @async_test
+    async def test_readahead_fetches_following_blocks(self):
+        async with AsyncHTTPIOFile('http://www.example.com/test/', 1024,
+                                   readahead=8) as io:
+            self.assertEqual(await io.read(1024), DATA[:1024])
+            self.assertEqual(await io.read(1024), DATA[1024:2048])
+            self.assertEqual(await io.read(2048), DATA[2048:4096])
+            self.assertEqual(io._readahead_window, 8)
+
+            ranges = [call[1]['headers']['Range']
+                      for call in self.session.get.call_args_list]
+            self.assertEqual(ranges[:2], ['bytes=0-1023', 'bytes=1024-3071'])
+            self.assertNotIn('bytes=1024-2047', ranges)
+            self.assertNotIn('bytes=2048-4095', ranges)
+
+    @async_test
+    async def test_read_ranges(self):
+        async with HTTPIOFile('http://www.example.com/test/') as io:
+            await io.seek(5)
+            data = await io.read_ranges([(100, 10), (0, 10), (1000000, 5), (50, 0)])
+            self.assertEqual(data, [DATA[100:110], DATA[0:10],
+                                    DATA[1000000:1000005], b''])
+            self.assertEqual(await io.tell(), 5)
+            self.assertEqual(self.session.get.call_count, 2)
+
+    @async_test
+    async def test_read_ranges_negative_length_is_empty(self):
+        for block_size in (-1, 1024):
+            async with AsyncHTTPIOFile('http://www.example.com/test/', block_size) as io:
+                self.assertEqual(await io.read_ranges([(10, -5)]), [b''])
+                self.assertEqual(await io.read_ranges([(10, -5), (0, 10)]),
+                                 [b'', DATA[:10]])
+
+    @async_test
+    async def test_read_ranges_fills_cache(self):
+        async with HTTPIOFile('http://www.example.com/test/', 1024) as io:
+            data = await io.read_ranges([(500, 1000), (3000, 100), (100000, 10)],
+                                        max_gap=2048)
+            self.assertEqual(data, [DATA[500:1500], DATA[3000:3100],
+                                    DATA[100000:100010]])
+            ranges = sorted(call[1]['headers']['Range']
+                            for call in self.session.get.call_args_list)
+            self.assertEqual(ranges, ['bytes=0-4095', 'bytes=99328-100351'])
+
+            self.session.reset_mock()
+            await io.seek(99500)
+            self.assertEqual(await io.read(500), DATA[99500:100000])
+            self.session.get.assert_not_called()
+
+    @async_test
+    async def test_multipart_fetches_gaps_in_one_request(self):
+        self.multipart = True
+        async with AsyncHTTPIOFile('http://www.example.com/test/', 1024,
+                                   multipart=True) as io:
+            await io.seek(1024)
+            await io.read(1024)
+            await io.seek(3072)
+            await io.read(1024)
+            await io.seek(0)
+
+            self.session.reset_mock()
+            self.assertEqual(await io.read(5120), DATA[:5120])
+            self.session.get.assert_called_once()
+            self.assertEqual(self.session.get.call_args[1]['headers']['Range'],
+                             'bytes=0-1023,2048-3071,4096-5119')
+            self.assertTrue(io._multipart)
+
+    @async_test
+    async def test_multipart_read_ranges_without_caching(self):
+        self.multipart = True
+        async with AsyncHTTPIOFile('http://www.example.com/test/', multipart=True) as io:
+            self.assertEqual(await io.read_ranges([(0, 100), (1000000, 10), (len(DATA) - 10, 10)]),
+                             [DATA[:100], DATA[1000000:1000010], DATA[-10:]])
+            self.session.get.assert_called_once()
+            self.assertEqual(self.session.get.call_args[1]['headers']['Range'],
+                             'bytes=0-99,1000000-1000009,%d-%d' % (len(DATA) - 10, len(DATA) - 1))
+
+        stats = IOStats()
+        self.multipart = False
+        async with AsyncHTTPIOFile('http://www.example.com/test/', multipart=True,
+                                   stats=stats) as io:
+            self.assertEqual(await io.read_ranges([(0, 100), (len(DATA) - 100, 100)]),
+                             [DATA[:100], DATA[-100:]])
+            self.assertFalse(io._multipart)
+        self.assertEqual(stats.bytes_fetched, 200)
+
+    @async_test
+    async def test_multipart_falls_back_when_unsupported(self):
+        async with AsyncHTTPIOFile('http://www.example.com/test/', 1024,
+                                   multipart=True) as io:
+            await io.seek(1024)
+            await io.read(1024)
+            await io.seek(0)
+            self.assertEqual(await io.read(3072), DATA[:3072])
+            self.assertFalse(io._multipart)
+
+    @async_test
+    async def test_multipart_fallback_does_not_read_whole_resource(self):
+        stats = IOStats()
+        async with AsyncHTTPIOFile('http://www.example.com/test/', 1024, multipart=True,
+                                   stats=stats) as io:
+            self.assertEqual(await io.read_ranges([(0, 100), (len(DATA) - 100, 100)]),
+                             [DATA[:100], DATA[-100:]])
+            self.assertFalse(io._multipart)
+        self.assertEqual(stats.bytes_fetched, 2048)
+
     @async_test
     async def test_readable(self):
         async with HTTPIOFile('http://www.example.com/test/', 1024) as io:
@@ -223,6 +622,15 @@ class TestAsyncHTTPIOFile(TestCase):
             self.assertEqual(await io.readinto(b), len(b))
             self.assertEqual(bytes(b), DATA[:1536])
 
+    @async_test
+    async def test_readinto_without_buffering(self):
+        b = bytearray(1536)
+        async with HTTPIOFile('http://www.example.com/test/') as io:
+            await io.seek(100)
+            self.assertEqual(await io.readinto(b), len(b))
+            self.assertEqual(bytes(b), DATA[100:1636])
+            self.assertEqual(await io.tell(), 1636)
+
     @async_test
     async def test_readinto1(self):
         b = bytearray(len(DATA))
@@ -258,6 +666,31 @@ class TestAsyncHTTPIOFile(TestCase):
             self.assertEqual([line.decode('ascii') async for line in io.readlines()],
                              [line for line in ASCII_LINES])
 
+    @async_test
+    async def test_readline_with_size(self):
+        self.data_source = ASCII_DATA
+        async with HTTPIOFile('http://www.example.com/test/', 4) as io:
+            self.assertEqual(await io.readline(3), b'Lin')
+            self.assertEqual(await io.readline(), b'e0\n')
+            self.assertEqual(await io.read(4), b'Line')
+            self.assertEqual(await io.readline(), b' the first\n')
+            self.assertEqual(await io.tell(), len(ASCII_LINES[0] + ASCII_LINES[1]))
+
+    @async_test
+    async def test_readline_fetches_incrementally(self):
+        self.data_source = b'x' * 100000 + b'\n' + DATA
+        async with HTTPIOFile('http://www.example.com/test/') as io:
+            self.assertEqual(await io.readline(), b'x' * 100000 + b'\n')
+            ranges = [call[1]['headers']['Range'] for call in self.session.get.call_args_list]
+            self.assertEqual(ranges, ['bytes=0-65535', 'bytes=65536-131071'])
+
+    @async_test
+    async def test_readlines_with_hint(self):
+        self.data_source = ASCII_DATA
+        async with HTTPIOFile('http://www.example.com/test/', 1024) as io:
+            self.assertEqual([line async for line in io.readlines(7)],
+                             [line.encode('ascii') for line in ASCII_LINES[:2]])
+
     @async_test
     async def test_aiter(self):
         self.data_source = ASCII_DATA
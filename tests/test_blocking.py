@@ -0,0 +1,92 @@
+import io
+import random
+import threading
+import unittest
+import zipfile
+from unittest import TestCase
+
+from httpio import HTTPIOError, IOStats, SharedBlockCache
+from httpio_async.blocking import BlockingHTTPIOFile, EventLoopThread
+
+from rangeserver import RangeServer
+
+
+DATA = bytes(random.randint(0, 0xFF) for _ in range(0, 64*1024))
+
+
+def make_zip():
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_STORED) as zf:
+        for n in range(20):
+            zf.writestr('member%02d.bin' % n, DATA[n * 1000:(n + 1) * 1000])
+    return archive.getvalue()
+
+
+class TestBlockingHTTPIOFile(TestCase):
+    def setUp(self):
+        self.server = RangeServer(DATA).__enter__()
+        self.loop = EventLoopThread()
+
+    def tearDown(self):
+        self.loop.close()
+        self.server.__exit__()
+
+    def test_read_seek_and_tell(self):
+        with BlockingHTTPIOFile(self.server.url, 1024, loop=self.loop) as f:
+            self.assertEqual(f.length, len(DATA))
+            self.assertEqual(f.read(1500), DATA[:1500])
+            self.assertEqual(f.tell(), 1500)
+            self.assertEqual(f.seek(-100, 2), len(DATA) - 100)
+            self.assertEqual(f.read(), DATA[-100:])
+            buf = bytearray(100)
+            self.assertEqual(f.preadinto(buf, 5000), 100)
+            self.assertEqual(bytes(buf), DATA[5000:5100])
+            self.assertEqual(f.read_ranges([(0, 10), (2000, 10)]),
+                             [DATA[:10], DATA[2000:2010]])
+        self.assertTrue(f.closed)
+        with self.assertRaises(HTTPIOError):
+            f.read(10)
+
+    def test_zipfile(self):
+        self.server.data = make_zip()
+        with BlockingHTTPIOFile(self.server.url, 4096, loop=self.loop) as f:
+            with zipfile.ZipFile(f) as zf:
+                self.assertEqual(len(zf.namelist()), 20)
+                self.assertEqual(zf.read('member03.bin'), DATA[3000:4000])
+
+    def test_files_share_session_and_cache(self):
+        cache = SharedBlockCache()
+        stats = IOStats()
+        with BlockingHTTPIOFile(self.server.url, 1024, loop=self.loop, cache=cache,
+                                stats=stats) as f:
+            f.read(4096)
+            with BlockingHTTPIOFile(self.server.url, 1024, loop=self.loop, cache=cache,
+                                    stats=stats) as g:
+                self.assertIs(f._file._session, g._file._session)
+                self.assertEqual(g.read(4096), DATA[:4096])
+        self.assertEqual(stats.requests, 3)
+        self.assertEqual(stats.cache_hits, 4)
+
+    def test_multipart_read_ranges(self):
+        with BlockingHTTPIOFile(self.server.url, 1024, loop=self.loop, multipart=True) as f:
+            self.assertEqual(f.read_ranges([(0, 10), (20000, 10), (40000, 10)]),
+                             [DATA[:10], DATA[20000:20010], DATA[40000:40010]])
+        self.assertEqual(self.server.requests[1:],
+                         [('GET', 'bytes=0-1023,19456-20479,39936-40959')])
+
+    def test_concurrent_preads(self):
+        results = {}
+        with BlockingHTTPIOFile(self.server.url, 1024, loop=self.loop, concurrency=4) as f:
+            def reader(n):
+                results[n] = f.pread(n * 4000, 4000)
+            threads = [threading.Thread(target=reader, args=(n,)) for n in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        for n in range(8):
+            self.assertEqual(results[n], DATA[n * 4000:(n + 1) * 4000])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,317 @@
+from __future__ import absolute_import
+
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+
+from httpio import (BlockCache, LRUBlockCache, SharedBlockCache, ArenaBlockCache,
+                    DiskBlockCache)
+from httpio.cache import _IntervalSet, _RunMap
+
+
+class TestIntervalSet(TestCase):
+    def test_add_merges_neighbours(self):
+        s = _IntervalSet()
+        for n in [5, 3, 4, 9, 0]:
+            s.add(n)
+        s.add(4)
+        self.assertEqual(list(s), [0, 3, 4, 5, 9])
+        self.assertEqual(len(s), 5)
+        self.assertEqual((s._starts, s._ends), ([0, 3, 9], [1, 6, 10]))
+
+    def test_discard_splits_intervals(self):
+        s = _IntervalSet()
+        for n in range(10):
+            s.add(n)
+        s.discard(4)
+        s.discard(0)
+        s.discard(9)
+        s.discard(20)
+        self.assertEqual((s._starts, s._ends), ([1, 5], [4, 9]))
+        self.assertNotIn(4, s)
+        self.assertIn(5, s)
+        self.assertEqual(len(s), 7)
+
+    def test_missing(self):
+        s = _IntervalSet()
+        for n in [2, 3, 6, 10]:
+            s.add(n)
+        self.assertEqual(s.missing(0, 12), [(0, 2), (4, 6), (7, 10), (11, 12)])
+        self.assertEqual(s.missing(3, 7), [(4, 6)])
+        self.assertEqual(s.missing(2, 4), [])
+        self.assertEqual(_IntervalSet().missing(1, 3), [(1, 3)])
+
+
+class TestRunMap(TestCase):
+    def test_get_and_overlapping(self):
+        m = _RunMap()
+        m.assign(10, 20, 'a')
+        m.assign(0, 5, 'b')
+        self.assertEqual((m.get(4), m.get(5), m.get(19), m.get(20)), ('b', None, 'a', None))
+        self.assertEqual(m.overlapping(3, 15), [(3, 5, 'b'), (10, 15, 'a')])
+        self.assertEqual(m.missing(0, 25), [(5, 10), (20, 25)])
+        self.assertEqual(m.values(), {'a', 'b'})
+
+    def test_assign_replaces_overlaps(self):
+        m = _RunMap()
+        m.assign(0, 10, 'a')
+        m.assign(3, 6, 'b')
+        self.assertEqual(list(m), [(0, 3, 'a'), (3, 6, 'b'), (6, 10, 'a')])
+
+    def test_discard(self):
+        m = _RunMap()
+        m.assign(0, 10, 'a')
+        m.assign(10, 20, 'b')
+        m.discard(5, 15, 'b')
+        self.assertEqual(list(m), [(0, 10, 'a'), (15, 20, 'b')])
+        m.discard(5, 18)
+        self.assertEqual(list(m), [(0, 5, 'a'), (18, 20, 'b')])
+        m.clear()
+        self.assertEqual(len(m), 0)
+
+
+class TestBlockCache(TestCase):
+    def test_get_and_put(self):
+        cache = BlockCache()
+        self.assertIsNone(cache.get(0))
+        cache.put(0, b'abcd')
+        self.assertEqual(cache.get(0), b'abcd')
+        self.assertIn(0, cache)
+        self.assertEqual(cache.size, 4)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_replace_updates_size(self):
+        cache = BlockCache()
+        cache.put(0, b'abcd')
+        cache.put(0, b'ab')
+        self.assertEqual(cache.size, 2)
+        self.assertEqual(len(cache), 1)
+
+    def test_clear(self):
+        cache = BlockCache()
+        cache.put(0, b'abcd')
+        cache.clear()
+        self.assertNotIn(0, cache)
+        self.assertEqual(cache.size, 0)
+
+    def test_missing(self):
+        cache = BlockCache()
+        cache.put(1, b'abcd')
+        cache.put(2, b'efgh')
+        self.assertEqual(cache.missing(0, 5), [(0, 1), (3, 5)])
+        self.assertEqual(cache.misses, 3)
+        self.assertEqual(cache.missing(0, 5, record=False), [(0, 1), (3, 5)])
+        self.assertEqual(cache.misses, 3)
+
+
+class TestLRUBlockCache(TestCase):
+    def test_max_blocks(self):
+        cache = LRUBlockCache(max_blocks=2)
+        cache.put(0, b'a')
+        cache.put(1, b'b')
+        cache.get(0)
+        cache.put(2, b'c')
+        self.assertIn(0, cache)
+        self.assertNotIn(1, cache)
+        self.assertIn(2, cache)
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(cache.missing(0, 3), [(1, 2)])
+
+    def test_max_bytes(self):
+        cache = LRUBlockCache(max_bytes=8)
+        cache.put(0, b'aaaa')
+        cache.put(1, b'bbbb')
+        cache.put(2, b'cccc')
+        self.assertEqual(sorted(cache._blocks), [1, 2])
+        self.assertEqual(cache.size, 8)
+
+    def test_views_are_copied(self):
+        slab = memoryview(bytearray(b'abcdefgh'))
+        cache = LRUBlockCache(max_bytes=4)
+        cache.put(0, slab[:4])
+        self.assertEqual(cache.get(0), b'abcd')
+        self.assertNotIsInstance(cache.get(0), memoryview)
+
+    def test_oversized_block_is_not_stored(self):
+        cache = LRUBlockCache(max_bytes=2)
+        cache.put(0, b'a')
+        cache.put(1, b'bbbb')
+        self.assertIn(0, cache)
+        self.assertNotIn(1, cache)
+        self.assertEqual(cache.evictions, 0)
+
+
+class TestSharedBlockCache(TestCase):
+    def test_views_with_same_validator_share_blocks(self):
+        cache = SharedBlockCache()
+        a = cache.bind('http://a/', '"v1"', 1024)
+        b = cache.bind('http://a/', '"v1"', 1024)
+        a.put(0, b'abcd')
+        self.assertEqual(b.get(0), b'abcd')
+        self.assertEqual((b.hits, b.misses), (1, 0))
+
+    def test_views_are_keyed_by_url_validator_and_block_size(self):
+        cache = SharedBlockCache()
+        cache.bind('http://a/', '"v1"', 1024).put(0, b'abcd')
+        self.assertIsNone(cache.bind('http://b/', '"v1"', 1024).get(0))
+        self.assertIsNone(cache.bind('http://a/', '"v2"', 1024).get(0))
+        self.assertIsNone(cache.bind('http://a/', '"v1"', 512).get(0))
+
+    def test_close_keeps_shared_blocks(self):
+        cache = SharedBlockCache()
+        view = cache.bind('http://a/', '"v1"', 1024)
+        view.put(0, b'abcd')
+        view.close()
+        self.assertIn(0, cache.bind('http://a/', '"v1"', 1024))
+
+    def test_views_without_validator_are_private(self):
+        cache = SharedBlockCache()
+        a = cache.bind('http://a/', None, 1024)
+        b = cache.bind('http://a/', None, 1024)
+        a.put(0, b'abcd')
+        self.assertNotIn(0, b)
+        a.close()
+        self.assertEqual(cache.size, 0)
+
+    def test_clear_drops_only_own_blocks(self):
+        cache = SharedBlockCache()
+        a = cache.bind('http://a/', '"v1"', 1024)
+        b = cache.bind('http://b/', '"v1"', 1024)
+        a.put(0, b'abcd')
+        b.put(0, b'efgh')
+        self.assertEqual(b.missing(0, 2), [(1, 2)])
+        a.clear()
+        self.assertEqual((len(a), len(b)), (0, 1))
+        self.assertEqual(cache.size, 4)
+        self.assertEqual(a.missing(0, 2), [(0, 2)])
+
+    def test_budget_is_global(self):
+        cache = SharedBlockCache(max_bytes=8)
+        a = cache.bind('http://a/', '"v1"', 1024)
+        b = cache.bind('http://b/', '"v1"', 1024)
+        a.put(0, b'aaaa')
+        b.put(0, b'bbbb')
+        b.put(1, b'cccc')
+        self.assertEqual((len(a), len(b)), (0, 2))
+        self.assertEqual(cache.evictions, 1)
+
+
+class TestArenaBlockCache(TestCase):
+    def test_get_and_put(self):
+        cache = ArenaBlockCache(16).bind('http://a/', None, 4, 10)
+        self.assertIsNone(cache.get(0))
+        cache.put(0, b'abcd')
+        cache.put(2, b'ij')
+        self.assertEqual(cache.get(0), b'abcd')
+        self.assertEqual(cache.get(2), b'ij')
+        self.assertEqual(bytes(cache.view(2)), b'ij')
+        self.assertEqual(cache.size, 6)
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+    def test_arena_is_sized_by_file_length(self):
+        cache = ArenaBlockCache(1024).bind('http://a/', None, 4, 10)
+        self.assertEqual(len(cache._arena), 12)
+
+    def test_clock_eviction(self):
+        cache = ArenaBlockCache(8).bind('http://a/', None, 4)
+        cache.put(0, b'aaaa')
+        cache.put(1, b'bbbb')
+        cache.put(2, b'cccc')
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(len(cache), 2)
+        self.assertIn(2, cache)
+        self.assertEqual(cache.missing(0, 3), [(0, 1)])
+
+        # A block referenced since the last sweep gets a second chance
+        cache.get(2)
+        cache.put(3, b'dddd')
+        self.assertIn(2, cache)
+        self.assertIn(3, cache)
+        self.assertEqual(cache.get(2), b'cccc')
+        self.assertEqual(cache.get(3), b'dddd')
+
+    def test_replace_block(self):
+        cache = ArenaBlockCache(8).bind('http://a/', None, 4)
+        cache.put(0, b'aaaa')
+        cache.put(0, b'bb')
+        self.assertEqual(cache.get(0), b'bb')
+        self.assertEqual((len(cache), cache.size), (1, 2))
+
+    def test_clear_and_close(self):
+        cache = ArenaBlockCache(8).bind('http://a/', None, 4)
+        cache.put(0, b'aaaa')
+        cache.clear()
+        self.assertNotIn(0, cache)
+        cache.put(1, b'bbbb')
+        self.assertEqual(cache.get(1), b'bbbb')
+        cache.close()
+        self.assertIsNone(cache.get(1))
+
+    def test_unbuffered_file_gets_no_arena(self):
+        cache = ArenaBlockCache(8)
+        self.assertIsInstance(cache.bind('http://a/', None, -1, 10), BlockCache)
+        self.assertIsNone(cache.block_size)
+
+
+class TestDiskBlockCache(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = DiskBlockCache(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_get_and_put(self):
+        f = self.cache.bind('http://a/', '"v1"', 4, 10)
+        self.assertIsNone(f.get(0))
+        f.put(0, b'abcd')
+        f.put(2, b'ij')
+        self.assertEqual(f.get(0), b'abcd')
+        self.assertEqual(f.get(2), b'ij')
+        self.assertNotIn(1, f)
+        self.assertEqual(len(f), 2)
+        self.assertEqual(f.missing(0, 3), [(1, 2)])
+        f.close()
+
+    def test_blocks_persist_across_bindings(self):
+        f = self.cache.bind('http://a/', '"v1"', 4, 10)
+        f.put(1, b'efgh')
+        f.close()
+
+        f = DiskBlockCache(self.directory).bind('http://a/', '"v1"', 4, 10)
+        self.assertEqual(f.get(1), b'efgh')
+        f.close()
+
+    def test_changed_validator_discards_blocks(self):
+        f = self.cache.bind('http://a/', '"v1"', 4, 10)
+        f.put(1, b'efgh')
+        f.close()
+
+        f = self.cache.bind('http://a/', '"v2"', 4, 10)
+        self.assertNotIn(1, f)
+        f.close()
+
+    def test_clear(self):
+        f = self.cache.bind('http://a/', '"v1"', 4, 10)
+        f.put(1, b'efgh')
+        f.clear()
+        f.close()
+
+        f = self.cache.bind('http://a/', '"v1"', 4, 10)
+        self.assertNotIn(1, f)
+        f.close()
+
+    def test_short_block_is_not_stored(self):
+        f = self.cache.bind('http://a/', '"v1"', 4, 10)
+        f.put(0, b'ab')
+        self.assertNotIn(0, f)
+        f.close()
+
+    def test_no_validator_uses_memory(self):
+        self.assertIsInstance(self.cache.bind('http://a/', None, 4, 10),
+                              BlockCache)
+
+
+if __name__ == "__main__":
+    unittest.main()
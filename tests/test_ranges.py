@@ -0,0 +1,70 @@
+from __future__ import absolute_import
+
+import unittest
+from unittest import TestCase
+
+from httpio.ranges import (MultipartByteranges, coalesce, format_range_header,
+                           multipart_boundary, parse_content_range,
+                           parse_unsatisfied_range)
+
+
+BODY = (b'--XYZ\r\n'
+        b'Content-Type: application/octet-stream\r\n'
+        b'Content-Range: bytes 0-3/100\r\n'
+        b'\r\n'
+        b'abcd\r\n'
+        b'--XYZ\r\n'
+        b'Content-Range: bytes 50-55/100\r\n'
+        b'\r\n'
+        b'--XYZ-\r\n'
+        b'--XYZ--\r\n')
+
+
+class TestRanges(TestCase):
+    def test_coalesce(self):
+        self.assertEqual(coalesce([(10, 20), (0, 5), (22, 30), (40, 50)], 2),
+                         [(0, 5), (10, 30), (40, 50)])
+        self.assertEqual(coalesce([(0, 10), (2, 5)]), [(0, 10)])
+
+    def test_format_range_header(self):
+        self.assertEqual(format_range_header([(0, 10), (20, 21)]),
+                         'bytes=0-9,20-20')
+
+    def test_parse_content_range(self):
+        self.assertEqual(parse_content_range('bytes 10-19/100'), (10, 20, 100))
+        self.assertEqual(parse_content_range('bytes 10-19/*'), (10, 20, None))
+        self.assertIsNone(parse_content_range('bytes */100'))
+        self.assertIsNone(parse_content_range(None))
+
+    def test_parse_unsatisfied_range(self):
+        self.assertEqual(parse_unsatisfied_range('bytes */100'), 100)
+        self.assertIsNone(parse_unsatisfied_range('bytes 10-19/100'))
+        self.assertIsNone(parse_unsatisfied_range(None))
+
+    def test_multipart_boundary(self):
+        self.assertEqual(multipart_boundary('multipart/byteranges; boundary=XYZ'), b'XYZ')
+        self.assertEqual(multipart_boundary('multipart/byteranges; boundary="XYZ"'), b'XYZ')
+        self.assertIsNone(multipart_boundary('application/octet-stream'))
+
+    def test_multipart_parser(self):
+        parser = MultipartByteranges(b'XYZ')
+        self.assertEqual(parser.feed(BODY),
+                         [(0, b'abcd'), (50, b'--XYZ-')])
+        self.assertTrue(parser.done)
+
+    def test_multipart_parser_with_small_chunks(self):
+        parser = MultipartByteranges(b'XYZ')
+        parts = []
+        for i in range(0, len(BODY), 3):
+            parts.extend(parser.feed(BODY[i:i + 3]))
+        self.assertEqual(parts, [(0, b'abcd'), (50, b'--XYZ-')])
+        self.assertTrue(parser.done)
+
+    def test_multipart_part_without_content_range(self):
+        parser = MultipartByteranges(b'XYZ')
+        with self.assertRaises(ValueError):
+            parser.feed(b'--XYZ\r\nContent-Type: text/plain\r\n\r\nabcd\r\n')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+import asyncio
+import random
+import unittest
+from unittest import TestCase
+
+import aiohttp
+import requests
+
+from httpio import HTTPIOFile, Retry
+from httpio.retry import is_retryable
+from httpio_async import AsyncHTTPIOFile
+
+from rangeserver import RangeServer
+
+
+DATA = bytes(random.randint(0, 0xFF) for _ in range(0, 64*1024))
+
+# Retry without waiting, so the tests run quickly
+RETRY = Retry(total=2, backoff=0)
+
+
+def async_test(f):
+    def __inner(*args, **kwargs):
+        asyncio.get_event_loop().run_until_complete(f(*args, **kwargs))
+    return __inner
+
+
+class TestRetry(TestCase):
+    def test_from_value(self):
+        self.assertEqual(Retry.from_value(None).total, 0)
+        self.assertEqual(Retry.from_value(4).total, 4)
+        self.assertIs(Retry.from_value(RETRY), RETRY)
+
+    def test_delay_grows_and_is_capped(self):
+        retry = Retry(backoff=1, max_backoff=5)
+        for attempt, limit in [(0, 1), (1, 2), (2, 4), (3, 5), (10, 5)]:
+            for _ in range(20):
+                self.assertTrue(0 <= retry.delay(attempt) <= limit)
+        self.assertEqual(Retry(backoff=0).delay(2, retry_after=3), 3)
+        self.assertEqual(retry.delay(0, retry_after=60), 5)
+
+    def test_is_retryable(self):
+        def http_error(status):
+            response = requests.Response()
+            response.status_code = status
+            return requests.HTTPError(response=response)
+
+        retry = Retry()
+        self.assertTrue(is_retryable(http_error(503), retry))
+        self.assertFalse(is_retryable(http_error(404), retry))
+        self.assertTrue(is_retryable(requests.ConnectionError(), retry))
+        self.assertFalse(is_retryable(ValueError(), retry))
+
+
+class TestSyncRetries(TestCase):
+    def setUp(self):
+        self.server = RangeServer(DATA).__enter__()
+
+    def tearDown(self):
+        self.server.__exit__()
+
+    def test_transient_status_is_retried(self):
+        with HTTPIOFile(self.server.url, retries=RETRY) as io:
+            self.server.faults = [('status', 503), ('status', 502)]
+            self.assertEqual(io.read(1000), DATA[:1000])
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_fatal_status_is_not_retried(self):
+        with HTTPIOFile(self.server.url, retries=RETRY) as io:
+            self.server.faults = [('status', 404)]
+            with self.assertRaises(requests.HTTPError):
+                io.read(1000)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_retries_run_out(self):
+        with HTTPIOFile(self.server.url, 1024, retries=RETRY) as io:
+            self.server.faults = [('status', 503)] * 3
+            with self.assertRaises(requests.HTTPError):
+                io.read(1000)
+
+    def test_no_retries_by_default(self):
+        with HTTPIOFile(self.server.url) as io:
+            self.server.faults = [('status', 503)]
+            with self.assertRaises(requests.HTTPError):
+                io.read(1000)
+
+    def test_truncated_body_is_resumed(self):
+        with HTTPIOFile(self.server.url, 4096, retries=RETRY) as io:
+            self.server.faults = [('truncate', 1000)]
+            self.assertEqual(io.read(8192), DATA[:8192])
+        self.assertEqual(self.server.requests[1:],
+                         [('GET', 'bytes=0-8191'), ('GET', 'bytes=1000-8191')])
+
+    def test_reset_connection_is_retried(self):
+        with HTTPIOFile(self.server.url, retries=RETRY) as io:
+            self.server.faults = [('reset',)]
+            io.seek(5000)
+            self.assertEqual(io.read(1000), DATA[5000:6000])
+
+    def test_open_is_retried(self):
+        self.server.faults = [('status', 503)]
+        with HTTPIOFile(self.server.url, retries=RETRY, lazy=True,
+                        prefetch_tail=100) as io:
+            self.assertEqual(io.length, len(DATA))
+        self.assertEqual(self.server.requests, [('GET', 'bytes=-100')] * 2)
+
+    def test_iter_chunks_resumes(self):
+        with HTTPIOFile(self.server.url, retries=RETRY) as io:
+            self.server.faults = [('truncate', 10000)]
+            self.assertEqual(b''.join(io.iter_chunks(chunk_size=1000)), DATA)
+        self.assertEqual(self.server.requests[-1], ('GET', 'bytes=10000-'))
+
+
+class TestAsyncRetries(TestCase):
+    def setUp(self):
+        self.server = RangeServer(DATA).__enter__()
+
+    def tearDown(self):
+        self.server.__exit__()
+
+    @async_test
+    async def test_transient_status_is_retried(self):
+        async with AsyncHTTPIOFile(self.server.url, 1024, retries=RETRY) as io:
+            self.server.faults = [('status', 503), ('status', 429)]
+            self.assertEqual(await io.read(3000), DATA[:3000])
+
+    @async_test
+    async def test_fatal_status_is_not_retried(self):
+        async with AsyncHTTPIOFile(self.server.url, retries=RETRY) as io:
+            self.server.faults = [('status', 404)]
+            with self.assertRaises(aiohttp.ClientResponseError):
+                await io.read(1000)
+        self.assertEqual(len(self.server.requests), 2)
+
+    @async_test
+    async def test_truncated_body_is_resumed(self):
+        async with AsyncHTTPIOFile(self.server.url, 4096, retries=RETRY) as io:
+            self.server.faults = [('truncate', 1000)]
+            self.assertEqual(await io.read(8192), DATA[:8192])
+        self.assertEqual(self.server.requests[1:],
+                         [('GET', 'bytes=0-8191'), ('GET', 'bytes=1000-8191')])
+
+    @async_test
+    async def test_iter_chunks_resumes(self):
+        async with AsyncHTTPIOFile(self.server.url, retries=RETRY) as io:
+            self.server.faults = [('truncate', 10000)]
+            self.assertEqual(b''.join([chunk async for chunk in io.iter_chunks()]), DATA)
+        self.assertEqual(self.server.requests[-1], ('GET', 'bytes=10000-'))
+
+
+if __name__ == "__main__":
+    unittest.main()
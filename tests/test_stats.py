@@ -0,0 +1,54 @@
+from __future__ import absolute_import
+
+import unittest
+from unittest import TestCase
+
+from httpio import IOStats, LRUBlockCache
+from httpio.stats import LatencyHistogram
+
+
+class TestLatencyHistogram(TestCase):
+    def test_buckets_and_percentiles(self):
+        histogram = LatencyHistogram()
+        for seconds in [0.0005, 0.003, 0.003, 0.003, 0.1]:
+            histogram.add(seconds)
+        self.assertEqual(histogram.count, 5)
+        self.assertAlmostEqual(histogram.mean, 0.1095 / 5)
+        self.assertEqual(histogram.percentile(10), 0.001)
+        self.assertEqual(histogram.percentile(50), 0.004)
+        self.assertEqual(histogram.percentile(99), 0.1)
+        self.assertEqual(histogram.as_dict()['buckets'],
+                         [(0.001, 1), (0.004, 3), (0.128, 1)])
+
+    def test_empty(self):
+        self.assertEqual(LatencyHistogram().percentile(50), 0.0)
+        self.assertEqual(LatencyHistogram().mean, 0.0)
+
+
+class TestIOStats(TestCase):
+    def test_request_timing(self):
+        ended = []
+        stats = IOStats(on_request_end=lambda *args: ended.append(args))
+        with stats.request('http://a/', 'bytes=0-9') as request:
+            request.first_byte()
+            request.received(10)
+        with self.assertRaises(ValueError):
+            with stats.request('http://a/', 'bytes=10-19'):
+                raise ValueError()
+        self.assertEqual((stats.requests, stats.failed_requests, stats.bytes_fetched),
+                         (2, 1, 10))
+        self.assertLessEqual(stats.ttfb.total, stats.latency.total)
+        self.assertEqual([args[2] for args in ended], [10, 0])
+        self.assertIsInstance(ended[1][5], ValueError)
+
+    def test_cache_evictions_come_from_the_cache(self):
+        stats = IOStats()
+        self.assertEqual(stats.cache_evictions, 0)
+        stats.cache = LRUBlockCache(max_blocks=1)
+        stats.cache.put(0, b'a')
+        stats.cache.put(1, b'b')
+        self.assertEqual(stats.as_dict()['cache_evictions'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
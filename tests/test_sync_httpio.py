@@ -4,13 +4,26 @@ from __future__ import absolute_import
 import unittest
 from unittest import TestCase
 
-from httpio import HTTPIOFile
-from io import BufferedIOBase, UnsupportedOperation
+from httpio import (HTTPIOFile, LRUBlockCache, SharedBlockCache, ArenaBlockCache,
+                    DiskBlockCache, IOStats, make_session)
+from io import BufferedIOBase, BytesIO, UnsupportedOperation
 from io import SEEK_CUR, SEEK_END
 
+import gc
+import httpio
 import mock
 import random
 import re
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
 
 from six import int2byte, PY3
 
@@ -33,6 +46,22 @@ ASCII_DATA = b''.join(line.encode('ascii') for line in ASCII_LINES)
 IOBaseError = OSError if PY3 else IOError
 
 
+def multipart_body(data, spans, boundary):
+    body = b''
+    for start, end in spans:
+        body += (b'--' + boundary + b'\r\n' +
+                 b'Content-Type: application/octet-stream\r\n' +
+                 ('Content-Range: bytes %d-%d/%d\r\n\r\n' % (
+                     start, end - 1, len(data))).encode('ascii') +
+                 data[start:end] + b'\r\n')
+    return body + b'--' + boundary + b'--\r\n'
+
+
+def iter_chunks(data, chunk_size=1000):
+    return iter([data[i:i + chunk_size]
+                 for i in range(0, len(data), chunk_size)])
+
+
 class HTTPException(Exception):
     pass
 
@@ -51,14 +80,18 @@ class TestHTTPIOFile(TestCase):
 
         self.data_source = DATA
         self.error_code = None
+        self.etag = None
+        self.multipart = False
+        self.get_delay = 0
 
         def _head(url, **kwargs):
             if self.error_code is None:
+                headers = {'Content-Length': len(self.data_source),
+                           'Accept-Ranges': 'bytes'}
+                if self.etag is not None:
+                    headers['ETag'] = self.etag
                 return mock.MagicMock(status_code=204,
-                                      headers={'Content-Length':
-                                               len(self.data_source),
-                                               'Accept-Ranges':
-                                               'bytes'})
+                                      headers=headers)
             else:
                 return mock.MagicMock(status_code=self.error_code,
                                       raise_for_status=mock.MagicMock(
@@ -67,22 +100,41 @@ class TestHTTPIOFile(TestCase):
         self.session.head.side_effect = _head
 
         def _get(url, **kwargs):
+            time.sleep(self.get_delay)
             (start, end) = (None, None)
             if 'headers' in kwargs:
                 if 'Range' in kwargs['headers']:
-                    m = re.match(r'bytes=(\d+)-(\d+)',
+                    m = re.match(r'bytes=(\d*)-(\d*)$',
                                  kwargs['headers']['Range'])
-                    if m:
+                    if m and not m.group(1):
+                        # A suffix range
+                        start = max(0, len(self.data_source) - int(m.group(2)))
+                        end = len(self.data_source)
+                    elif m:
                         start = int(m.group(1))
-                        end = int(m.group(2)) + 1
+                        end = int(m.group(2) or len(self.data_source) - 1) + 1
+                        end = min(end, len(self.data_source))
 
             if self.error_code is not None:
                 return mock.MagicMock(status_code=self.error_code,
                                       raise_for_status=mock.MagicMock(
                                           side_effect=HTTPException))
+            elif ',' in kwargs.get('headers', {}).get('Range', ''):
+                return self._multi_range_response(kwargs['headers']['Range'])
+            elif start is not None and start >= len(self.data_source):
+                return mock.MagicMock(status_code=416, headers={
+                    'Content-Range': 'bytes */%d' % len(self.data_source)})
             else:
-                return mock.MagicMock(status_code=200,
-                                      content=self.data_source[start:end])
+                headers = {}
+                if start is not None:
+                    headers['Content-Range'] = 'bytes %d-%d/%d' % (
+                        start, end - 1, len(self.data_source))
+                if self.etag is not None:
+                    headers['ETag'] = self.etag
+                body = self.data_source[start:end]
+                return mock.MagicMock(status_code=206, headers=headers,
+                                      content=body, raw=BytesIO(body),
+                                      iter_content=lambda size=1: iter_chunks(body, size))
 
         self.session.get.side_effect = _get
 
@@ -90,6 +142,23 @@ class TestHTTPIOFile(TestCase):
         for key in self.patchers:
             self.mocks[key] = self.patchers[key].stop()
 
+    def _multi_range_response(self, header):
+        spans = [(int(start), int(end) + 1)
+                 for start, end in re.findall(r'(\d+)-(\d+)', header)]
+        if self.multipart:
+            body = multipart_body(self.data_source, spans, b'BOUNDARY')
+            headers = {'Content-Type':
+                       'multipart/byteranges; boundary=BOUNDARY'}
+            status_code = 206
+        else:
+            body = self.data_source
+            headers = {}
+            status_code = 200
+        return mock.MagicMock(
+            status_code=status_code,
+            headers=headers,
+            iter_content=lambda chunk_size: iter_chunks(body))
+
     def test_throws_exception_when_head_returns_error(self):
         self.error_code = 404
         with self.assertRaises(HTTPException):
@@ -159,6 +228,84 @@ class TestHTTPIOFile(TestCase):
                 io.read(1024)
             self.assertEqual(io.tell(), 0)
 
+    def test_stats_count_requests_bytes_and_lookups(self):
+        misses = []
+        stats = IOStats(on_cache_miss=lambda url, start, stop: misses.append((start, stop)))
+        with HTTPIOFile('http://www.example.com/test/', 1024, stats=stats) as io:
+            self.assertIs(io.stats, stats)
+            io.read(1500)
+            io.seek(0)
+            io.read(100)
+        self.assertEqual((stats.requests, stats.bytes_fetched, stats.bytes_returned),
+                         (2, 2048, 1600))
+        self.assertEqual((stats.cache_hits, stats.cache_misses), (1, 2))
+        self.assertEqual(misses, [(0, 2)])
+        self.assertEqual(stats.latency.count, 2)
+        self.assertEqual(stats.as_dict()['ttfb']['count'], 2)
+
+    def test_adaptive_fetches_grow_with_sequential_reads(self):
+        headers = []
+        stats = IOStats(on_request_start=lambda url, header: headers.append(header))
+        with HTTPIOFile('http://www.example.com/test/', 1024, stats=stats,
+                        adaptive=True) as io:
+            for n in range(10):
+                self.assertEqual(io.read(1024), DATA[n * 1024:(n + 1) * 1024])
+        self.assertEqual(headers, [None, 'bytes=0-1023', 'bytes=1024-2047',
+                                   'bytes=2048-8191', 'bytes=8192-26623'])
+
+    def test_adaptive_random_reads_fetch_only_their_blocks(self):
+        headers = []
+        stats = IOStats(on_request_start=lambda url, header: headers.append(header))
+        with HTTPIOFile('http://www.example.com/test/', 1024, stats=stats,
+                        adaptive=True) as io:
+            for offset in [50000, 10000, 90000, 30000]:
+                io.seek(offset)
+                self.assertEqual(io.read(100), DATA[offset:offset + 100])
+        self.assertEqual(headers, [None, 'bytes=49152-50175', 'bytes=9216-10239',
+                                   'bytes=89088-90111', 'bytes=29696-30719'])
+
+    def test_coalesce_keeps_bytes_after_unbuffered_reads(self):
+        headers = []
+        stats = IOStats(on_request_start=lambda url, header: headers.append(header))
+        with HTTPIOFile('http://www.example.com/test/', stats=stats, coalesce=1000) as io:
+            io.seek(5000)
+            self.assertEqual(io.read(10), DATA[5000:5010])
+            io.seek(5300)
+            self.assertEqual(io.read(10), DATA[5300:5310])
+            buf = bytearray(10)
+            self.assertEqual(io.preadinto(buf, 5900), 10)
+            self.assertEqual(bytes(buf), DATA[5900:5910])
+            self.assertEqual(io.pread(6100, 10), DATA[6100:6110])
+        self.assertEqual(headers, [None, 'bytes=5000-6009', 'bytes=6100-7109'])
+
+    def test_coalesce_merges_runs_around_cached_blocks(self):
+        headers = []
+        stats = IOStats(on_request_start=lambda url, header: headers.append(header))
+        with HTTPIOFile('http://www.example.com/test/', 1024, stats=stats,
+                        coalesce=1024) as io:
+            io.seek(1024)
+            io.read(1024)
+            io.seek(0)
+            self.assertEqual(io.read(3072), DATA[:3072])
+        self.assertEqual(headers, [None, 'bytes=1024-2047', 'bytes=0-3071'])
+
+    def test_request_hooks(self):
+        events = []
+        stats = IOStats(
+            on_request_start=lambda url, header: events.append(('start', header)),
+            on_request_end=lambda url, header, nbytes, latency, ttfb, error:
+                events.append(('end', header, nbytes, type(error))))
+        with HTTPIOFile('http://www.example.com/test/', stats=stats) as io:
+            io.read(10)
+            self.error_code = 404
+            with self.assertRaises(HTTPException):
+                io.read(10)
+        self.assertEqual(events, [('start', None), ('end', None, 0, type(None)),
+                                  ('start', 'bytes=0-9'), ('end', 'bytes=0-9', 10, type(None)),
+                                  ('start', 'bytes=10-19'),
+                                  ('end', 'bytes=10-19', 0, HTTPException)])
+        self.assertEqual(stats.failed_requests, 1)
+
     def test_read1(self):
         with HTTPIOFile('http://www.example.com/test/', 1024) as io:
             io.seek(1024)
@@ -178,6 +325,374 @@ class TestHTTPIOFile(TestCase):
 
             self.assertEqual(data, DATA[1536:])
 
+    def test_read_with_bounded_cache(self):
+        cache = LRUBlockCache(max_blocks=2)
+        with HTTPIOFile('http://www.example.com/test/', 1024, cache) as io:
+            io.seek(512)
+            self.assertEqual(io.read(4096), DATA[512:4608])
+            self.assertEqual(len(cache), 2)
+            self.assertEqual(cache.evictions, 3)
+
+            io.seek(3584)
+            self.session.reset_mock()
+            self.assertEqual(io.read(1024), DATA[3584:4608])
+            self.session.get.assert_not_called()
+
+    def test_read_with_arena_cache(self):
+        cache = ArenaBlockCache(4096)
+        with HTTPIOFile('http://www.example.com/test/', 1024, cache) as io:
+            io.seek(512)
+            self.assertEqual(io.read(8192), DATA[512:8704])
+            self.assertEqual(len(cache), 4)
+            io.seek(6000)
+            self.session.reset_mock()
+            self.assertEqual(io.read(1000), DATA[6000:7000])
+            self.session.get.assert_not_called()
+
+    def test_read_without_block_size_ignores_arena_cache(self):
+        with HTTPIOFile('http://www.example.com/test/', cache=ArenaBlockCache(4096)) as io:
+            self.assertEqual(io.read(100), DATA[:100])
+
+    def test_shared_cache_is_shared_between_files(self):
+        cache = SharedBlockCache()
+        self.etag = '"v1"'
+        with HTTPIOFile('http://www.example.com/test/', 1024, cache) as io:
+            self.assertEqual(io.read(2048), DATA[:2048])
+        self.session.reset_mock()
+        with HTTPIOFile('http://www.example.com/test/', 1024, cache) as io:
+            self.assertEqual(io.read(2048), DATA[:2048])
+            self.session.get.assert_not_called()
+
+        self.etag = '"v2"'
+        self.data_source = OTHER_DATA
+        with HTTPIOFile('http://www.example.com/test/', 1024, cache) as io:
+            self.assertEqual(io.read(2048), OTHER_DATA[:2048])
+
+    def test_session_is_shared_between_files(self):
+        session = make_session(pool_maxsize=4)
+        for _ in range(2):
+            with HTTPIOFile('http://www.example.com/test/', 1024,
+                            session=session) as io:
+                self.assertEqual(io.read(1024), DATA[:1024])
+        self.assertEqual(self.mocks['Session'].call_count, 1)
+        self.assertEqual(session.head.call_count, 2)
+        session.close.assert_not_called()
+
+    def test_lazy_open_learns_length_from_first_read(self):
+        self.etag = '"v1"'
+        with HTTPIOFile('http://www.example.com/test/', 1024, lazy=True) as io:
+            self.session.head.assert_not_called()
+            self.assertIsNone(io.length)
+            self.assertEqual(io.read(100), DATA[:100])
+            self.assertEqual(io.length, len(DATA))
+            self.assertEqual(io.validator, '"v1"')
+            self.assertEqual(io.read(924), DATA[100:1024])
+            self.assertEqual(self.session.get.call_count, 1)
+
+    def test_lazy_open_without_cache(self):
+        with HTTPIOFile('http://www.example.com/test/', lazy=True) as io:
+            io.seek(len(DATA) - 10)
+            self.assertEqual(io.read(), DATA[-10:])
+            self.assertEqual(io.length, len(DATA))
+            self.session.head.assert_not_called()
+
+        with HTTPIOFile('http://www.example.com/test/', lazy=True) as io:
+            self.assertEqual(io.seek(-10, SEEK_END), len(DATA) - 10)
+            self.assertEqual(io.read(), DATA[-10:])
+
+    def test_open_passes_options_by_keyword(self):
+        cache = LRUBlockCache()
+        with httpio.open('http://www.example.com/test/', 1024, cache=cache, retries=2,
+                         coalesce=4096) as io:
+            self.assertIs(io._given_cache, cache)
+            self.assertEqual((io.retries.total, io.coalesce), (2, 4096))
+            self.assertEqual(io.read(100), DATA[:100])
+
+    def test_lazy_open_empty_readinto(self):
+        with HTTPIOFile('http://www.example.com/test/', 1024, lazy=True) as io:
+            self.assertEqual(io.readinto(bytearray(0)), 0)
+            self.assertIsNone(io.length)
+            self.session.get.assert_not_called()
+            self.assertEqual(io.read(100), DATA[:100])
+
+    def test_lazy_open_of_empty_file(self):
+        self.data_source = b''
+        with HTTPIOFile('http://www.example.com/test/', lazy=True) as io:
+            self.assertEqual(io.read(), b'')
+            self.assertEqual(io.length, 0)
+
+    def test_known_length_skips_probe(self):
+        with HTTPIOFile('http://www.example.com/test/', 1024,
+                        length=len(DATA), etag='"v1"') as io:
+            self.assertEqual(io.validator, '"v1"')
+            self.assertEqual(io.read(1024), DATA[:1024])
+            self.session.head.assert_not_called()
+            self.assertEqual(self.session.get.call_count, 1)
+
+    def test_prefetch_tail_opens_zip_in_one_request(self):
+        buf = BytesIO()
+        with zipfile.ZipFile(buf, 'w') as z:
+            z.writestr('a.txt', ASCII_DATA)
+        self.data_source = buf.getvalue()
+        with HTTPIOFile('http://www.example.com/test/',
+                        prefetch_tail=64 * 1024) as io:
+            with zipfile.ZipFile(io) as z:
+                self.assertEqual(z.namelist(), ['a.txt'])
+                self.assertEqual(z.read('a.txt'), ASCII_DATA)
+        self.session.head.assert_not_called()
+        self.assertEqual(self.session.get.call_count, 1)
+
+    def test_prefetch_head_and_tail_seed_cache(self):
+        with HTTPIOFile('http://www.example.com/test/', 1024,
+                        prefetch_head=100, prefetch_tail=1500) as io:
+            self.session.head.assert_not_called()
+            self.assertEqual(io.length, len(DATA))
+            self.assertEqual(io.read(1024), DATA[:1024])
+            io.seek(-1024, SEEK_END)
+            self.assertEqual(io.read(), DATA[-1024:])
+            self.assertEqual(self.session.get.call_count, 2)
+
+    def test_trailer_of_lazy_file_takes_one_request(self):
+        with HTTPIOFile('http://www.example.com/test/', lazy=True) as io:
+            self.assertEqual(io.seek(-22, SEEK_END), len(DATA) - 22)
+            self.assertEqual(io.read(22), DATA[-22:])
+            self.assertEqual(self.session.get.call_count, 1)
+            self.assertEqual(
+                self.session.get.call_args[1]['headers']['Range'], 'bytes=-22')
+
+    def test_tail_reads_share_one_suffix_request(self):
+        with HTTPIOFile('http://www.example.com/test/', tail_size=4096) as io:
+            io.seek(-22, SEEK_END)
+            self.assertEqual(io.read(22), DATA[-22:])
+            io.seek(-3000, SEEK_END)
+            self.assertEqual(io.read(100), DATA[-3000:-2900])
+            self.assertEqual(self.session.get.call_count, 1)
+            self.assertEqual(
+                self.session.get.call_args[1]['headers']['Range'], 'bytes=-4096')
+
+    def test_iter_chunks_streams_in_one_request(self):
+        with HTTPIOFile('http://www.example.com/test/', 1024) as io:
+            chunks = list(io.iter_chunks(100, chunk_size=65536))
+            self.assertEqual(b''.join(chunks), DATA[100:])
+            self.assertEqual(io.tell(), len(DATA))
+            self.session.get.assert_called_once()
+            self.assertEqual(self.session.get.call_args[1]['headers']['Range'],
+                             'bytes=100-')
+
+            self.session.reset_mock()
+            io.seek(1024)
+            self.assertEqual(io.read(4096), DATA[1024:5120])
+            self.session.get.assert_not_called()
+
+    def test_iter_chunks_stops_after_seek(self):
+        with HTTPIOFile('http://www.example.com/test/') as io:
+            chunks = io.iter_chunks(0, 10000, chunk_size=1000)
+            self.assertEqual(next(chunks), DATA[:1000])
+            self.assertEqual(io.tell(), 1000)
+            io.seek(0)
+            self.assertEqual(list(chunks), [])
+
+    def test_streaming_keeps_response_open_for_sequential_reads(self):
+        with HTTPIOFile('http://www.example.com/test/', streaming=True) as io:
+            for i in range(3):
+                self.assertEqual(io.read(1000), DATA[i * 1000:(i + 1) * 1000])
+            self.session.get.assert_called_once()
+            self.assertEqual(self.session.get.call_args[1]['headers']['Range'],
+                             'bytes=0-')
+
+            io.seek(5000)
+            self.assertEqual(io.read(100), DATA[5000:5100])
+            self.assertEqual(io.read(100), DATA[5100:5200])
+            ranges = [call[1]['headers']['Range']
+                      for call in self.session.get.call_args_list]
+            self.assertEqual(ranges, ['bytes=0-', 'bytes=5000-5099',
+                                      'bytes=5100-'])
+
+    def test_pread_leaves_position_alone(self):
+        with HTTPIOFile('http://www.example.com/test/', 1024) as io:
+            io.seek(10)
+            self.assertEqual(io.pread(1000, 100), DATA[1000:1100])
+            b = bytearray(100)
+            self.assertEqual(io.preadinto(b, len(DATA) - 50), 50)
+            self.assertEqual(bytes(b[:50]), DATA[-50:])
+            self.assertEqual(io.tell(), 10)
+
+        with HTTPIOFile('http://www.example.com/test/') as io:
+            self.assertEqual(io.pread(1000, 100), DATA[1000:1100])
+            self.assertEqual(io.pread(len(DATA), 100), b'')
+
+    def test_concurrent_preads_share_fetches(self):
+        self.get_delay = 0.2
+        with HTTPIOFile('http://www.example.com/test/', 1024) as io:
+            results = []
+
+            def pread():
+                results.append(io.pread(0, 2048))
+
+            threads = [threading.Thread(target=pread) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(results, [DATA[:2048]] * 8)
+            self.session.get.assert_called_once()
+
+    def test_disk_cache_survives_reopening(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.etag = '"v1"'
+        with HTTPIOFile('http://www.example.com/test/', 1024,
+                        DiskBlockCache(directory)) as io:
+            io.seek(1536)
+            self.assertEqual(io.read(1024), DATA[1536:2560])
+        self.session.reset_mock()
+        with HTTPIOFile('http://www.example.com/test/', 1024,
+                        DiskBlockCache(directory)) as io:
+            io.seek(1024)
+            self.assertEqual(io.read(2048), DATA[1024:3072])
+            self.session.get.assert_not_called()
+
+    def test_readahead_fetches_following_blocks(self):
+        with HTTPIOFile('http://www.example.com/test/', 1024,
+                        readahead=8) as io:
+            self.assertEqual(io.read(1024), DATA[:1024])
+            self.assertEqual(io.read(1024), DATA[1024:2048])
+            self.assertEqual(io.read(2048), DATA[2048:4096])
+            self.assertEqual(io._readahead_window, 8)
+            io._cancel_readahead()
+
+            ranges = [call[1]['headers']['Range']
+                      for call in self.session.get.call_args_list]
+            self.assertEqual(ranges[:2], ['bytes=0-1023', 'bytes=1024-3071'])
+            self.assertNotIn('bytes=1024-2047', ranges)
+            self.assertNotIn('bytes=2048-4095', ranges)
+
+    def test_readahead_ignores_random_reads(self):
+        with HTTPIOFile('http://www.example.com/test/', 1024,
+                        readahead=8) as io:
+            io.seek(4096)
+            self.assertEqual(io.read(1024), DATA[4096:5120])
+            io.seek(1024)
+            self.assertEqual(io.read(1024), DATA[1024:2048])
+            self.assertEqual(self.session.get.call_count, 2)
+
+    def test_read_ranges(self):
+        with HTTPIOFile('http://www.example.com/test/') as io:
+            io.seek(5)
+            data = io.read_ranges([(100, 10), (0, 10), (1000000, 5),
+                                   (len(DATA) - 2, 10), (50, 0)])
+            self.assertEqual(data, [DATA[100:110], DATA[0:10],
+                                    DATA[1000000:1000005], DATA[-2:], b''])
+            self.assertEqual(io.tell(), 5)
+
+            ranges = sorted(call[1]['headers']['Range']
+                            for call in self.session.get.call_args_list)
+            self.assertEqual(ranges, ['bytes=0-109',
+                                      'bytes=1000000-1000004',
+                                      'bytes=%d-%d' % (len(DATA) - 2,
+                                                       len(DATA) - 1)])
+
+    def test_read_ranges_negative_length_is_empty(self):
+        for block_size in (-1, 1024):
+            with HTTPIOFile('http://www.example.com/test/', block_size) as io:
+                self.assertEqual(io.read_ranges([(10, -5)]), [b''])
+                self.assertEqual(io.read_ranges([(10, -5), (0, 10)]), [b'', DATA[:10]])
+
+    def test_read_ranges_fills_cache(self):
+        with HTTPIOFile('http://www.example.com/test/', 1024) as io:
+            io.read(1024)
+            self.session.reset_mock()
+            data = io.read_ranges([(500, 1000), (3000, 100), (100000, 10)],
+                                  max_gap=2048)
+            self.assertEqual(data, [DATA[500:1500], DATA[3000:3100],
+                                    DATA[100000:100010]])
+            ranges = sorted(call[1]['headers']['Range']
+                            for call in self.session.get.call_args_list)
+            self.assertEqual(ranges, ['bytes=1024-4095',
+                                      'bytes=99328-100351'])
+
+            self.session.reset_mock()
+            io.seek(99500)
+            self.assertEqual(io.read(500), DATA[99500:100000])
+            self.session.get.assert_not_called()
+
+    def test_multipart_fetches_gaps_in_one_request(self):
+        self.multipart = True
+        with HTTPIOFile('http://www.example.com/test/', 1024,
+                        multipart=True) as io:
+            io.seek(1024)
+            io.read(1024)
+            io.seek(3072)
+            io.read(1024)
+            io.seek(0)
+
+            self.session.reset_mock()
+            self.assertEqual(io.read(5120), DATA[:5120])
+            self.session.get.assert_called_once()
+            self.assertEqual(
+                self.session.get.call_args[1]['headers']['Range'],
+                'bytes=0-1023,2048-3071,4096-5119')
+            self.assertTrue(io._multipart)
+
+    def test_multipart_read_ranges_without_caching(self):
+        self.multipart = True
+        with HTTPIOFile('http://www.example.com/test/', multipart=True) as io:
+            self.assertEqual(io.read_ranges([(0, 100), (1000000, 10), (len(DATA) - 10, 10)]),
+                             [DATA[:100], DATA[1000000:1000010], DATA[-10:]])
+            self.session.get.assert_called_once()
+            self.assertEqual(
+                self.session.get.call_args[1]['headers']['Range'],
+                'bytes=0-99,1000000-1000009,%d-%d' % (len(DATA) - 10, len(DATA) - 1))
+
+        stats = IOStats()
+        self.multipart = False
+        with HTTPIOFile('http://www.example.com/test/', multipart=True, stats=stats) as io:
+            self.assertEqual(io.read_ranges([(0, 100), (len(DATA) - 100, 100)]),
+                             [DATA[:100], DATA[-100:]])
+            self.assertFalse(io._multipart)
+        self.assertEqual(stats.bytes_fetched, 200)
+
+    def test_multipart_falls_back_when_unsupported(self):
+        with HTTPIOFile('http://www.example.com/test/', 1024,
+                        multipart=True) as io:
+            io.seek(1024)
+            io.read(1024)
+            io.seek(0)
+            self.assertEqual(io.read(3072), DATA[:3072])
+            self.assertFalse(io._multipart)
+
+            io.seek(4096)
+            io.read(1024)
+            io.seek(3072)
+            self.session.reset_mock()
+            self.assertEqual(io.read(3072), DATA[3072:6144])
+            self.assertEqual(self.session.get.call_count, 2)
+
+    @unittest.skipIf(tracemalloc is None, "needs tracemalloc")
+    def test_bounded_cache_bounds_memory(self):
+        cache = LRUBlockCache(max_bytes=64*1024)
+        with HTTPIOFile('http://www.example.com/test/', 4096, cache) as io:
+            tracemalloc.start()
+            try:
+                before = tracemalloc.get_traced_memory()[0]
+                self.assertEqual(len(io.read(4*1024*1024)), 4*1024*1024)
+                # The mock responses hold the body in reference cycles
+                gc.collect()
+                grown = tracemalloc.get_traced_memory()[0] - before
+            finally:
+                tracemalloc.stop()
+            self.assertEqual(cache.size, 64*1024)
+            self.assertLess(grown, 4 * 64*1024)
+
+    def test_multipart_fallback_does_not_read_whole_resource(self):
+        stats = IOStats()
+        with HTTPIOFile('http://www.example.com/test/', 1024, multipart=True,
+                        stats=stats) as io:
+            self.assertEqual(io.read_ranges([(0, 100), (len(DATA) - 100, 100)]),
+                             [DATA[:100], DATA[-100:]])
+            self.assertFalse(io._multipart)
+        self.assertEqual(stats.bytes_fetched, 2048)
+
     def test_readable(self):
         with HTTPIOFile('http://www.example.com/test/', 1024) as io:
             self.assertTrue(io.readable())
@@ -188,6 +703,22 @@ class TestHTTPIOFile(TestCase):
             self.assertEqual(io.readinto(b), len(b))
             self.assertEqual(bytes(b), DATA[:1536])
 
+    def test_readinto_without_buffering(self):
+        b = bytearray(1536)
+        with HTTPIOFile('http://www.example.com/test/') as io:
+            io.seek(100)
+            self.assertEqual(io.readinto(b), len(b))
+            self.assertEqual(bytes(b), DATA[100:1636])
+            self.assertEqual(io.tell(), 1636)
+
+    def test_cache_holds_views_of_fetched_data(self):
+        with HTTPIOFile('http://www.example.com/test/', 1024) as io:
+            io.read(4096)
+            block = io._cache.get(1)
+            self.assertIsInstance(block, memoryview)
+            if PY3:
+                self.assertIs(block.obj, io._cache.get(2).obj)
+
     def test_readinto1(self):
         b = bytearray(len(DATA))
         with HTTPIOFile('http://www.example.com/test/', 1024) as io: